@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
 import argparse
+import functools
 import logging
+import math
+from typing import List
 
 from obfuscapk.main import perform_obfuscation, check_external_tool_dependencies
 from obfuscapk.obfuscator_manager import ObfuscatorManager
@@ -9,6 +12,40 @@ from obfuscapk.obfuscator_manager import ObfuscatorManager
 logger = logging.getLogger(__name__)
 
 
+def capacity_weight(value: str, obfuscators: List[str]):
+    # OBFUSCATOR=WEIGHT -> (OBFUSCATOR, WEIGHT)
+    obfuscator_name, _, weight = value.partition("=")
+    obfuscator_name = obfuscator_name.strip()
+    try:
+        weight = float(weight)
+    except ValueError:
+        weight = 0
+    if not obfuscator_name or not math.isfinite(weight) or weight <= 0:
+        raise argparse.ArgumentTypeError(
+            'Invalid capacity weight "{0}", the expected format is '
+            "OBFUSCATOR=WEIGHT with a finite weight greater than 0".format(value)
+        )
+    if obfuscator_name not in obfuscators:
+        raise argparse.ArgumentTypeError(
+            'Invalid capacity weight "{0}", there is no obfuscator named '
+            '"{1}"'.format(value, obfuscator_name)
+        )
+    return obfuscator_name, weight
+
+
+def cache_size(value: str) -> int:
+    try:
+        size = int(value)
+    except ValueError:
+        size = -1
+    if size < 0:
+        raise argparse.ArgumentTypeError(
+            'Invalid cache size "{0}", the expected value is an integer greater '
+            "than or equal to 0".format(value)
+        )
+    return size
+
+
 def get_cmd_args(args: list = None):
     """
     Parse and return the command line parameters needed for the script execution.
@@ -117,6 +154,79 @@ def get_cmd_args(args: list = None):
         help="The file containing the package names to be ignored during the "
         "obfuscation (one package name per line)",
     )
+    parser.add_argument(
+        "--pack-static-strings",
+        action="store_true",
+        help="When using ConstStringEncryption obfuscator, decrypt all the static "
+        "strings of a class with a single call in the static constructor",
+    )
+    parser.add_argument(
+        "--mapping-file",
+        type=str,
+        metavar="MAPPING_FILE",
+        help="The path where to save the mapping (in ProGuard format) of the renamed "
+        "classes, methods and fields (by default mapping.txt in the working directory, "
+        "only when a rename obfuscator is used)",
+    )
+    parser.add_argument(
+        "--previous-mapping",
+        type=str,
+        metavar="PREVIOUS_MAPPING_FILE",
+        help="The mapping file of a previous obfuscation, the classes, methods and "
+        "fields in this mapping will keep the same names",
+    )
+    parser.add_argument(
+        "--previous-output",
+        type=str,
+        metavar="PREVIOUS_OUTPUT_DIR",
+        help="The directory with the decoded application of the previous obfuscation "
+        "(used with --previous-mapping), the unchanged classes will reuse the previous "
+        "obfuscated code when using only rename obfuscators",
+    )
+    parser.add_argument(
+        "--call-indirection-cache",
+        type=cache_size,
+        metavar="CACHE_SIZE",
+        help="When using CallIndirection obfuscator, reuse the same wrapper method for "
+        "the calls of a class to the same method, keeping at most CACHE_SIZE wrappers "
+        "for reuse in each class (0 for no limit)",
+    )
+    parser.add_argument(
+        "--reflection-set-accessible",
+        action="store_true",
+        help="When using Reflection and AdvancedReflection obfuscators, make the "
+        "reflected methods accessible when they are looked up, so their invocations "
+        "skip the access checks",
+    )
+    parser.add_argument(
+        "--capacity-weight",
+        type=functools.partial(capacity_weight, obfuscators=obfuscators),
+        action="append",
+        metavar="OBFUSCATOR=WEIGHT",
+        help="The weight (1 by default) of an obfuscator adding new methods/fields "
+        "when allocating the capacity still available in each dex file (e.g., "
+        "--capacity-weight CallIndirection=2), can be used multiple times",
+    )
+    parser.add_argument(
+        "--split-dex",
+        action="store_true",
+        help="Move some classes to a new dex file when the obfuscation pushes a dex "
+        "over the 64K method/field limit (the application must support multidex "
+        "natively, minSdkVersion 21 or higher)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Save the time, I/O and memory statistics of each obfuscation step in a "
+        "JSON file next to the obfuscated .apk file (with .stats.json extension)",
+    )
+    parser.add_argument(
+        "--stats-file",
+        type=str,
+        metavar="STATS_FILE",
+        help="Save the time, I/O and memory statistics of each obfuscation step in "
+        "this JSON file",
+    )
     return parser.parse_args(args)
 
 
@@ -168,6 +278,21 @@ def main():
     if arguments.ignore_packages_file:
         arguments.ignore_packages_file = arguments.ignore_packages_file.strip(" '\"")
 
+    if arguments.mapping_file:
+        arguments.mapping_file = arguments.mapping_file.strip(" '\"")
+
+    if arguments.previous_mapping:
+        arguments.previous_mapping = arguments.previous_mapping.strip(" '\"")
+
+    if arguments.previous_output:
+        arguments.previous_output = arguments.previous_output.strip(" '\"")
+
+    if arguments.stats_file:
+        arguments.stats_file = arguments.stats_file.strip(" '\"")
+    elif arguments.stats:
+        # Save the statistics next to the obfuscated application.
+        arguments.stats_file = ""
+
     perform_obfuscation(
         arguments.apk_file,
         arguments.obfuscator,
@@ -182,6 +307,15 @@ def main():
         arguments.key_password,
         arguments.ignore_packages_file,
         arguments.use_aapt2,
+        arguments.pack_static_strings,
+        arguments.mapping_file,
+        arguments.previous_mapping,
+        arguments.previous_output,
+        arguments.call_indirection_cache,
+        arguments.reflection_set_accessible,
+        dict(arguments.capacity_weight) if arguments.capacity_weight else None,
+        arguments.split_dex,
+        arguments.stats_file,
     )
 
 
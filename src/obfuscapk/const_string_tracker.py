@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import re
+from typing import Dict, List, Union
+
+from obfuscapk.smali_lexer import SmaliLineKind, classify_line
+
+
+class ConstStringTracker(object):
+    """
+    Track the constant strings held by the registers of a method, with a single
+    forward pass over the lines of a smali file (call update for each line, in
+    order). Before updating with a line, get_string returns the constant string held
+    by a register when that line is reached (e.g., the name of the asset file passed
+    to an invoke instruction), or None if the value of the register is not a known
+    constant string.
+
+    To be safe, all the registers are forgotten at the start and at the end of each
+    method, at the labels that can be the target of a jump (the registers could hold
+    different values when coming from another instruction) and after the
+    unconditional branches. The labels of the try blocks are not jump targets, so
+    they don't affect the registers.
+    """
+
+    # The labels that are not the target of a jump.
+    try_label_prefixes = (":try_start_", ":try_end_")
+
+    # The instructions after which the next line can't be reached without a jump.
+    unconditional_branch_prefixes = ("goto", "return", "throw")
+
+    # The instructions not writing a value in their first register.
+    non_writing_prefixes = (
+        "nop",
+        "if-",
+        "goto",
+        "return",
+        "throw",
+        "invoke-",
+        "iput",
+        "sput",
+        "aput",
+        "monitor-",
+        "check-cast",
+        "fill-array-data",
+        "filled-new-array",
+        "packed-switch",
+        "sparse-switch",
+    )
+
+    destination_register_pattern = re.compile(r"\s*\S+\s+(?P<register>[vp]\d+)\b")
+
+    def __init__(self):
+        # Register -> constant string (still escaped) held by the register.
+        self._strings: Dict[str, str] = {}
+
+    @staticmethod
+    def _is_wide(opcode: str) -> bool:
+        # The instructions with long or double values write a pair of registers.
+        return "wide" in opcode or opcode.split("/", 1)[0].endswith(
+            ("-long", "-double")
+        )
+
+    def _forget(self, register: str, opcode: str) -> None:
+        self._strings.pop(register, None)
+        if self._is_wide(opcode):
+            next_register = "{0}{1}".format(register[0], int(register[1:]) + 1)
+            self._strings.pop(next_register, None)
+
+    def update(self, line: str) -> None:
+        smali_line = classify_line(line)
+        kind = smali_line.kind
+
+        if kind is SmaliLineKind.CONST_STRING:
+            self._strings[smali_line.registers] = smali_line.literal
+
+        elif not self._strings:
+            # No register to update.
+            return
+
+        elif kind is SmaliLineKind.METHOD or kind is SmaliLineKind.END_METHOD:
+            self._strings.clear()
+
+        elif kind is SmaliLineKind.LABEL:
+            if not line.lstrip().startswith(self.try_label_prefixes):
+                self._strings.clear()
+
+        elif kind is SmaliLineKind.FIELD_USAGE:
+            # iget and sget write the value of the field in the first register.
+            if smali_line.opcode[1:4] == "get":
+                self._forget(
+                    smali_line.registers.split(",", 1)[0].strip(), smali_line.opcode
+                )
+
+        elif kind is SmaliLineKind.INSTRUCTION:
+            opcode = smali_line.opcode
+            if opcode.startswith(self.unconditional_branch_prefixes):
+                self._strings.clear()
+            elif not opcode.startswith(self.non_writing_prefixes):
+                register_match = self.destination_register_pattern.match(line)
+                if register_match:
+                    self._forget(register_match.group("register"), opcode)
+
+    def get_string(self, register: str) -> Union[str, None]:
+        return self._strings.get(register, None)
+
+    def get_strings(self, registers: str) -> List[Union[str, None]]:
+        # The constant strings held by the registers passed to an invoke instruction
+        # (e.g., "p0, v1" or "v0 .. v3").
+        if ".." in registers:
+            first_register, last_register = registers.split("..")
+            first_register = first_register.strip()
+            register_names = [
+                "{0}{1}".format(first_register[0], number)
+                for number in range(
+                    int(first_register[1:]), int(last_register.strip()[1:]) + 1
+                )
+            ]
+        else:
+            register_names = [
+                register.strip() for register in registers.split(",") if register
+            ]
+
+        return [self.get_string(register) for register in register_names]
+
+    def reset(self) -> None:
+        self._strings.clear()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+from typing import Dict, List, Union
+
+
+class DexCapacityPlanner(object):
+    """
+    Allocate the methods and the fields that can still be added to each dex file
+    (before hitting the 64K limit) among the obfuscators adding new methods/fields.
+
+    Every time one of these obfuscators is about to run, it gets a share of the
+    capacity that is currently available in each dex, proportional to its weight
+    compared to the weights of the obfuscators that still have to run (including
+    itself). The capacity is computed again for every obfuscator, so the capacity not
+    used by an obfuscator is given back to the following ones.
+    """
+
+    default_weight = 1.0
+
+    def __init__(self, weights: Dict[str, float] = None):
+        self.logger = logging.getLogger(
+            "{0}.{1}".format(__name__, self.__class__.__name__)
+        )
+
+        # Obfuscator name -> weight used when allocating the capacity (the
+        # obfuscators not in this dictionary use the default weight).
+        self.weights: Dict[str, float] = dict(weights or {})
+
+        for obfuscator_name, weight in self.weights.items():
+            if not math.isfinite(weight) or weight <= 0:
+                raise ValueError(
+                    'Invalid capacity weight {0} for obfuscator "{1}", the weight '
+                    "must be a finite number greater than 0".format(
+                        weight, obfuscator_name
+                    )
+                )
+
+        # The obfuscators adding methods/fields that still have to run (in order).
+        self._pending_method_obfuscators: List[str] = []
+        self._pending_field_obfuscators: List[str] = []
+
+        # The obfuscator currently running (None if the obfuscators are not run
+        # through the planner, e.g., when an obfuscator is used on its own).
+        self.current_obfuscator: Union[str, None] = None
+
+    def get_weight(self, obfuscator_name: str) -> float:
+        return self.weights.get(obfuscator_name, self.default_weight)
+
+    def add_obfuscator(
+        self, obfuscator_name: str, is_adding_methods: bool, is_adding_fields: bool
+    ) -> None:
+        # Called (in order) for each obfuscator that will be run.
+        if is_adding_methods:
+            self._pending_method_obfuscators.append(obfuscator_name)
+        if is_adding_fields:
+            self._pending_field_obfuscators.append(obfuscator_name)
+
+    def start_obfuscator(self, obfuscator_name: str) -> None:
+        # Called right before running an obfuscator, which is no longer pending.
+        self.current_obfuscator = obfuscator_name
+        if obfuscator_name in self._pending_method_obfuscators:
+            self._pending_method_obfuscators.remove(obfuscator_name)
+        if obfuscator_name in self._pending_field_obfuscators:
+            self._pending_field_obfuscators.remove(obfuscator_name)
+
+    def _allocate(
+        self,
+        remaining: Union[int, List[int]],
+        pending_obfuscators: List[str],
+        fallback_count: int,
+    ) -> Union[int, List[int]]:
+        if self.current_obfuscator is None:
+            # The obfuscators are not run through the planner, use an equal share.
+            current_weight = 1
+            total_weight = max(fallback_count, 1)
+        else:
+            current_weight = self.get_weight(self.current_obfuscator)
+            total_weight = current_weight + sum(
+                self.get_weight(obfuscator_name)
+                for obfuscator_name in pending_obfuscators
+            )
+
+        # If this is a multidex application, the capacity is allocated in every dex.
+        if isinstance(remaining, list):
+            return [
+                max(int(dex_remaining * current_weight // total_weight), 0)
+                for dex_remaining in remaining
+            ]
+        else:
+            return max(int(remaining * current_weight // total_weight), 0)
+
+    def get_method_budget(
+        self, remaining_methods: Union[int, List[int]], fallback_count: int = 1
+    ) -> Union[int, List[int]]:
+        budget = self._allocate(
+            remaining_methods, self._pending_method_obfuscators, fallback_count
+        )
+        self.logger.debug(
+            'Method budget for "{0}": {1}'.format(self.current_obfuscator, budget)
+        )
+        return budget
+
+    def get_field_budget(
+        self, remaining_fields: Union[int, List[int]], fallback_count: int = 1
+    ) -> Union[int, List[int]]:
+        budget = self._allocate(
+            remaining_fields, self._pending_field_obfuscators, fallback_count
+        )
+        self.logger.debug(
+            'Field budget for "{0}": {1}'.format(self.current_obfuscator, budget)
+        )
+        return budget
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import logging
+from typing import Dict, Iterable, Tuple
+
+from obfuscapk import util
+
+
+class IdentifierHasher(object):
+    """
+    Generate the new names of the renamed identifiers (e.g., p1234abcd for a class
+    name token), made of a prefix and of the first characters of the md5 digest of the
+    original identifier.
+
+    Every name is computed only once during an obfuscation (the same identifier is
+    usually found many times, e.g., the tokens of a package are shared by all its
+    classes). Two different identifiers with the same prefix never get the same name:
+    when their truncated digests collide, the digest of the identifier hashed later is
+    extended with more characters until the name is unique.
+    """
+
+    digest_length = 8
+
+    def __init__(self):
+        self.logger = logging.getLogger(
+            "{0}.{1}".format(__name__, self.__class__.__name__)
+        )
+
+        # (prefix, identifier) -> name
+        self._names: Dict[Tuple[str, str], str] = {}
+
+        # name -> identifier (the prefix is part of the name)
+        self._identifiers: Dict[str, str] = {}
+
+        self.collisions: int = 0
+
+    def get_name(self, prefix: str, identifier: str) -> str:
+        name = self._names.get((prefix, identifier), None)
+        if name is not None:
+            return name
+
+        identifier_md5 = util.get_string_md5(identifier).lower()
+        length = self.digest_length
+        name = "{0}{1}".format(prefix, identifier_md5[:length])
+
+        while self._identifiers.get(name, identifier) != identifier:
+            length += 1
+            if length <= len(identifier_md5):
+                name = "{0}{1}".format(prefix, identifier_md5[:length])
+            else:
+                # Same full digest (practically impossible), add a counter.
+                name = "{0}{1}{2}".format(prefix, identifier_md5, length)
+
+        if length > self.digest_length:
+            self.collisions += 1
+            self.logger.warning(
+                'Name collision when hashing "{0}" (same name as "{1}"), "{2}" '
+                "will be used instead".format(
+                    identifier,
+                    self._identifiers[
+                        "{0}{1}".format(prefix, identifier_md5[: self.digest_length])
+                    ],
+                    name,
+                )
+            )
+
+        self._names[(prefix, identifier)] = name
+        self._identifiers[name] = identifier
+        return name
+
+    def get_names(self, prefix: str, identifiers: Iterable[str]) -> Dict[str, str]:
+        # The identifiers are hashed in sorted order, so a collision is always
+        # resolved in the same way, no matter the order in which they are found.
+        return {
+            identifier: self.get_name(prefix, identifier)
+            for identifier in sorted(set(identifiers))
+        }
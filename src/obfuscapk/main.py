@@ -2,10 +2,11 @@
 
 import logging
 import os
-from typing import List
+from typing import Dict, List
 
 from obfuscapk import util
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.obfuscator_category import IOtherObfuscator, ITrivialObfuscator
 from obfuscapk.obfuscator_manager import ObfuscatorManager
 from obfuscapk.tool import Apktool, Zipalign, ApkSigner
 from obfuscapk.toolbundledecompiler import BundleDecompiler
@@ -58,6 +59,15 @@ def perform_obfuscation(
     key_password: str = None,
     ignore_packages_file: str = None,
     use_aapt2: bool = False,
+    pack_static_strings: bool = False,
+    mapping_file: str = None,
+    previous_mapping_file: str = None,
+    previous_output_dir: str = None,
+    call_indirection_cache_size: int = None,
+    reflection_set_accessible: bool = False,
+    dex_capacity_weights: Dict[str, float] = None,
+    split_dex: bool = False,
+    stats_file: str = None,
 ):
     """
     Apply the obfuscation techniques to an input application and generate an obfuscated
@@ -91,6 +101,58 @@ def perform_obfuscation(
     :param ignore_packages_file: The file containing the package names to be ignored
                                  during the obfuscation (one package name per line).
     :param use_aapt2 If True, use aapt2 for rebuild app
+    :param pack_static_strings: If True, when using ConstStringEncryption obfuscator
+                                the static strings of each class are packed into a
+                                single encrypted blob, decrypted with a single call in
+                                the static constructor.
+    :param mapping_file: The path where to save the mapping (in ProGuard format)
+                         between the original and the renamed classes, methods and
+                         fields. By default, when a rename obfuscator is used,
+                         the mapping is saved in the working directory as
+                         mapping.txt.
+    :param previous_mapping_file: The mapping file of a previous obfuscation (e.g.,
+                                  of a previous version of the application). The
+                                  classes, methods and fields already in the previous
+                                  mapping keep the same names.
+    :param previous_output_dir: The directory with the decoded application of the
+                                previous obfuscation (inside its working directory),
+                                used together with previous_mapping_file. When only
+                                consecutive rename obfuscators are used (with the
+                                same list of the previous obfuscation), the classes
+                                that didn't change reuse the previous obfuscated
+                                smali files.
+    :param call_indirection_cache_size: If not None, when using CallIndirection
+                                        obfuscator the calls of a class to the same
+                                        method share the same wrapper method, and
+                                        this is the maximum number of wrappers kept
+                                        for reuse in each class (the least recently
+                                        used are evicted, 0 means no limit).
+    :param reflection_set_accessible: If True, when using Reflection and
+                                      AdvancedReflection obfuscators each method
+                                      invoked through reflection is made accessible
+                                      once (when it's looked up), so its invocations
+                                      skip the access checks.
+    :param dex_capacity_weights: The weights (obfuscator name -> weight, 1 by
+                                 default) used to allocate the methods and the
+                                 fields that can still be added to each dex file
+                                 among the obfuscators adding new methods/fields.
+                                 Each obfuscator gets a share of the capacity still
+                                 available when it runs, proportional to its weight
+                                 compared to the weights of the obfuscators that
+                                 still have to run.
+    :param split_dex: If True, when the methods or the fields referenced in a dex
+                      file exceed the limit, some classes are moved to a new dex file
+                      (a new smali_classesN directory), so the obfuscators adding new
+                      methods/fields are not limited by the space left in the
+                      existing dex files. The application has to support multidex
+                      natively (minSdkVersion 21 or higher).
+    :param stats_file: The path where to save (in JSON format) the statistics of
+                       each step of the obfuscation (decoding, each obfuscator,
+                       building, signing and aligning): wall and CPU time, files and
+                       bytes read and written, peak memory usage and the change in
+                       the number of methods and fields. An empty string saves the
+                       statistics next to the obfuscated apk file (with .stats.json
+                       extension). By default no statistics are recorded.
     """
 
     check_external_tool_dependencies()
@@ -114,28 +176,89 @@ def perform_obfuscation(
         key_password,
         ignore_packages_file,
         use_aapt2,
+        pack_static_strings,
+        mapping_file,
+        previous_mapping_file,
+        previous_output_dir,
+        call_indirection_cache_size,
+        reflection_set_accessible,
+        dex_capacity_weights,
+        split_dex,
+        stats_file,
     )
 
     manager = ObfuscatorManager()
-    obfuscator_name_to_obfuscator_object = {
-        ob.name: ob.plugin_object for ob in manager.get_all_obfuscators()
-    }
-    obfuscator_name_to_function = {
-        ob.name: ob.plugin_object.obfuscate for ob in manager.get_all_obfuscators()
-    }
     valid_obfuscators = manager.get_obfuscators_names()
 
-    # Check how many obfuscators in list will add new fields/methods.
+    # Make sure all the provided obfuscator names are valid.
     for obfuscator_name in obfuscator_list:
-        # Make sure all the provided obfuscator names are valid.
         if obfuscator_name not in valid_obfuscators:
             raise ValueError(
                 'There is no obfuscator named "{0}"'.format(obfuscator_name)
             )
-        if obfuscator_name_to_obfuscator_object[obfuscator_name].is_adding_fields:
+
+    # Only the modules of the obfuscators in the list are loaded.
+    selected_obfuscators = manager.get_obfuscators(obfuscator_list)
+    obfuscator_name_to_obfuscator_object = {
+        ob.name: ob.plugin_object for ob in selected_obfuscators
+    }
+    obfuscator_name_to_function = {
+        ob.name: ob.plugin_object.obfuscate for ob in selected_obfuscators
+    }
+
+    # Check how many obfuscators in list will add new fields/methods.
+    for obfuscator_name in obfuscator_list:
+        obfuscator = obfuscator_name_to_obfuscator_object[obfuscator_name]
+        if obfuscator.is_adding_fields:
             obfuscation.obfuscators_adding_fields += 1
-        if obfuscator_name_to_obfuscator_object[obfuscator_name].is_adding_methods:
+        if obfuscator.is_adding_methods:
             obfuscation.obfuscators_adding_methods += 1
+        if obfuscator.is_planning_renames:
+            obfuscation.use_rename_mapping = True
+        obfuscation.get_dex_capacity_planner().add_obfuscator(
+            obfuscator_name, obfuscator.is_adding_methods, obfuscator.is_adding_fields
+        )
+
+    obfuscation.get_rename_mapping().obfuscators = list(obfuscator_list)
+
+    # Reuse the previous obfuscation for the unchanged classes (possible only when
+    # the same obfuscators were used and when they only rename classes, methods and
+    # fields, the other obfuscators are not applied again to the reused files). The
+    # reused files are copied during the rewrite of the planned renaming, so the
+    # rename obfuscators have to be consecutive (a single rewrite), otherwise the
+    # following rewrites would rename again the reused files.
+    if previous_mapping_file and previous_output_dir:
+        previous_obfuscators = obfuscation.get_previous_rename_mapping().obfuscators
+        obfuscators = [
+            obfuscator_name_to_obfuscator_object[obfuscator_name]
+            for obfuscator_name in obfuscator_list
+        ]
+        only_renames = all(
+            obfuscator.is_planning_renames
+            or isinstance(obfuscator, (ITrivialObfuscator, IOtherObfuscator))
+            for obfuscator in obfuscators
+        )
+        rename_indexes = [
+            index
+            for index, obfuscator in enumerate(obfuscators)
+            if obfuscator.is_planning_renames
+        ]
+        consecutive_renames = all(
+            next_index == index + 1
+            for index, next_index in zip(rename_indexes, rename_indexes[1:])
+        )
+        if (
+            previous_obfuscators == obfuscator_list
+            and only_renames
+            and consecutive_renames
+        ):
+            obfuscation.enable_incremental_obfuscation()
+        else:
+            logger.warning(
+                "Incremental obfuscation is possible only with consecutive rename "
+                "obfuscators and with the same obfuscators of the previous "
+                "obfuscation, all the classes will be obfuscated"
+            )
 
     obfuscator_progress = util.show_list_progress(
         obfuscator_list,
@@ -144,13 +267,40 @@ def perform_obfuscation(
         description="Running obfuscators",
     )
 
-    for obfuscator_name in obfuscator_progress:
+    for index, obfuscator_name in enumerate(obfuscator_progress):
         try:
+            # Consecutive rename obfuscators only plan their renaming, the files are
+            # rewritten once by the last of them.
+            obfuscation.defer_rename_rewrite = (
+                obfuscator_name_to_obfuscator_object[
+                    obfuscator_name
+                ].is_planning_renames
+                and index + 1 < len(obfuscator_list)
+                and obfuscator_name_to_obfuscator_object[
+                    obfuscator_list[index + 1]
+                ].is_planning_renames
+            )
+            obfuscation.start_obfuscator(obfuscator_name)
             if interactive:
                 obfuscator_progress.set_description(
                     "Running obfuscators ({0})".format(obfuscator_name)
                 )
-            (obfuscator_name_to_function[obfuscator_name])(obfuscation)
+            with obfuscation.measure_step(obfuscator_name, "obfuscator"):
+                (obfuscator_name_to_function[obfuscator_name])(obfuscation)
+
+                # Move some classes to new dex files if the new methods/fields pushed
+                # a dex over the limit.
+                obfuscator = obfuscator_name_to_obfuscator_object[obfuscator_name]
+                if obfuscation.split_dex and (
+                    obfuscator.is_adding_methods or obfuscator.is_adding_fields
+                ):
+                    obfuscation.split_dex_files()
         except Exception as e:
             logger.critical("Error during obfuscation: {0}".format(e), exc_info=True)
             raise
+
+    # Save the mapping with the renamed classes, methods and fields.
+    obfuscation.write_rename_mapping()
+
+    # Save the statistics of the obfuscation (if requested).
+    obfuscation.write_stats()
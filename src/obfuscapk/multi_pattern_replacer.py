@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+from collections import deque
+from typing import Dict, List
+
+
+class MultiPatternReplacer(object):
+    """
+    Replace many strings at once using an Aho-Corasick automaton. The automaton is
+    built once from the replacement mapping and then each text is processed with a
+    single linear scan, instead of a str.replace for each pattern.
+
+    When several patterns match at overlapping positions, the leftmost match is
+    replaced and, among the matches starting at the same position, the longest one
+    is used (e.g., with the patterns "com.app.A" and "com.app.AB", the text
+    "com.app.AB" is replaced with the replacement of "com.app.AB"). Replaced text is
+    never scanned again.
+    """
+
+    def __init__(self, replacements: Dict[str, str]):
+        self.replacements: Dict[str, str] = {
+            pattern: replacement
+            for pattern, replacement in replacements.items()
+            if pattern
+        }
+
+        # The states of the automaton: the transitions of each state, the failure
+        # link, the length of the prefix represented by the state and the length of
+        # the longest pattern that is a suffix of the prefix (0 if no pattern ends
+        # in the state).
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._depth: List[int] = [0]
+        self._output: List[int] = [0]
+
+        self._build()
+
+    def _build(self) -> None:
+        # Build the trie with all the patterns.
+        for pattern in self.replacements:
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char, None)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._depth.append(self._depth[state] + 1)
+                    self._output.append(0)
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._output[state] = len(pattern)
+
+        # Compute the failure links with a breadth-first visit of the trie.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail_state = self._fail[state]
+                while fail_state and char not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                fail_state = self._goto[fail_state].get(char, 0)
+                if fail_state == next_state:
+                    fail_state = 0
+                self._fail[next_state] = fail_state
+
+                # If no pattern ends in this state, the longest pattern ending here
+                # is the one (if any) ending in the failure state.
+                if not self._output[next_state]:
+                    self._output[next_state] = self._output[fail_state]
+
+                queue.append(next_state)
+
+    def replace(self, text: str) -> str:
+        if not self.replacements:
+            return text
+
+        goto = self._goto
+        fail = self._fail
+        depth = self._depth
+        output = self._output
+
+        result: List[str] = []
+        copied_up_to = 0
+        state = 0
+        position = 0
+        text_length = len(text)
+
+        # The best match found so far and not yet replaced (leftmost, then longest).
+        match_start = -1
+        match_end = -1
+
+        while position < text_length:
+            char = text[position]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            position += 1
+
+            if output[state]:
+                start = position - output[state]
+                if match_start < 0 or start <= match_start:
+                    match_start = start
+                    match_end = position
+
+            # When the text currently matched by the automaton starts after the
+            # best match, no other pattern can start before (or at the same
+            # position of) the best match, so the best match can be replaced.
+            if match_start >= 0 and (
+                position - depth[state] > match_start or position == text_length
+            ):
+                result.append(text[copied_up_to:match_start])
+                result.append(self.replacements[text[match_start:match_end]])
+                copied_up_to = match_end
+
+                # Restart the scan right after the replaced text.
+                position = match_end
+                state = 0
+                match_start = -1
+
+        if not result:
+            return text
+
+        result.append(text[copied_up_to:])
+        return "".join(result)
@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 
+import contextlib
+import hashlib
+import json
 import logging
 import os
+import re
 import secrets
 import string
-from typing import List, Union
+from collections import Counter
+from typing import Dict, List, Set, Tuple, Union
 
 from obfuscapk import util
+from obfuscapk.dex_capacity_planner import DexCapacityPlanner
+from obfuscapk.identifier_hasher import IdentifierHasher
+from obfuscapk.obfuscation_stats import ObfuscationStats
+from obfuscapk.package_trie import PackagePrefixTrie
+from obfuscapk.rename_mapping import RenameMapping
+from obfuscapk.rename_planner import RenamePlanner
+from obfuscapk.resource_table import ResourceTable
+from obfuscapk.smali_lexer import SmaliLexer, SmaliLineKind
 from obfuscapk.tool import Apktool, ApkSigner, Zipalign
 from obfuscapk.toolbundledecompiler import BundleDecompiler, AABSigner
 
@@ -18,6 +31,15 @@ class Obfuscation(object):
     and passed to all the obfuscators (in sequence).
     """
 
+    # There is a 64K limit for the methods and the fields referenced in a dex file (a
+    # lower value is used to leave some margin).
+    dex_reference_limit: int = 64000
+
+    # The categories of the classes (see get_class_category).
+    app_class = "app"
+    library_class = "library"
+    ignored_class = "ignored"
+
     def __init__(
         self,
         apk_path: str,
@@ -32,6 +54,15 @@ class Obfuscation(object):
         key_password: str = None,
         ignore_packages_file: str = None,
         use_aapt2: bool = False,
+        pack_static_strings: bool = False,
+        mapping_file: str = None,
+        previous_mapping_file: str = None,
+        previous_output_dir: str = None,
+        call_indirection_cache_size: int = None,
+        reflection_set_accessible: bool = False,
+        dex_capacity_weights: Dict[str, float] = None,
+        split_dex: bool = False,
+        stats_file: str = None,
     ):
         self.logger = logging.getLogger(__name__)
 
@@ -47,6 +78,15 @@ class Obfuscation(object):
         self.key_password: str = key_password
         self.ignore_packages_file: str = ignore_packages_file
         self.use_aapt2 = use_aapt2
+        self.pack_static_strings: bool = pack_static_strings
+        self.mapping_file: str = mapping_file
+        self.previous_mapping_file: str = previous_mapping_file
+        self.previous_output_dir: str = previous_output_dir
+        self.call_indirection_cache_size: int = call_indirection_cache_size
+        self.reflection_set_accessible: bool = reflection_set_accessible
+        self.dex_capacity_weights: Dict[str, float] = dex_capacity_weights
+        self.split_dex: bool = split_dex
+        self.stats_file: str = stats_file
         if apk_path.endswith("aab"):
             self.is_bundle = True
         else:
@@ -76,6 +116,18 @@ class Obfuscation(object):
         self.decrypt_asset_smali_file_added_flag: bool = False
         self.decrypt_string_smali_file_added_flag: bool = False
 
+        # If True, the rename obfuscators only plan their renaming without rewriting
+        # the files (set when the next obfuscator to run is a rename obfuscator too,
+        # so all the planned renaming is applied with a single rewrite).
+        self.defer_rename_rewrite: bool = False
+
+        # If True, the original classes are indexed when decoding the application and
+        # the rename mapping is saved at the end of the obfuscation (needed only when
+        # a rename obfuscator is used or when a mapping file is requested).
+        self.use_rename_mapping: bool = bool(
+            mapping_file or previous_mapping_file or previous_output_dir
+        )
+
         self._remaining_fields_per_obfuscator = None
         self._remaining_methods_per_obfuscator = None
 
@@ -85,7 +137,27 @@ class Obfuscation(object):
         self._manifest_file: Union[str, None] = None
         self._smali_files: List[str] = []
         self._multidex_smali_files: List[List[str]] = []  # A list for each dex file.
+        # (Number of smali files, total size in bytes) for each dex file.
+        self._dex_smali_stats: List[Tuple[int, int]] = []
         self._native_lib_files: List[str] = []
+        self._resource_table: Union[ResourceTable, None] = None
+        self._identifier_hasher: IdentifierHasher = IdentifierHasher()
+        self._smali_lexer: SmaliLexer = SmaliLexer()
+        self._library_trie: Union[PackagePrefixTrie, None] = None
+        self._ignored_package_trie: Union[PackagePrefixTrie, None] = None
+        # Class name -> category of the class (app, library or ignored).
+        self._class_categories: Dict[str, str] = {}
+        self._dex_capacity_planner: DexCapacityPlanner = DexCapacityPlanner(
+            dex_capacity_weights
+        )
+        self._rename_planner: RenamePlanner = RenamePlanner()
+        self._rename_mapping: RenameMapping = RenameMapping()
+        self._previous_rename_mapping: Union[RenameMapping, None] = None
+        # The statistics are recorded only when they are saved in a file (an empty
+        # string means the default file, next to the obfuscated application).
+        self._stats: Union[ObfuscationStats, None] = None
+        if stats_file is not None:
+            self._stats = ObfuscationStats()
 
         # Check if the apk file to obfuscate is a valid file.
         if not os.path.isfile(self.apk_path):
@@ -144,7 +216,8 @@ class Obfuscation(object):
 
         # The result is not saved but is calculated each time this function is called,
         # since the total number might change when the smali files are modified by
-        # an obfuscator.
+        # an obfuscator (the classified lines of the unchanged smali files are cached
+        # by the lexer, so they are not parsed again).
 
         # Workaround to use the same code for single dex and multidex applications.
         to_iterate = [self._smali_files]
@@ -160,34 +233,7 @@ class Obfuscation(object):
             total_fields = set()
 
             for smali_file in dex_smali_files:
-                with open(smali_file, "r", encoding="utf-8") as current_file:
-                    class_name = None
-                    for line in current_file:
-                        if not class_name:
-                            class_match = util.class_pattern.match(line)
-                            if class_match:
-                                class_name = class_match.group("class_name")
-                                continue
-
-                        # Field declared in class.
-                        field_match = util.field_pattern.match(line)
-                        if field_match:
-                            field = "{class_name}->{field_name}:{field_type}".format(
-                                class_name=class_name,
-                                field_name=field_match.group("field_name"),
-                                field_type=field_match.group("field_type"),
-                            )
-                            total_fields.add(field)
-
-                        # Field usage.
-                        field_usage_match = util.field_usage_pattern.match(line)
-                        if field_usage_match:
-                            field = "{class_name}->{field_name}:{field_type}".format(
-                                class_name=field_usage_match.group("field_object"),
-                                field_name=field_usage_match.group("field_name"),
-                                field_type=field_usage_match.group("field_type"),
-                            )
-                            total_fields.add(field)
+                total_fields.update(self._get_class_references(smali_file)[1])
 
             return_list.append(len(total_fields))
 
@@ -202,7 +248,8 @@ class Obfuscation(object):
 
         # The result is not saved but is calculated each time this function is called,
         # since the total number might change when the smali files are modified by
-        # an obfuscator.
+        # an obfuscator (the classified lines of the unchanged smali files are cached
+        # by the lexer, so they are not parsed again).
 
         # Workaround to use the same code for single dex and multidex applications.
         to_iterate = [self._smali_files]
@@ -218,66 +265,7 @@ class Obfuscation(object):
             total_methods = set()
 
             for smali_file in dex_smali_files:
-                with open(smali_file, "r", encoding="utf-8") as current_file:
-                    class_name = None
-                    for line in current_file:
-                        if not class_name:
-                            class_match = util.class_pattern.match(line)
-                            if class_match:
-                                class_name = class_match.group("class_name")
-                                continue
-
-                        # Method used in annotation.
-                        annotation_method_match = util.annotation_method_pattern.match(
-                            line
-                        )
-                        if annotation_method_match:
-                            method = (
-                                "{class_name}->"
-                                "{method_name}({method_param}){method_return}".format(
-                                    class_name=annotation_method_match.group(
-                                        "method_object"
-                                    ),
-                                    method_name=annotation_method_match.group(
-                                        "method_name"
-                                    ),
-                                    method_param=annotation_method_match.group(
-                                        "method_param"
-                                    ),
-                                    method_return=annotation_method_match.group(
-                                        "method_return"
-                                    ),
-                                )
-                            )
-                            total_methods.add(method)
-
-                        # Method declared in class.
-                        method_match = util.method_pattern.match(line)
-                        if method_match:
-                            method = (
-                                "{class_name}->"
-                                "{method_name}({method_param}){method_return}".format(
-                                    class_name=class_name,
-                                    method_name=method_match.group("method_name"),
-                                    method_param=method_match.group("method_param"),
-                                    method_return=method_match.group("method_return"),
-                                )
-                            )
-                            total_methods.add(method)
-
-                        # Method invocation.
-                        invoke_match = util.invoke_pattern.match(line)
-                        if invoke_match:
-                            method = (
-                                "{class_name}->"
-                                "{method_name}({method_param}){method_return}".format(
-                                    class_name=invoke_match.group("invoke_object"),
-                                    method_name=invoke_match.group("invoke_method"),
-                                    method_param=invoke_match.group("invoke_param"),
-                                    method_return=invoke_match.group("invoke_return"),
-                                )
-                            )
-                            total_methods.add(method)
+                total_methods.update(self._get_class_references(smali_file)[0])
 
             return_list.append(len(total_methods))
 
@@ -302,9 +290,11 @@ class Obfuscation(object):
 
         # There is a 64K field limit for dex files.
         if self._is_multidex:
-            remaining_fields = [64000 - dex_fields for dex_fields in total_fields]
+            remaining_fields = [
+                self.dex_reference_limit - dex_fields for dex_fields in total_fields
+            ]
         else:
-            remaining_fields = 64000 - total_fields
+            remaining_fields = self.dex_reference_limit - total_fields
 
         return remaining_fields
 
@@ -324,13 +314,20 @@ class Obfuscation(object):
 
         # There is a 64K method limit for dex files.
         if self._is_multidex:
-            remaining_methods = [64000 - dex_methods for dex_methods in total_methods]
+            remaining_methods = [
+                self.dex_reference_limit - dex_methods for dex_methods in total_methods
+            ]
         else:
-            remaining_methods = 64000 - total_methods
+            remaining_methods = self.dex_reference_limit - total_methods
 
         return remaining_methods
 
     def decode_apk(self) -> None:
+        if not self._is_decoded:
+            with self.measure_step("decode", "decode"):
+                self._decode_apk()
+
+    def _decode_apk(self) -> None:
         if not self._is_decoded:
             # The input apk will be decoded with apktool or BundleDecompiler.
             apktool: Apktool = Apktool()
@@ -362,89 +359,47 @@ class Obfuscation(object):
                         self._decoded_apk_path, "AndroidManifest.xml"
                     )
 
-                # A list containing the paths to all the smali files obtained with
-                # apktool or bundledecompiler.
-                self._smali_files = [
-                    os.path.join(root, file_name)
-                    for root, dir_names, file_names in os.walk(self._decoded_apk_path)
-                    for file_name in file_names
-                    if file_name.endswith(".smali")
-                ]
-
+                # The smali files are found by scanning only the directories with
+                # the smali code of each dex (smali/, smali_classes2/,
+                # smali_classes3/ etc., any number of dex files is supported), so
+                # each file is assigned to its dex while scanning.
                 if self.ignore_libs:
-                    # Normalize paths for the current OS ('.join(x, "")' is used to add
-                    # a trailing slash).
-                    libs_to_ignore = list(
-                        map(
-                            lambda x: os.path.join(os.path.normpath(x), ""),
-                            util.get_libs_to_ignore(),
-                        )
-                    )
-                    filtered_smali_files = []
-
-                    for smali_file in self._smali_files:
-                        # Get the path without the initial part <root>/smali/.
-                        relative_smali_file = os.path.join(
-                            *(
-                                os.path.relpath(
-                                    smali_file, self._decoded_apk_path
-                                ).split(os.path.sep)[1:]
-                            )
-                        )
-                        # Get only the smali files that are not part of known third
-                        # party libraries.
-                        if not any(
-                            relative_smali_file.startswith(lib)
-                            for lib in libs_to_ignore
-                        ):
-                            filtered_smali_files.append(smali_file)
+                    library_trie = self._get_library_trie()
+                else:
+                    library_trie = None
+
+                smali_directories = self._get_smali_directories()
+                self._is_multidex = len(smali_directories) > 1
 
-                    self._smali_files = filtered_smali_files
+                self._smali_files = []
+                self._multidex_smali_files = []
+                self._dex_smali_stats = []
+                for smali_directory in smali_directories:
+                    smali_files, total_size = self._find_smali_files(
+                        smali_directory, library_trie
+                    )
+                    self._smali_files.extend(smali_files)
+                    self._dex_smali_stats.append((len(smali_files), total_size))
+                    if self._is_multidex:
+                        self._multidex_smali_files.append(smali_files)
+
+                # The smali files of the other modules of a bundle (they are not
+                # part of the dex files of the base module).
+                for smali_directory in self._get_module_smali_directories():
+                    smali_files, _ = self._find_smali_files(
+                        smali_directory, library_trie
+                    )
+                    self._smali_files.extend(smali_files)
 
                 # Sort the list of smali files to always have the list in the same
                 # order.
                 self._smali_files.sort()
 
-                # Check if multidex.
-                if self.is_bundle:
-                    if os.path.isdir(
-                        os.path.join(
-                            self._decoded_apk_path, "base", "dex", "smali_classes2"
-                        )
-                    ):
-                        self._is_multidex = True
-                else:
-                    if os.path.isdir(
-                        os.path.join(self._decoded_apk_path, "smali_classes2")
-                    ):
-                        self._is_multidex = True
-
-                if self._is_multidex:
-                    smali_directories = ["smali"]
-                    for i in range(2, 15):
-                        smali_directories.append("smali_classes{0}".format(i))
-
-                    for smali_directory in smali_directories:
-                        if self.is_bundle:
-                            current_directory = os.path.join(
-                                self._decoded_apk_path,
-                                "base",
-                                "dex",
-                                smali_directory,
-                                "",
-                            )
-                        else:
-                            current_directory = os.path.join(
-                                self._decoded_apk_path, smali_directory, ""
-                            )
-                        if os.path.isdir(current_directory):
-                            self._multidex_smali_files.append(
-                                [
-                                    smali_file
-                                    for smali_file in self._smali_files
-                                    if smali_file.startswith(current_directory)
-                                ]
-                            )
+                # Save the hash of the original smali files (written in the rename
+                # mapping file, it's used to find the unchanged classes when
+                # obfuscating a new version of the application).
+                if self.use_rename_mapping:
+                    self._index_original_smali_files()
 
                 # A list containing the paths to the native libraries included in the
                 # application.
@@ -467,33 +422,61 @@ class Obfuscation(object):
             else:
                 self._is_decoded = True
 
+    def _index_original_smali_files(self) -> None:
+        for smali_file in self._smali_files:
+            with open(smali_file, "rb") as current_file:
+                smali_content = current_file.read()
+
+            # Every smali file contains a class, declared in the first line (only
+            # this line is decoded).
+            class_match = util.class_bytes_pattern.match(smali_content)
+            if class_match:
+                class_name = class_match.group("class_name").decode(
+                    "utf-8", errors="replace"
+                )
+                relative_path = os.path.relpath(smali_file, self._decoded_apk_path)
+                self._rename_mapping.class_files[class_name] = (
+                    relative_path.replace(os.path.sep, "/"),
+                    hashlib.sha256(smali_content).hexdigest(),
+                )
+
+    def get_dex_capacity_planner(self) -> DexCapacityPlanner:
+        return self._dex_capacity_planner
+
+    def start_obfuscator(self, obfuscator_name: str) -> None:
+        # This function has to be called right before running each obfuscator, so
+        # the capacity available in the dex files is allocated again (including the
+        # capacity not used by the previous obfuscators).
+        self._dex_capacity_planner.start_obfuscator(obfuscator_name)
+        self._remaining_fields_per_obfuscator = None
+        self._remaining_methods_per_obfuscator = None
+
     def get_remaining_fields_per_obfuscator(self) -> Union[int, List[int]]:
         if not self._is_decoded:
             self.decode_apk()
 
         # This function has to be called before running an obfuscator that adds new
         # fields. It will calculate the available number of fields that can be added by
-        # each obfuscator before hitting the 64K limit. So if there are f available
-        # fields and n obfuscators that will add new fields, each obfuscator will be
-        # able to add a maximum of f/n fields.
+        # the current obfuscator before hitting the 64K limit. The fields still
+        # available are allocated among the current obfuscator and the following
+        # obfuscators adding new fields, according to their weights (see
+        # DexCapacityPlanner).
 
-        if self._remaining_fields_per_obfuscator:
+        if self._remaining_fields_per_obfuscator is not None:
             return self._remaining_fields_per_obfuscator
 
-        remaining_fields = self._get_remaining_fields()
-
-        if self.obfuscators_adding_fields > 1:
-            if self._is_multidex:
-                self._remaining_fields_per_obfuscator = [
-                    dex_fields // self.obfuscators_adding_fields
-                    for dex_fields in remaining_fields
-                ]
-            else:
-                self._remaining_fields_per_obfuscator = (
-                    remaining_fields // self.obfuscators_adding_fields
-                )
+        if self.split_dex:
+            # The classes are moved to new dex files when a dex overflows, so the
+            # new fields of each dex can fill up to a whole new dex.
+            remaining_fields = self._get_split_dex_capacity()
         else:
-            self._remaining_fields_per_obfuscator = remaining_fields
+            remaining_fields = self._get_remaining_fields()
+
+        self._remaining_fields_per_obfuscator = (
+            self._dex_capacity_planner.get_field_budget(
+                remaining_fields, self.obfuscators_adding_fields
+            )
+        )
 
         return self._remaining_fields_per_obfuscator
 
@@ -503,45 +486,279 @@ class Obfuscation(object):
 
         # This function has to be called before running an obfuscator that adds new
         # methods. It will calculate the available number of methods that can be added
-        # by each obfuscator before hitting the 64K limit. So if there are m available
-        # methods and n obfuscators that will add new methods, each obfuscator will be
-        # able to add a maximum of m/n methods.
+        # by the current obfuscator before hitting the 64K limit. The methods still
+        # available are allocated among the current obfuscator and the following
+        # obfuscators adding new methods, according to their weights (see
+        # DexCapacityPlanner).
 
-        if self._remaining_methods_per_obfuscator:
+        if self._remaining_methods_per_obfuscator is not None:
             return self._remaining_methods_per_obfuscator
 
-        remaining_methods = self._get_remaining_methods()
-
-        if self.obfuscators_adding_methods > 1:
-            if self._is_multidex:
-                self._remaining_methods_per_obfuscator = [
-                    dex_methods // self.obfuscators_adding_methods
-                    for dex_methods in remaining_methods
-                ]
-            else:
-                self._remaining_methods_per_obfuscator = (
-                    remaining_methods // self.obfuscators_adding_methods
-                )
+        if self.split_dex:
+            # The classes are moved to new dex files when a dex overflows, so the
+            # new methods of each dex can fill up to a whole new dex.
+            remaining_methods = self._get_split_dex_capacity()
         else:
-            self._remaining_methods_per_obfuscator = remaining_methods
+            remaining_methods = self._get_remaining_methods()
+
+        self._remaining_methods_per_obfuscator = (
+            self._dex_capacity_planner.get_method_budget(
+                remaining_methods, self.obfuscators_adding_methods
+            )
+        )
 
         return self._remaining_methods_per_obfuscator
 
+    def _get_split_dex_capacity(self) -> Union[int, List[int]]:
+        if self._is_multidex:
+            return [self.dex_reference_limit] * len(self._multidex_smali_files)
+        else:
+            return self.dex_reference_limit
+
+    def _get_dex_root(self) -> str:
+        # The directory containing the smali directories of the dex files.
+        if self.is_bundle:
+            return os.path.join(self._decoded_apk_path, "base", "dex")
+        else:
+            return self._decoded_apk_path
+
+    @staticmethod
+    def _get_smali_directories_in(dex_root: str) -> List[str]:
+        smali_directories: List[Tuple[int, str]] = []
+        if not os.path.isdir(dex_root):
+            return []
+
+        with os.scandir(dex_root) as entries:
+            for entry in entries:
+                directory_match = re.fullmatch(r"smali(_classes(\d+))?", entry.name)
+                if directory_match and entry.is_dir():
+                    dex_number = int(directory_match.group(2) or 1)
+                    smali_directories.append((dex_number, entry.path))
+
+        return [directory_path for _, directory_path in sorted(smali_directories)]
+
+    def _get_smali_directories(self) -> List[str]:
+        # The directories with the smali files of each dex (smali/, smali_classes2/,
+        # smali_classes3/ etc.), in the same order as the dex files.
+        return self._get_smali_directories_in(self._get_dex_root())
+
+    def _get_module_smali_directories(self) -> List[str]:
+        # The directories with the smali files of the modules of a bundle, other
+        # than the base module (<module>/dex/smali/ etc.).
+        module_smali_directories: List[str] = []
+        if not self.is_bundle:
+            return module_smali_directories
+
+        with os.scandir(self._decoded_apk_path) as entries:
+            module_directories = sorted(
+                entry.path
+                for entry in entries
+                if entry.name != "base" and entry.is_dir()
+            )
+
+        for module_directory in module_directories:
+            module_smali_directories.extend(
+                self._get_smali_directories_in(os.path.join(module_directory, "dex"))
+            )
+
+        return module_smali_directories
+
+    @staticmethod
+    def _find_smali_files(
+        smali_directory: str, library_trie: PackagePrefixTrie = None
+    ) -> Tuple[List[str], int]:
+        # The (sorted) smali files in a smali directory and their total size in
+        # bytes. If a trie with the library packages is given, the smali files of
+        # the libraries are skipped (the path of a file, relative to the smali
+        # directory, is the same of the class name).
+        smali_files: List[str] = []
+        total_size = 0
+        prefix_length = len(os.path.join(smali_directory, ""))
+
+        directories_to_scan = [smali_directory]
+        while directories_to_scan:
+            with os.scandir(directories_to_scan.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories_to_scan.append(entry.path)
+                    elif entry.name.endswith(".smali") and entry.is_file():
+                        if library_trie is not None:
+                            class_path = "L{0}".format(
+                                entry.path[prefix_length:].replace(os.path.sep, "/")
+                            )
+                            if class_path in library_trie:
+                                continue
+                        smali_files.append(entry.path)
+                        total_size += entry.stat().st_size
+
+        smali_files.sort()
+        return smali_files, total_size
+
+    def _get_class_references(self, smali_file: str) -> Tuple[Set[str], Set[str]]:
+        # The methods and the fields referenced by the class in a smali file: the
+        # methods declared in the class, invoked or used in annotations, and the
+        # fields declared in the class or used.
+        methods: Set[str] = set()
+        fields: Set[str] = set()
+
+        class_name = None
+        for smali_line in self._smali_lexer.lex_file(smali_file):
+            kind = smali_line.kind
+            if kind is SmaliLineKind.CLASS:
+                if not class_name:
+                    class_name = smali_line.class_name
+            elif (
+                kind is SmaliLineKind.METHOD
+                or kind is SmaliLineKind.INVOKE
+                or kind is SmaliLineKind.ANNOTATION_METHOD
+            ):
+                methods.add(smali_line.get_method_reference(class_name))
+            elif kind is SmaliLineKind.FIELD or kind is SmaliLineKind.FIELD_USAGE:
+                fields.add(smali_line.get_field_reference(class_name))
+
+        return methods, fields
+
+    def split_dex_files(self) -> None:
+        if not self._is_decoded:
+            self.decode_apk()
+
+        with self.measure_step("split_dex", "split_dex"):
+            self._split_dex_files()
+
+    def _split_dex_files(self) -> None:
+        # When the methods or the fields referenced in a dex are more than the limit,
+        # move whole classes (starting from the last ones) to a new smali_classesN
+        # directory (a new dex file), which is checked in the same way. All the smali
+        # files of a dex are considered, including the ignored ones.
+        try:
+            smali_directories = self._get_smali_directories()
+            dex_root = os.path.dirname(smali_directories[0])
+            moved_smali_files: Dict[str, str] = {}
+
+            directory_index = 0
+            while directory_index < len(smali_directories):
+                smali_directory = smali_directories[directory_index]
+                directory_index += 1
+
+                class_references: List[Tuple[str, Set[str], Set[str]]] = []
+                method_counter: Counter = Counter()
+                field_counter: Counter = Counter()
+                smali_files, _ = self._find_smali_files(smali_directory)
+                for smali_file in smali_files:
+                    methods, fields = self._get_class_references(smali_file)
+                    class_references.append((smali_file, methods, fields))
+                    method_counter.update(methods)
+                    field_counter.update(fields)
+
+                smali_files_to_move: List[str] = []
+                while len(class_references) > 1 and (
+                    len(method_counter) > self.dex_reference_limit
+                    or len(field_counter) > self.dex_reference_limit
+                ):
+                    smali_file, methods, fields = class_references.pop()
+                    for counter, references in (
+                        (method_counter, methods),
+                        (field_counter, fields),
+                    ):
+                        for reference in references:
+                            counter[reference] -= 1
+                            if not counter[reference]:
+                                del counter[reference]
+                    smali_files_to_move.append(smali_file)
+
+                if not smali_files_to_move:
+                    continue
+
+                dex_number = len(smali_directories) + 1
+                while os.path.exists(
+                    os.path.join(dex_root, "smali_classes{0}".format(dex_number))
+                ):
+                    dex_number += 1
+                new_smali_directory = os.path.join(
+                    dex_root, "smali_classes{0}".format(dex_number)
+                )
+                smali_directories.append(new_smali_directory)
+
+                self.logger.info(
+                    '{0} classes moved from "{1}" to "{2}" to stay within the dex '
+                    "limits".format(
+                        len(smali_files_to_move),
+                        os.path.basename(smali_directory),
+                        os.path.basename(new_smali_directory),
+                    )
+                )
+
+                for smali_file in smali_files_to_move:
+                    new_smali_file = os.path.join(
+                        new_smali_directory,
+                        os.path.relpath(smali_file, smali_directory),
+                    )
+                    os.renames(smali_file, new_smali_file)
+                    moved_smali_files[smali_file] = new_smali_file
+
+            if not moved_smali_files:
+                return
+
+            # Update the lists with the smali files (a file can be moved more than
+            # once, when also the new dex is over the limits).
+            new_smali_files: List[str] = []
+            for smali_file in self._smali_files:
+                while smali_file in moved_smali_files:
+                    smali_file = moved_smali_files[smali_file]
+                new_smali_files.append(smali_file)
+            self._smali_files = sorted(new_smali_files)
+            self._is_multidex = True
+            directory_indexes = {
+                os.path.basename(smali_directory): index
+                for index, smali_directory in enumerate(smali_directories)
+            }
+            self._multidex_smali_files = [[] for _ in smali_directories]
+            for smali_file in self._smali_files:
+                # <dex root>/<smali directory>/...
+                smali_directory = os.path.relpath(smali_file, dex_root).split(
+                    os.path.sep, 1
+                )[0]
+                dex_index = directory_indexes.get(smali_directory, None)
+                if dex_index is not None:
+                    self._multidex_smali_files[dex_index].append(smali_file)
+            self._dex_smali_stats = [
+                (
+                    len(smali_files),
+                    sum(os.path.getsize(smali_file) for smali_file in smali_files),
+                )
+                for smali_files in self._multidex_smali_files
+            ]
+
+            # The capacity of the dex files has changed.
+            self._remaining_fields_per_obfuscator = None
+            self._remaining_methods_per_obfuscator = None
+
+        except Exception as e:
+            self.logger.error("Error during dex splitting: {0}".format(e))
+            raise
+
     def build_obfuscated_apk(self) -> None:
         if not self._is_decoded:
             self.decode_apk()
 
+        # Make sure no dex file is over the limit after the obfuscation.
+        if self.split_dex:
+            self.split_dex_files()
+
         # The obfuscated apk will be built with apktool or BundleDecompiler.
         apktool: Apktool = Apktool()
         bundledecompiler: BundleDecompiler = BundleDecompiler()
 
         try:
-            if self.is_bundle:
-                bundledecompiler.build(self._decoded_apk_path, self.obfuscated_apk_path)
-            else:
-                apktool.build(
-                    self._decoded_apk_path, self.obfuscated_apk_path, self.use_aapt2
-                )
+            with self.measure_step("build", "build"):
+                if self.is_bundle:
+                    bundledecompiler.build(
+                        self._decoded_apk_path, self.obfuscated_apk_path
+                    )
+                else:
+                    apktool.build(
+                        self._decoded_apk_path, self.obfuscated_apk_path, self.use_aapt2
+                    )
         except Exception as e:
             self.logger.error("Error during apk building: {0}".format(e))
             raise
@@ -577,18 +794,19 @@ class Obfuscation(object):
                 )
 
         try:
-            if self.is_bundle:
-                aabsigner.sign(
-                    self.obfuscated_apk_path,
-                )
-            else:
-                apksigner.resign(
-                    self.obfuscated_apk_path,
-                    self.keystore_file,
-                    self.keystore_password,
-                    self.key_alias,
-                    self.key_password,
-                )
+            with self.measure_step("sign", "sign"):
+                if self.is_bundle:
+                    aabsigner.sign(
+                        self.obfuscated_apk_path,
+                    )
+                else:
+                    apksigner.resign(
+                        self.obfuscated_apk_path,
+                        self.keystore_file,
+                        self.keystore_password,
+                        self.key_alias,
+                        self.key_password,
+                    )
         except Exception as e:
             self.logger.error("Error during apk signing: {0}".format(e))
             raise
@@ -602,7 +820,8 @@ class Obfuscation(object):
             return
 
         try:
-            zipalign.align(self.obfuscated_apk_path)
+            with self.measure_step("align", "align"):
+                zipalign.align(self.obfuscated_apk_path)
         except Exception as e:
             self.logger.error("Error during apk alignment: {0}".format(e))
             raise
@@ -632,6 +851,14 @@ class Obfuscation(object):
         # If this isn't a multidex application, an empty list will be returned.
         return self._multidex_smali_files
 
+    def get_dex_smali_stats(self) -> List[Tuple[int, int]]:
+        if not self._is_decoded:
+            self.decode_apk()
+
+        # The number of smali files and their total size in bytes for each dex file
+        # (a single element if this isn't a multidex application).
+        return self._dex_smali_stats
+
     def get_native_lib_files(self) -> List[str]:
         if not self._is_decoded:
             self.decode_apk()
@@ -658,6 +885,194 @@ class Obfuscation(object):
         else:
             return os.path.join(self._decoded_apk_path, "res", "")
 
+    def get_resource_table(self) -> ResourceTable:
+        if not self._is_decoded:
+            self.decode_apk()
+
+        # The resource table is built only once (the first time it's needed), since
+        # the obfuscators don't add or remove resources.
+        if not self._resource_table:
+            self._resource_table = ResourceTable(self.get_resource_directory())
+
+        return self._resource_table
+
+    def get_identifier_hasher(self) -> IdentifierHasher:
+        return self._identifier_hasher
+
+    def get_smali_lexer(self) -> SmaliLexer:
+        return self._smali_lexer
+
+    def get_rename_planner(self) -> RenamePlanner:
+        return self._rename_planner
+
+    def get_rename_mapping(self) -> RenameMapping:
+        return self._rename_mapping
+
+    def get_previous_rename_mapping(self) -> Union[RenameMapping, None]:
+        if self.previous_mapping_file and not self._previous_rename_mapping:
+            self._previous_rename_mapping = RenameMapping.load(
+                self.previous_mapping_file
+            )
+        return self._previous_rename_mapping
+
+    def enable_incremental_obfuscation(self) -> int:
+        if not self._is_decoded:
+            self.decode_apk()
+
+        previous_rename_mapping = self.get_previous_rename_mapping()
+        if not previous_rename_mapping or not self.previous_output_dir:
+            return 0
+
+        # The classes whose original smali file is the same as in the previous
+        # version of the application will reuse the obfuscated smali file of the
+        # previous obfuscation, instead of being rewritten.
+        reusable_smali_files: Dict[str, str] = {}
+        for class_name, (
+            relative_path,
+            sha256,
+        ) in self._rename_mapping.class_files.items():
+            previous_class_file = previous_rename_mapping.class_files.get(
+                class_name, None
+            )
+            if previous_class_file and previous_class_file[1] == sha256:
+                previous_smali_file = os.path.join(
+                    self.previous_output_dir, *previous_class_file[0].split("/")
+                )
+                if os.path.isfile(previous_smali_file):
+                    reusable_smali_files[
+                        os.path.join(self._decoded_apk_path, *relative_path.split("/"))
+                    ] = previous_smali_file
+
+        self._rename_planner.reusable_smali_files = reusable_smali_files
+
+        self.logger.info(
+            "{0} unchanged classes will reuse the previous obfuscation".format(
+                len(reusable_smali_files)
+            )
+        )
+
+        return len(reusable_smali_files)
+
+    def rewrite_planned_renames(self):
+        if not self._rename_planner.has_pending_renames():
+            return
+
+        # Keep the names used in the previous obfuscation (if any) and save the
+        # planned renaming into the mapping.
+        previous_rename_mapping = self.get_previous_rename_mapping()
+        if previous_rename_mapping:
+            self._rename_mapping.reuse_previous_names(
+                previous_rename_mapping, self._rename_planner
+            )
+        self._rename_mapping.add_planned_renames(self._rename_planner)
+
+        # Classes are renamed also in res/layout-*/ and res/xml-*/ files (taken from
+        # the resource table) and in the manifest.
+        resource_table = self.get_resource_table()
+        xml_files: List[str] = sorted(
+            set(
+                xml_file
+                for resource_type in ("layout", "xml")
+                for xml_file in resource_table.get_resource_files(resource_type)
+                if xml_file.endswith(".xml")
+            )
+        )
+        xml_files.append(self.get_manifest_file())
+
+        self._rename_planner.rewrite(
+            self.get_smali_files(), xml_files, self.interactive
+        )
+
+    def write_rename_mapping(self) -> None:
+        # Nothing to write if the application wasn't decoded (no obfuscator used) or
+        # if the mapping isn't needed.
+        if not self._is_decoded or not self.use_rename_mapping:
+            return
+
+        mapping_file = self.mapping_file or os.path.join(
+            self.working_dir_path, "mapping.txt"
+        )
+        self._rename_mapping.write(mapping_file)
+        self.logger.info('Rename mapping saved in "{0}"'.format(mapping_file))
+
+    def _get_reference_counts(self) -> Union[Tuple[int, int], None]:
+        # The total number of methods and fields referenced in the dex files of the
+        # application (None if the application wasn't decoded).
+        if not self._is_decoded:
+            return None
+
+        total_methods = self._get_total_methods()
+        total_fields = self._get_total_fields()
+        if self._is_multidex:
+            return sum(total_methods), sum(total_fields)
+        else:
+            return total_methods, total_fields
+
+    def measure_step(self, step_name: str, step_type: str):
+        # Record the statistics of a step of the obfuscation (decode, obfuscator,
+        # split_dex, build, sign or align), if they have to be saved.
+        if self._stats is None:
+            return contextlib.nullcontext()
+
+        if step_type in ("decode", "obfuscator"):
+            return self._stats.measure(step_name, step_type, self._get_reference_counts)
+        else:
+            return self._stats.measure(step_name, step_type)
+
+    def write_stats(self) -> None:
+        # Nothing to write if the statistics weren't recorded.
+        if self._stats is None:
+            return
+
+        stats_file = self.stats_file or "{0}.stats.json".format(
+            os.path.splitext(self.obfuscated_apk_path)[0]
+        )
+        report = {
+            "apk": self.apk_path,
+            "obfuscated_apk": self.obfuscated_apk_path,
+            "obfuscators": self.used_obfuscators,
+        }
+        report.update(self._stats.get_report())
+        with open(stats_file, "w", encoding="utf-8") as json_stats_file:
+            json.dump(report, json_stats_file, indent=4)
+        self.logger.info('Obfuscation statistics saved in "{0}"'.format(stats_file))
+
+    def _get_library_trie(self) -> PackagePrefixTrie:
+        if self._library_trie is None:
+            self._library_trie = PackagePrefixTrie()
+            for lib in util.get_libs_to_ignore():
+                self._library_trie.add(
+                    "L{0}/".format(lib.strip("/")), self.library_class
+                )
+        return self._library_trie
+
+    def _get_ignored_package_trie(self) -> PackagePrefixTrie:
+        if self._ignored_package_trie is None:
+            self._ignored_package_trie = PackagePrefixTrie()
+            for package_name in self.get_ignore_package_names():
+                self._ignored_package_trie.add(package_name, self.ignored_class)
+        return self._ignored_package_trie
+
+    def get_class_category(self, class_name: str) -> str:
+        # The category of a class (e.g., Lcom/example/MainActivity;): library (if
+        # it's part of a known third party library and the libraries are ignored),
+        # ignored (if it's part of a package to ignore) or app. Each class is
+        # classified only once.
+        category = self._class_categories.get(class_name, None)
+        if category is None:
+            if self.ignore_libs and class_name in self._get_library_trie():
+                category = self.library_class
+            elif class_name in self._get_ignored_package_trie():
+                category = self.ignored_class
+            else:
+                category = self.app_class
+            self._class_categories[class_name] = category
+        return category
+
+    def is_ignored_class(self, class_name: str) -> bool:
+        # True if the class shouldn't be obfuscated (see get_class_category).
+        return self.get_class_category(class_name) != self.app_class
+
     def get_ignore_package_names(self) -> List[str]:
         ignore_package_list = []
 
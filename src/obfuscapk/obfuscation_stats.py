@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import contextlib
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows (the peak memory usage is not recorded).
+    resource = None
+
+# The values measured for each step, as the difference between the values at the
+# end and at the start of the step (the values of the nested steps are not included
+# in the values of the outer step).
+measured_values = (
+    "wall_time",
+    "cpu_time",
+    "tools_cpu_time",
+    "files_read",
+    "files_written",
+    "bytes_read",
+    "bytes_written",
+)
+
+# Measured value -> measure (None if not available).
+_Values = Dict[str, Union[float, None]]
+
+# The number of files opened by this process, counted with an audit hook (added
+# when the first ObfuscationStats object is created, Python 3.8 or higher). An audit
+# hook can't be removed, so the files are counted only while at least one step is
+# being measured (the hook does nothing otherwise).
+_opened_files: Dict[str, int] = {"read": 0, "written": 0}
+_audit_hook_added: bool = False
+_measured_steps: int = 0
+
+
+def _count_opened_files(event: str, args: tuple) -> None:
+    if not _measured_steps or event != "open":
+        return
+
+    path, mode, flags = args
+    if not isinstance(path, (str, bytes)) or path == "/proc/self/io":
+        # Already opened file descriptors and the file read for the statistics.
+        return
+
+    if mode is None:
+        # File opened with os.open.
+        writing = bool(flags & (os.O_WRONLY | os.O_RDWR))
+        reading = not flags & os.O_WRONLY
+    else:
+        writing = any(char in mode for char in "wax+")
+        reading = "r" in mode or "+" in mode
+
+    if reading:
+        _opened_files["read"] += 1
+    if writing:
+        _opened_files["written"] += 1
+
+
+def _add_audit_hook() -> bool:
+    global _audit_hook_added
+
+    if not _audit_hook_added and hasattr(sys, "addaudithook"):
+        sys.addaudithook(_count_opened_files)
+        _audit_hook_added = True
+
+    return _audit_hook_added
+
+
+@contextlib.contextmanager
+def _counting_opened_files():
+    global _measured_steps
+
+    _measured_steps += 1
+    try:
+        yield
+    finally:
+        _measured_steps -= 1
+
+
+def _get_io_bytes() -> Tuple[Union[int, None], Union[int, None]]:
+    # The bytes read and written by this process (only on Linux).
+    try:
+        with open("/proc/self/io", "r") as io_file:
+            io_counters = dict(line.split(":", 1) for line in io_file)
+        return int(io_counters["rchar"]), int(io_counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _get_peak_rss() -> Tuple[Union[int, None], Union[int, None]]:
+    # The peak memory usage (in bytes) of this process and of the largest external
+    # tool (e.g., apktool) run so far.
+    if resource is None:
+        return None, None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    )
+
+
+class ObfuscationStats(object):
+    """
+    Statistics about each step of an obfuscation (decoding, each obfuscator,
+    building, signing and aligning the application): wall time, CPU time of this
+    process and of the external tools, files opened for reading and writing, bytes
+    read and written by this process, peak memory usage and the number of methods and
+    fields referenced in the application after the step (with the difference from the
+    previous step).
+    """
+
+    def __init__(self):
+        self._count_files = _add_audit_hook()
+
+        self.steps: List[Dict[str, Any]] = []
+
+        # For each running step, the values measured by its nested steps (e.g., the
+        # decoding of the application done by the first obfuscator).
+        self._nested_values: List[Dict[str, float]] = []
+
+        # The number of methods and fields after the last step counting them.
+        self._last_counts: Union[Tuple[int, int], None] = None
+
+        self._start_values = self._take_snapshot()
+
+    def _take_snapshot(self) -> _Values:
+        times = os.times()
+        bytes_read, bytes_written = _get_io_bytes()
+        return {
+            "wall_time": time.perf_counter(),
+            "cpu_time": times.user + times.system,
+            "tools_cpu_time": times.children_user + times.children_system,
+            "files_read": _opened_files["read"] if self._count_files else None,
+            "files_written": _opened_files["written"] if self._count_files else None,
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+        }
+
+    @staticmethod
+    def _get_difference(start_values: _Values, end_values: _Values) -> _Values:
+        difference = {}
+        for value in measured_values:
+            if start_values[value] is None or end_values[value] is None:
+                difference[value] = None
+            else:
+                difference[value] = end_values[value] - start_values[value]
+        return difference
+
+    @staticmethod
+    def _round_times(values: _Values) -> _Values:
+        # The times are in seconds, with microsecond precision.
+        return {
+            value: round(measure, 6) if isinstance(measure, float) else measure
+            for value, measure in values.items()
+        }
+
+    @contextlib.contextmanager
+    def measure(
+        self,
+        step_name: str,
+        step_type: str,
+        get_counts: Callable[[], Union[Tuple[int, int], None]] = None,
+    ):
+        # The opened files are counted only while some step is measured.
+        with _counting_opened_files():
+            start_values = self._take_snapshot()
+            self._nested_values.append(dict.fromkeys(measured_values, 0))
+            completed = False
+            try:
+                yield
+                completed = True
+            finally:
+                step_values = self._get_difference(start_values, self._take_snapshot())
+                nested_values = self._nested_values.pop()
+
+                step: Dict[str, Any] = {"name": step_name, "type": step_type}
+                for value in measured_values:
+                    if step_values[value] is not None:
+                        step_values[value] -= nested_values[value]
+                step.update(self._round_times(step_values))
+                step["peak_rss"], step["tools_peak_rss"] = _get_peak_rss()
+
+                # The methods and the fields are counted after the end of the step
+                # (the time needed to count them is not part of any step).
+                step["methods"], step["fields"] = None, None
+                step["methods_delta"], step["fields_delta"] = None, None
+                if get_counts and completed:
+                    counts = get_counts()
+                    if counts:
+                        step["methods"], step["fields"] = counts
+                        if self._last_counts:
+                            step["methods_delta"] = counts[0] - self._last_counts[0]
+                            step["fields_delta"] = counts[1] - self._last_counts[1]
+                        self._last_counts = counts
+
+                self.steps.append(step)
+
+                # This step (counting included) is not part of the outer step.
+                if self._nested_values:
+                    total_values = self._get_difference(
+                        start_values, self._take_snapshot()
+                    )
+                    outer_nested_values = self._nested_values[-1]
+                    for value in measured_values:
+                        if total_values[value] is not None:
+                            outer_nested_values[value] += total_values[value]
+
+    def get_report(self) -> Dict[str, Any]:
+        total: Dict[str, Any] = self._get_difference(
+            self._start_values, self._take_snapshot()
+        )
+        total = self._round_times(total)
+        total["peak_rss"], total["tools_peak_rss"] = _get_peak_rss()
+        return {"steps": self.steps, "total": total}
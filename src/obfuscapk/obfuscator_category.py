@@ -14,6 +14,10 @@ class IBaseObfuscator(ABC, IPlugin):
         self.is_adding_fields = False
         self.is_adding_methods = False
 
+        # True for the obfuscators that rename through the rename planner of the
+        # obfuscation (their renaming can be applied together with a single rewrite).
+        self.is_planning_renames = False
+
     @abstractmethod
     def obfuscate(self, obfuscation_info: Obfuscation):
         raise NotImplementedError()
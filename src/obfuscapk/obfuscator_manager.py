@@ -1,21 +1,42 @@
 #!/usr/bin/env python3
 
+import configparser
+import glob
 import os
-
-from yapsy.PluginManager import PluginManager
-
-from obfuscapk import obfuscator_category
+from typing import Dict, Iterable, List, Set
 
 
 class ObfuscatorManager(object):
+    obfuscators_dir = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "obfuscators"
+    )
+
     def __init__(self):
-        # Collect all the obfuscators contained in the ./obfuscators directory. Each
-        # obfuscator has an associated *.obfuscator file with some metadata and belongs
-        # to a category (see the base class of each obfuscator).
-        self.manager = PluginManager(
-            directories_list=[
-                os.path.join(os.path.dirname(os.path.realpath(__file__)), "obfuscators")
-            ],
+        # Each obfuscator in the ./obfuscators directory has an associated *.obfuscator
+        # file with some metadata (name, module, category and description). Only these
+        # files are read here: the modules of the obfuscators (and their dependencies)
+        # are imported only when the obfuscators are actually needed.
+        self._descriptors: Dict[str, configparser.ConfigParser] = {}
+        for descriptor_file in glob.glob(
+            os.path.join(self.obfuscators_dir, "*.obfuscator")
+        ):
+            descriptor = configparser.ConfigParser()
+            descriptor.read(descriptor_file, encoding="utf-8")
+            self._descriptors[descriptor.get("Core", "Name")] = descriptor
+
+        self.manager = None
+        self._loaded_obfuscators: Set[str] = set()
+
+    def _get_plugin_manager(self):
+        # The plugin system is imported only when loading the first obfuscators.
+        from yapsy.PluginManager import PluginManager
+
+        from obfuscapk import obfuscator_category
+
+        # Each obfuscator belongs to a category (see the base class of each
+        # obfuscator).
+        return PluginManager(
+            directories_list=[self.obfuscators_dir],
             plugin_info_ext="obfuscator",
             categories_filter={
                 "Trivial": obfuscator_category.ITrivialObfuscator,
@@ -26,15 +47,47 @@ class ObfuscatorManager(object):
                 "Other": obfuscator_category.IOtherObfuscator,
             },
         )
-        self.manager.collectPlugins()
 
-    def get_all_obfuscators(self):
-        return self.manager.getAllPlugins()
+    def load_obfuscators(self, obfuscator_names: Iterable[str]) -> None:
+        # Import (only once) the modules of the obfuscators with the given names.
+        obfuscators_to_load = set(obfuscator_names) - self._loaded_obfuscators
+        if not obfuscators_to_load:
+            return
+
+        if self.manager is None:
+            self.manager = self._get_plugin_manager()
 
-    def get_obfuscators_names(self):
+        self.manager.locatePlugins()
+        for candidate in self.manager.getPluginCandidates():
+            if candidate[2].name not in obfuscators_to_load:
+                self.manager.removePluginCandidate(candidate)
+        self.manager.loadPlugins()
+
+        self._loaded_obfuscators.update(obfuscators_to_load)
+
+    def get_obfuscators(self, obfuscator_names: Iterable[str]) -> list:
+        obfuscator_names = set(obfuscator_names)
+        self.load_obfuscators(obfuscator_names)
         return [
-            ob.name
-            for ob in sorted(
-                self.get_all_obfuscators(), key=lambda x: (x.category, x.name)
-            )
+            ob for ob in self.manager.getAllPlugins() if ob.name in obfuscator_names
         ]
+
+    def get_all_obfuscators(self) -> list:
+        return self.get_obfuscators(self._descriptors)
+
+    def get_obfuscator_category(self, obfuscator_name: str) -> str:
+        # The metadata files of the obfuscators written before the category was added
+        # don't have this key: these obfuscators are listed in the "Other" category
+        # (the actual category, given by the base class, is still used when loading
+        # them).
+        return self._descriptors[obfuscator_name].get(
+            "Core", "Category", fallback="Other"
+        )
+
+    def get_obfuscators_names(self) -> List[str]:
+        # The names are sorted by category and then by name (the same order used when
+        # all the obfuscators were loaded to get their category).
+        return sorted(
+            self._descriptors,
+            key=lambda name: (self.get_obfuscator_category(name), name),
+        )
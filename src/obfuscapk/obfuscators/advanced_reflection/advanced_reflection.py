@@ -3,7 +3,7 @@
 import logging
 import os
 import re
-from typing import List, Set
+from typing import Dict, FrozenSet, List, Set
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
@@ -19,6 +19,15 @@ class AdvancedReflection(obfuscator_category.ICodeObfuscator):
 
         self.methods_with_reflection: int = 0
 
+        # If True, setAccessible(true) is called once on every method using
+        # reflection (when it's looked up), to skip the access checks when invoking it.
+        self.set_accessible: bool = False
+
+        # The methods already added to the list of methods using reflection (e.g.,
+        # Lcom/app/Class;->method(I)V) and their index in the list: the same method
+        # invoked in many places (even in different classes) is added only once.
+        self.reflected_methods: Dict[str, int] = {}
+
         # Keep track of the length of the added instructions for advanced reflection
         # obfuscator, since there is a limit for the number of maximum instructions in
         # a try catch block. Not all the instructions have the same length.
@@ -122,7 +131,7 @@ class AdvancedReflection(obfuscator_category.ICodeObfuscator):
         return needed_registers
 
     def add_smali_reflection_code(
-        self, class_name: str, method_name: str, param_string: str
+        self, class_name: str, method_name: str, param_string: str, method_index: int
     ) -> str:
         params = self.split_method_params(param_string)
 
@@ -164,17 +173,26 @@ class AdvancedReflection(obfuscator_category.ICodeObfuscator):
         )
         self.obfuscator_instructions_length += 3
 
-        smali_code += (
-            "\tmove-result-object v1\n\n"
-            "\tsget-object v2, Lcom/apireflectionmanager/AdvancedApiReflection;->"
-            "obfuscatedMethods:Ljava/util/List;\n\n"
-        )
-        self.obfuscator_instructions_length += 3
+        smali_code += "\tmove-result-object v1\n\n"
+        self.obfuscator_instructions_length += 1
+
+        if self.set_accessible:
+            # Skip the access checks when the method is invoked.
+            smali_code += (
+                "\tconst/4 v2, 0x1\n\n"
+                "\tinvoke-virtual {v1, v2}, "
+                "Ljava/lang/reflect/Method;->setAccessible(Z)V\n\n"
+            )
+            self.obfuscator_instructions_length += 4
 
+        # Save the method in the static array, so it's looked up only once.
         smali_code += (
-            "\tinvoke-interface {v2, v1}, Ljava/util/List;->add(Ljava/lang/Object;)Z\n"
+            "\tsget-object v2, Lcom/apireflectionmanager/AdvancedApiReflection;->"
+            "obfuscatedMethods:[Ljava/lang/reflect/Method;\n\n"
+            "\tconst/16 v3, {method_index:#x}\n\n"
+            "\taput-object v1, v2, v3\n".format(method_index=method_index)
         )
-        self.obfuscator_instructions_length += 3
+        self.obfuscator_instructions_length += 6
 
         return smali_code
 
@@ -312,7 +330,14 @@ class AdvancedReflection(obfuscator_category.ICodeObfuscator):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
         try:
-            dangerous_api: Set[str] = set(util.get_dangerous_api())
+            # The list of methods using reflection is created for each obfuscation.
+            self.methods_with_reflection = 0
+            self.reflected_methods = {}
+            self.obfuscator_instructions_length = 0
+
+            self.set_accessible = obfuscation_info.reflection_set_accessible
+
+            dangerous_api: FrozenSet[str] = util.get_dangerous_api()
 
             obfuscator_smali_code: str = ""
 
@@ -397,9 +422,7 @@ class AdvancedReflection(obfuscator_category.ICodeObfuscator):
 
                             current_line_number += 1
 
-                            invoke_match = util.invoke_pattern.match(
-                                lines[current_line_number]
-                            )
+                            invoke_match = util.match_invoke(lines[current_line_number])
                             if invoke_match:
                                 method = (
                                     "{class_name}->{method_name}"
@@ -512,25 +535,38 @@ class AdvancedReflection(obfuscator_category.ICodeObfuscator):
 
                                         lines[move_result_index] = new_move_result
 
-                                # Add the original method to the list of methods using
-                                # reflection.
-                                obfuscator_smali_code += self.add_smali_reflection_code(
-                                    tmp_class_name, tmp_method, tmp_param
+                                # Add the original method to the list of methods
+                                # using reflection (only the first time it's found).
+                                reflected_method = "{0}->{1}({2}){3}".format(
+                                    tmp_class_name,
+                                    tmp_method,
+                                    tmp_param,
+                                    tmp_return_type,
+                                )
+                                reflection_index = self.reflected_methods.setdefault(
+                                    reflected_method, self.methods_with_reflection
                                 )
+                                if reflection_index == self.methods_with_reflection:
+                                    reflection_code = self.add_smali_reflection_code(
+                                        tmp_class_name,
+                                        tmp_method,
+                                        tmp_param,
+                                        reflection_index,
+                                    )
+                                    obfuscator_smali_code += reflection_code
+                                    self.methods_with_reflection += 1
 
                                 # Change the original code with code using reflection.
                                 lines[
                                     current_line_number
                                 ] = self.create_reflection_method(
-                                    self.methods_with_reflection,
+                                    reflection_index,
                                     method_local_count[method_number],
                                     tmp_is_virtual,
                                     tmp_register,
                                     tmp_param,
                                 )
 
-                                self.methods_with_reflection += 1
-
                                 # Add the registers needed for performing reflection.
                                 lines[index + 1] = "\t.locals {0}\n".format(
                                     method_local_count[method_number] + 4
@@ -547,8 +583,13 @@ class AdvancedReflection(obfuscator_category.ICodeObfuscator):
                 destination_dir, "AdvancedApiReflection.smali"
             )
             with open(destination_file, "w", encoding="utf-8") as api_reflection_smali:
-                reflection_code = util.get_advanced_api_reflection_smali_code().replace(
-                    "#!code_to_replace!#", obfuscator_smali_code
+                reflection_code = (
+                    util.get_advanced_api_reflection_smali_code()
+                    .replace(
+                        "#!methods_count!#",
+                        "{0:#x}".format(self.methods_with_reflection),
+                    )
+                    .replace("#!code_to_replace!#", obfuscator_smali_code)
                 )
                 api_reflection_smali.write(reflection_code)
 
@@ -5,6 +5,7 @@ import logging
 from obfuscapk import obfuscator_category
 from obfuscapk import util
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.smali_method_index import SmaliMethodIndex
 
 
 class ArithmeticBranch(obfuscator_category.ICodeObfuscator):
@@ -26,59 +27,55 @@ class ArithmeticBranch(obfuscator_category.ICodeObfuscator):
                 self.logger.debug(
                     'Inserting arithmetic computations in file "{0}"'.format(smali_file)
                 )
-                with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                    editing_method = False
-                    start_label = None
-                    end_label = None
-                    for line in in_file:
-                        if (
-                            line.startswith(".method ")
-                            and " abstract " not in line
-                            and " native " not in line
-                            and not editing_method
-                        ):
-                            # Entering method.
-                            out_file.write(line)
-                            editing_method = True
+                with util.inplace_edit_binary_file(smali_file) as (in_file, out_file):
+                    lines = in_file.readlines()
+                    for method in SmaliMethodIndex(lines).methods:
+                        if not method.has_code or (method.local_count or 0) < 2:
+                            continue
 
-                        elif line.startswith(".end method") and editing_method:
-                            # Exiting method.
-                            if start_label and end_label:
-                                out_file.write("\t:{0}\n".format(end_label))
-                                out_file.write("\tgoto/32 :{0}\n".format(start_label))
-                                start_label = None
-                                end_label = None
-                            out_file.write(line)
-                            editing_method = False
+                        # If there are at least 2 registers available, add a fake
+                        # branch at the beginning of the method: one branch will
+                        # continue from here, the other branch will go to the end of
+                        # the method and then will return here through a "goto"
+                        # instruction.
+                        v0, v1 = (
+                            util.get_random_int(1, 32),
+                            util.get_random_int(1, 32),
+                        )
+                        start_label = util.get_random_string(16)
+                        end_label = util.get_random_string(16)
+                        tmp_label = util.get_random_string(16)
+                        branch_code = (
+                            "\n\tconst v0, {v0}\n"
+                            "\tconst v1, {v1}\n"
+                            "\tadd-int v0, v0, v1\n"
+                            "\trem-int v0, v0, v1\n"
+                            "\tif-gtz v0, :{tmp_label}\n"
+                            "\tgoto/32 :{end_label}\n"
+                            "\t:{tmp_label}\n"
+                            "\t:{start_label}\n".format(
+                                v0=v0,
+                                v1=v1,
+                                tmp_label=tmp_label,
+                                end_label=end_label,
+                                start_label=start_label,
+                            )
+                        )
+                        locals_line = lines[method.locals_line]
+                        lines[method.locals_line] += util.with_line_ending(
+                            branch_code.encode(), locals_line
+                        )
 
-                        elif editing_method:
-                            # Inside method.
-                            out_file.write(line)
-                            match = util.locals_pattern.match(line)
-                            if match and int(match.group("local_count")) >= 2:
-                                # If there are at least 2 registers available, add a
-                                # fake branch at the beginning of the method: one branch
-                                # will continue from here, the other branch will go to
-                                # the end of the method and then will return here
-                                # through a "goto" instruction.
-                                v0, v1 = (
-                                    util.get_random_int(1, 32),
-                                    util.get_random_int(1, 32),
-                                )
-                                start_label = util.get_random_string(16)
-                                end_label = util.get_random_string(16)
-                                tmp_label = util.get_random_string(16)
-                                out_file.write("\n\tconst v0, {0}\n".format(v0))
-                                out_file.write("\tconst v1, {0}\n".format(v1))
-                                out_file.write("\tadd-int v0, v0, v1\n")
-                                out_file.write("\trem-int v0, v0, v1\n")
-                                out_file.write("\tif-gtz v0, :{0}\n".format(tmp_label))
-                                out_file.write("\tgoto/32 :{0}\n".format(end_label))
-                                out_file.write("\t:{0}\n".format(tmp_label))
-                                out_file.write("\t:{0}\n".format(start_label))
+                        end_code = "\t:{0}\n\tgoto/32 :{1}\n".format(
+                            end_label, start_label
+                        )
+                        end_line = lines[method.end]
+                        lines[method.end] = (
+                            util.with_line_ending(end_code.encode(), end_line)
+                            + end_line
+                        )
 
-                        else:
-                            out_file.write(line)
+                    out_file.writelines(lines)
 
         except Exception as e:
             self.logger.error(
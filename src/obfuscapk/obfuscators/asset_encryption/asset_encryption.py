@@ -10,6 +10,7 @@ from Crypto.Util.Padding import pad
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
+from obfuscapk.const_string_tracker import ConstStringTracker
 from obfuscapk.obfuscation import Obfuscation
 
 
@@ -54,13 +55,6 @@ class AssetEncryption(obfuscator_category.IEncryptionObfuscator):
                     with open(smali_file, "r", encoding="utf-8") as current_file:
                         lines = current_file.readlines()
 
-                    # Line numbers where an asset file is opened.
-                    asset_index: List[int] = []
-
-                    # Registers containing the strings with the names of the opened
-                    # asset files.
-                    asset_register: List[str] = []
-
                     # Names of the opened asset files.
                     asset_names: List[str] = []
 
@@ -69,50 +63,32 @@ class AssetEncryption(obfuscator_category.IEncryptionObfuscator):
                     # element in position n in asset_names is opened at the line in
                     # position n in asset_index_for_asset_names. So each time an asset
                     # file is encrypted, the corresponding line is changed to open the
-                    # encrypted file. A new variable is needed because asset_index could
-                    # have different indices than asset_names because there might be
-                    # assets loaded from other variables and not constant strings.
+                    # encrypted file. Assets loaded from other variables and not from
+                    # constant strings are not considered.
                     asset_index_for_asset_names: List[int] = []
 
+                    # Iterate the lines (only once) keeping track of the constant
+                    # strings held by the registers, and for each asset file open
+                    # instruction get the constant string containing the name of the
+                    # opened file (if any).
+                    const_string_tracker = ConstStringTracker()
                     for line_number, line in enumerate(lines):
                         invoke_match = open_asset_invoke_pattern.match(line)
                         if invoke_match:
                             # Asset file open instruction.
-                            asset_index.append(line_number)
-                            asset_register.append(invoke_match.group("param_register"))
-
-                    # Iterate the lines backwards (until the method declaration is
-                    # reached) and for each asset file open instruction find the
-                    # constant string containing the name of the opened file (if any).
-                    for asset_number, index in enumerate(asset_index):
-                        for line_number in range(index - 1, 0, -1):
-                            if lines[line_number].startswith(".method "):
-                                # Method declaration reached, no constant string found
-                                # for this asset file so proceed with the next (if any).
-                                break
-
                             # NOTE: if an asset is opened using a constant string, it
                             # will be encrypted. If other code opens the same assets but
                             # using a variable instead of a constant string, it won't
                             # work anymore and this case is not handled by this
                             # obfuscator.
-
-                            string_match = util.const_string_pattern.match(
-                                lines[line_number]
+                            asset_name = const_string_tracker.get_string(
+                                invoke_match.group("param_register")
                             )
-                            if (
-                                string_match
-                                and string_match.group("register")
-                                == asset_register[asset_number]
-                            ):
-                                # Asset file name string declaration.
-                                asset_names.append(string_match.group("string"))
-                                asset_index_for_asset_names.append(
-                                    asset_index[asset_number]
-                                )
+                            if asset_name is not None:
+                                asset_names.append(asset_name)
+                                asset_index_for_asset_names.append(line_number)
 
-                                # Proceed with the next asset file (if any).
-                                break
+                        const_string_tracker.update(line)
 
                     # Encrypt the the loaded asset files and replace the old code with
                     # new code to decrypt the encrypted asset files.
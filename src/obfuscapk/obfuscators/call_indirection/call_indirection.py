@@ -2,8 +2,9 @@
 
 import logging
 import re
+from collections import OrderedDict
 from io import StringIO
-from typing import List
+from typing import List, Tuple, Union
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
@@ -21,6 +22,13 @@ class CallIndirection(obfuscator_category.ICodeObfuscator):
 
         self.registers_pattern = re.compile(r"[vp]\d{1,3}")
 
+        # If not None, the calls of a class to the same method (with the same invoke
+        # type) use the same wrapper method, and this is the maximum number of
+        # wrapper methods to keep for reuse in each class (0 means no limit, the
+        # least recently used wrappers are no longer reused when the limit is
+        # reached). If None, a new wrapper method is added for every call.
+        self.wrapper_cache_size: Union[int, None] = None
+
     def is_range(self, invoke_type: str) -> bool:
         return "range" in invoke_type
 
@@ -46,6 +54,18 @@ class CallIndirection(obfuscator_category.ICodeObfuscator):
     def is_init(self, invoke_method: str) -> bool:
         return "<init>" in invoke_method or "<clinit>" in invoke_method
 
+    def get_wrapper_key(
+        self,
+        invoke_type: str,
+        invoke_object: str,
+        invoke_method: str,
+        invoke_param: str,
+        invoke_return: str,
+    ) -> Tuple[str, str, str, str, str]:
+        # The wrapper method depends only on the invoke type and on the invoked
+        # method (the registers are passed as they are).
+        return invoke_type, invoke_object, invoke_method, invoke_param, invoke_return
+
     def change_method_call(
         self,
         invoke_type: str,
@@ -57,12 +77,47 @@ class CallIndirection(obfuscator_category.ICodeObfuscator):
         class_name: str,
         new_method: StringIO,
         out_file,
-    ):
-        new_method_name = util.get_random_string(16)
-
+        wrapper_cache: "OrderedDict[Tuple[str, str, str, str, str], str]" = None,
+    ) -> bool:
         is_range_invocation = self.is_range(invoke_type)
         is_static_invocation = self.is_static(invoke_type)
 
+        add_param = "" if is_static_invocation else invoke_object
+        new_invoke = "invoke-static/range" if is_range_invocation else "invoke-static"
+
+        wrapper_key = self.get_wrapper_key(
+            invoke_type, invoke_object, invoke_method, invoke_param, invoke_return
+        )
+        if wrapper_cache is not None and wrapper_key in wrapper_cache:
+            new_method_name = wrapper_cache[wrapper_key]
+            wrapper_cache.move_to_end(wrapper_key)
+            is_new_method = False
+        else:
+            new_method_name = util.get_random_string(16)
+            is_new_method = True
+
+        # Insert the new method invocation in the smali file.
+        out_file.write(
+            "\t{invoke_type} {{{invoke_pass}}}, {class_name}->"
+            "{method_name}({add_param}{invoke_param}){invoke_return}\n".format(
+                invoke_type=new_invoke,
+                invoke_pass=invoke_pass,
+                class_name=class_name,
+                method_name=new_method_name,
+                add_param=add_param,
+                invoke_param=invoke_param,
+                invoke_return=invoke_return,
+            )
+        )
+
+        if not is_new_method:
+            return False
+
+        if wrapper_cache is not None:
+            wrapper_cache[wrapper_key] = new_method_name
+            if 0 < self.wrapper_cache_size < len(wrapper_cache):
+                wrapper_cache.popitem(last=False)
+
         register_list = self.get_registers(invoke_pass)
         if is_range_invocation:
             register_count = self.get_register_range_count(register_list)
@@ -95,23 +150,6 @@ class CallIndirection(obfuscator_category.ICodeObfuscator):
         if is_object_value:
             return_str = "return-object v0"
 
-        add_param = "" if is_static_invocation else invoke_object
-        new_invoke = "invoke-static/range" if is_range_invocation else "invoke-static"
-
-        # Insert the new method invocation in the smali file.
-        out_file.write(
-            "\t{invoke_type} {{{invoke_pass}}}, {class_name}->"
-            "{method_name}({add_param}{invoke_param}){invoke_return}\n".format(
-                invoke_type=new_invoke,
-                invoke_pass=invoke_pass,
-                class_name=class_name,
-                method_name=new_method_name,
-                add_param=add_param,
-                invoke_param=invoke_param,
-                invoke_return=invoke_return,
-            )
-        )
-
         # Prepare the new method(s) declaration (will be inserted later into code).
         new_method.write(
             ".method public static "
@@ -149,23 +187,59 @@ class CallIndirection(obfuscator_category.ICodeObfuscator):
         new_method.write("    {return_result}\n".format(return_result=return_str))
         new_method.write(".end method\n\n")
 
-    def update_method(self, smali_file: str, new_method: StringIO):
+        return True
+
+    def update_method(self, smali_file: str, max_methods_to_add: int) -> int:
+        # Every smali file contains a single class, so the wrappers can be reused only
+        # within the same file.
+        wrapper_cache = None
+        if self.wrapper_cache_size is not None:
+            wrapper_cache = OrderedDict()
+
+        added_methods = 0
+        new_method = StringIO()
+        following_lines = StringIO()
+
+        # The file is rewritten in a single pass: the new indirection methods are
+        # inserted in the direct methods section, which comes before the invocations
+        # to change, so the lines after the beginning of this section are buffered
+        # and written after the new methods (when the file is complete).
         with util.inplace_edit_file(smali_file) as (in_file, out_file):
+            current_out = out_file
             class_name = None
             for line in in_file:
                 if not class_name:
                     class_match = util.class_pattern.match(line)
                     if class_match:
                         class_name = class_match.group("class_name")
-                        out_file.write(line)
+                        current_out.write(line)
                         continue
 
-                invoke_match = util.invoke_pattern.match(line)
+                if current_out is out_file and line.startswith("# direct methods"):
+                    # The new indirection method(s) will be added here.
+                    out_file.write(line)
+                    current_out = following_lines
+                    continue
+
+                invoke_match = util.match_invoke(line)
+                if invoke_match and added_methods >= max_methods_to_add:
+                    # No more methods can be added, only the wrappers already added
+                    # can be used.
+                    wrapper_key = self.get_wrapper_key(
+                        invoke_match.group("invoke_type"),
+                        invoke_match.group("invoke_object"),
+                        invoke_match.group("invoke_method"),
+                        invoke_match.group("invoke_param"),
+                        invoke_match.group("invoke_return"),
+                    )
+                    if wrapper_cache is None or wrapper_key not in wrapper_cache:
+                        invoke_match = None
+
                 if invoke_match:
                     if not self.is_init(invoke_match.group("invoke_method")):
                         # The following function will write into the file the new
                         # method invocation.
-                        self.change_method_call(
+                        is_new_method = self.change_method_call(
                             invoke_match.group("invoke_type"),
                             invoke_match.group("invoke_pass"),
                             invoke_match.group("invoke_object"),
@@ -174,25 +248,22 @@ class CallIndirection(obfuscator_category.ICodeObfuscator):
                             invoke_match.group("invoke_return"),
                             class_name,
                             new_method,
-                            out_file,
+                            current_out,
+                            wrapper_cache,
                         )
+                        if is_new_method:
+                            added_methods += 1
                     else:
-                        out_file.write(line)
+                        current_out.write(line)
                 else:
-                    out_file.write(line)
+                    current_out.write(line)
 
-    def add_method(self, smali_file: str, new_method: StringIO):
-        with util.inplace_edit_file(smali_file) as (in_file, out_file):
-            for line in in_file:
-                if line.startswith("# direct methods"):
-                    # Add the new indirection method(s) in the direct methods section.
-                    out_file.write(line)
-                    out_file.write(new_method.getvalue())
-                else:
-                    out_file.write(line)
+            # Add the new indirection method(s) in the direct methods section (or at
+            # the end of the file, if the class has no direct methods section).
+            out_file.write(new_method.getvalue())
+            out_file.write(following_lines.getvalue())
 
-    def get_declared_method_number_in_text(self, text: str) -> int:
-        return sum(1 for line in text.splitlines() if line.startswith(".method "))
+        return added_methods
 
     def add_call_indirections(
         self, smali_files: List[str], max_methods_to_add: int, interactive: bool = False
@@ -207,12 +278,9 @@ class CallIndirection(obfuscator_category.ICodeObfuscator):
                 'Inserting call indirections in file "{0}"'.format(smali_file)
             )
             if added_methods < max_methods_to_add:
-                with StringIO() as new_method:
-                    self.update_method(smali_file, new_method)
-                    self.add_method(smali_file, new_method)
-                    added_methods += self.get_declared_method_number_in_text(
-                        new_method.getvalue()
-                    )
+                added_methods += self.update_method(
+                    smali_file, max_methods_to_add - added_methods
+                )
             else:
                 break
 
@@ -222,6 +290,8 @@ class CallIndirection(obfuscator_category.ICodeObfuscator):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
         try:
+            self.wrapper_cache_size = obfuscation_info.call_indirection_cache_size
+
             # There is a method limit for dex files.
             max_methods_to_add = obfuscation_info.get_remaining_methods_per_obfuscator()
 
@@ -1,15 +1,14 @@
 #!/usr/bin/env python3
 
 import logging
-import os
 import re
-import xml.etree.cElementTree as Xml
-from typing import List, Set, Dict, Union
-from xml.etree.cElementTree import Element
+from typing import Callable, Dict, List, Set, Tuple, Union
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
+from obfuscapk.identifier_hasher import IdentifierHasher
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.xml_rewriter import StreamingXmlRewriter, XmlParents
 
 
 class ClassRename(obfuscator_category.IRenameObfuscator):
@@ -23,107 +22,119 @@ class ClassRename(obfuscator_category.IRenameObfuscator):
             r'\s+name\s=\s"(?P<subclass_name>\S+?)"', re.UNICODE
         )
 
-        self.string_pattern = re.compile(r'"(?P<string_value>\S+?)"', re.UNICODE)
-
         self.split_class_pattern = re.compile(r"[/$]")
 
         self.package_name: Union[str, None] = None
         self.encrypted_package_name: Union[str, None] = None
-        self.ignore_package_names = []
+        # Replaced with the check of the current obfuscation when running the
+        # obfuscator (see Obfuscation.is_ignored_class).
+        self.is_ignored_class: Callable[[str], bool] = lambda class_name: False
 
         # Will be populated before running the class rename obfuscator.
         self.class_name_to_smali_file: dict = {}
 
-    def encrypt_identifier(self, identifier: str) -> str:
-        identifier_md5 = util.get_string_md5(identifier)
-        return "p{0}".format(identifier_md5.lower()[:8])
+        # Replaced with the one of the current obfuscation when running the obfuscator.
+        self.identifier_hasher: IdentifierHasher = IdentifierHasher()
 
-    def slash_to_dot_notation_for_classes(
-        self, rename_transformations: Dict[str, str]
-    ) -> Dict[str, str]:
-        dot_rename_transformations: Dict[str, str] = {}
+        self.is_planning_renames = True
 
-        # Remove leading L and trailing ; from class names and replace / and $ with .
-        for old_name, new_name in rename_transformations.items():
-            dot_rename_transformations[
-                old_name[1:-1].replace("/", ".").replace("$", ".")
-            ] = (new_name[1:-1].replace("/", ".").replace("$", "."))
+    def encrypt_identifier(self, identifier: str) -> str:
+        return self.identifier_hasher.get_name("p", identifier)
 
-        return dot_rename_transformations
+    def transform_package_name(self, manifest_file: str):
+        def new_manifest_attributes(
+            tag: str, attributes: Dict[str, str], parents: XmlParents
+        ) -> Union[Dict[str, str], None]:
+            # Only the root <manifest> element contains the package name.
+            if parents or tag != "manifest":
+                return None
 
-    def transform_package_name(self, manifest_xml_root: Element):
-        self.encrypted_package_name = ".".join(
-            [self.encrypt_identifier(token) for token in self.package_name.split(".")]
-        )
+            self.package_name = attributes.get("package", None)
+            if not self.package_name:
+                return None
+
+            self.encrypted_package_name = ".".join(
+                [
+                    self.encrypt_identifier(token)
+                    for token in self.package_name.split(".")
+                ]
+            )
 
-        # Rename package name in manifest file.
-        manifest_xml_root.set("package", self.encrypted_package_name)
-        manifest_xml_root.set(
-            "{http://schemas.android.com/apk/res/android}sharedUserId",
-            "{0}.uid.shared".format(util.get_random_string(16)),
+            return {
+                "package": self.encrypted_package_name,
+                "android:sharedUserId": "{0}.uid.shared".format(
+                    util.get_random_string(16)
+                ),
+            }
+
+        # Rename package name in manifest file (only the attributes of the root
+        # element are rewritten, the rest of the file is copied unchanged).
+        StreamingXmlRewriter(new_attributes=new_manifest_attributes).rewrite(
+            manifest_file
         )
 
-    def rename_class_declarations(
+    def get_class_rename_transformations(
         self, smali_files: List[str], interactive: bool = False
-    ) -> dict:
-        renamed_classes = {}
+    ) -> Tuple[Dict[str, str], Dict[str, Tuple[str, str]]]:
+        # Class name -> (tokens of the class name, each one with a flag telling if
+        # it has to be encrypted, and the separators following the tokens).
+        class_name_tokens: Dict[str, Tuple[List[Tuple[str, bool]], List[str]]] = {}
 
-        # Search for class declarations that can be renamed.
+        # Class name -> name of its inner class (from the InnerClass annotation).
+        inner_class_names: Dict[str, str] = {}
+
+        # All the identifiers to encrypt, their new names are computed at once after
+        # reading all the class declarations.
+        identifiers: Set[str] = set()
+
+        # Search for class declarations that can be renamed (the files are only read,
+        # they will be rewritten by the rename planner).
         for smali_file in util.show_list_progress(
             smali_files,
             interactive=interactive,
             description="Renaming class declarations",
         ):
             annotation_flag = False
-            with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                skip_remaining_lines = False
+            with open(smali_file, "r", encoding="utf-8") as current_file:
                 class_name = None
                 r_class = False
-                for line in in_file:
-                    if skip_remaining_lines:
-                        out_file.write(line)
-                        continue
-
+                for line in current_file:
                     if not class_name:
                         class_match = util.class_pattern.match(line)
                         if class_match:
                             class_name = class_match.group("class_name")
 
-                            ignore_class = class_name.startswith(
-                                tuple(self.ignore_package_names)
-                            )
+                            # Every smali file contains a class.
+                            self.class_name_to_smali_file[class_name] = smali_file
 
-                            # Split class name to its components and encrypt them.
-                            class_tokens = self.split_class_pattern.split(
-                                class_name[1:-1]
-                            )
+                            ignore_class = self.is_ignored_class(class_name)
 
-                            encrypted_class_name = "L"
-                            separator_index = 1
-                            for token in class_tokens:
-                                separator_index += len(token)
+                            # Split class name to its components (the last one is
+                            # followed by ";").
+                            class_tokens: List[Tuple[str, bool]] = []
+                            for token in self.split_class_pattern.split(
+                                class_name[1:-1]
+                            ):
                                 if token == "R":
                                     r_class = True
-                                if token.isdigit():
-                                    encrypted_class_name += (
-                                        token + class_name[separator_index]
-                                    )
-                                elif not r_class and not ignore_class:
-                                    encrypted_class_name += (
-                                        self.encrypt_identifier(token)
-                                        + class_name[separator_index]
-                                    )
-                                else:
-                                    encrypted_class_name += (
-                                        token + class_name[separator_index]
-                                    )
-                                separator_index += 1
-
-                            out_file.write(
-                                line.replace(class_name, encrypted_class_name)
+                                encrypt_token = (
+                                    not token.isdigit()
+                                    and not r_class
+                                    and not ignore_class
+                                )
+                                if encrypt_token:
+                                    identifiers.add(token)
+                                class_tokens.append((token, encrypt_token))
+
+                            class_separators = self.split_class_pattern.findall(
+                                class_name[1:-1]
                             )
+                            class_separators.append(";")
 
-                            renamed_classes[class_name] = encrypted_class_name
+                            class_name_tokens[class_name] = (
+                                class_tokens,
+                                class_separators,
+                            )
                             continue
 
                     if (
@@ -131,7 +142,6 @@ class ClassRename(obfuscator_category.IRenameObfuscator):
                         == ".annotation system Ldalvik/annotation/InnerClass;"
                     ):
                         annotation_flag = True
-                        out_file.write(line)
                         continue
 
                     if annotation_flag and 'name = "' in line:
@@ -139,226 +149,95 @@ class ClassRename(obfuscator_category.IRenameObfuscator):
                         subclass_match = self.subclass_name_pattern.match(line)
                         if subclass_match and not r_class:
                             subclass_name = subclass_match.group("subclass_name")
-                            out_file.write(
-                                line.replace(
-                                    subclass_name,
-                                    self.encrypt_identifier(subclass_name),
-                                )
-                            )
-                        else:
-                            out_file.write(line)
+                            inner_class_names[class_name] = subclass_name
+                            identifiers.add(subclass_name)
                         continue
 
                     if line.strip() == ".end annotation":
                         annotation_flag = False
-                        out_file.write(line)
                         continue
 
                     # Method declaration reached, no more class definitions in
                     # this file.
                     if line.startswith(".method "):
-                        skip_remaining_lines = True
-                        out_file.write(line)
-                    else:
-                        out_file.write(line)
-
-        return renamed_classes
-
-    def rename_class_usages_in_smali(
-        self,
-        smali_files: List[str],
-        rename_transformations: dict,
-        interactive: bool = False,
-    ):
-        dot_rename_transformations = self.slash_to_dot_notation_for_classes(
-            rename_transformations
-        )
-
-        # Add package name.
-        dot_rename_transformations[self.package_name] = self.encrypted_package_name
-
-        for smali_file in util.show_list_progress(
-            smali_files,
-            interactive=interactive,
-            description="Renaming class usages in smali files",
-        ):
-            with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                for line in in_file:
-                    # Rename classes used as strings with . instead of /.
-                    string_match = self.string_pattern.search(line)
-                    if (
-                        string_match
-                        and string_match.group("string_value")
-                        in dot_rename_transformations
-                    ):
-                        line = line.replace(
-                            string_match.group("string_value"),
-                            dot_rename_transformations[
-                                string_match.group("string_value")
-                            ],
-                        )
-
-                    # Sometimes classes are used in annotations as strings
-                    # without trailing ;
-                    if (
-                        string_match
-                        and "{0};".format(string_match.group("string_value"))
-                        in rename_transformations
-                    ):
-                        line = line.replace(
-                            string_match.group("string_value"),
-                            rename_transformations[
-                                "{0};".format(string_match.group("string_value"))
-                            ][:-1],
-                        )
-
-                    # Rename classes used with the "classic" syntax
-                    # (leading L and trailing ;).
-                    class_names = util.class_name_pattern.findall(line)
-                    for class_name in class_names:
-                        if class_name in rename_transformations:
-                            line = line.replace(
-                                class_name, rename_transformations[class_name]
-                            )
+                        break
 
-                    out_file.write(line)
+        encrypted_identifiers = self.identifier_hasher.get_names("p", identifiers)
 
-    def rename_class_usages_in_xml(
-        self,
-        xml_files: List[str],
-        rename_transformations: dict,
-        interactive: bool = False,
-    ):
-        dot_rename_transformations = self.slash_to_dot_notation_for_classes(
-            rename_transformations
-        )
-
-        # Add package name.
-        dot_rename_transformations[self.package_name] = self.encrypted_package_name
-
-        for xml_file in util.show_list_progress(
-            xml_files,
-            interactive=interactive,
-            description="Renaming class usages in xml files",
-        ):
-            with open(xml_file, "r", encoding="utf-8") as current_file:
-                file_content = current_file.read()
-
-            # Replace strings from longest to shortest (to avoid replacing
-            # partial strings).
-            for old_name in sorted(dot_rename_transformations, reverse=True, key=len):
-                file_content = file_content.replace(
-                    old_name, dot_rename_transformations[old_name]
+        renamed_classes: Dict[str, str] = {}
+        for class_name, (class_tokens, class_separators) in class_name_tokens.items():
+            encrypted_class_name = "L"
+            for (token, encrypt_token), separator in zip(
+                class_tokens, class_separators
+            ):
+                if encrypt_token:
+                    encrypted_class_name += encrypted_identifiers[token] + separator
+                else:
+                    encrypted_class_name += token + separator
+            renamed_classes[class_name] = encrypted_class_name
+
+        # The encrypted identifiers are unique, but a new class name could still be
+        # equal to the name of a class that is not renamed (e.g., an ignored class).
+        new_class_names: Dict[str, str] = {}
+        for class_name, encrypted_class_name in renamed_classes.items():
+            if encrypted_class_name in new_class_names:
+                raise Exception(
+                    'Classes "{0}" and "{1}" would be both renamed to "{2}"'.format(
+                        new_class_names[encrypted_class_name],
+                        class_name,
+                        encrypted_class_name,
+                    )
                 )
+            new_class_names[encrypted_class_name] = class_name
 
-                # Activity without package name (".ActivityName")
-                if (
-                    '"{0}"'.format(old_name.replace(self.package_name, ""))
-                    in file_content
-                ):
-                    file_content = file_content.replace(
-                        '"{0}"'.format(old_name.replace(self.package_name, "")),
-                        '"{0}"'.format(
-                            dot_rename_transformations[old_name].replace(
-                                self.encrypted_package_name, ""
-                            )
-                        ),
-                    )
+        renamed_inner_classes: Dict[str, Tuple[str, str]] = {
+            class_name: (subclass_name, encrypted_identifiers[subclass_name])
+            for class_name, subclass_name in inner_class_names.items()
+        }
 
-            with open(xml_file, "w", encoding="utf-8") as current_file:
-                current_file.write(file_content)
+        return renamed_classes, renamed_inner_classes
 
     def obfuscate(self, obfuscation_info: Obfuscation):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
         try:
-            Xml.register_namespace(
-                "android", "http://schemas.android.com/apk/res/android"
-            )
+            self.identifier_hasher = obfuscation_info.get_identifier_hasher()
 
-            xml_parser = Xml.XMLParser(encoding="utf-8")
-            manifest_tree = Xml.parse(
-                obfuscation_info.get_manifest_file(), parser=xml_parser
-            )
-            manifest_root = manifest_tree.getroot()
+            self.transform_package_name(obfuscation_info.get_manifest_file())
 
-            self.package_name = manifest_root.get("package")
             if not self.package_name:
                 raise Exception(
                     "Unable to extract package name from application manifest"
                 )
 
-            # Get a mapping between class name and smali file path.
-            for smali_file in util.show_list_progress(
-                obfuscation_info.get_smali_files(),
-                interactive=obfuscation_info.interactive,
-                description="Class name to smali file mapping",
-            ):
-                with open(smali_file, "r", encoding="utf-8") as current_file:
-                    class_name = None
-                    for line in current_file:
-                        if not class_name:
-                            # Every smali file contains a class.
-                            class_match = util.class_pattern.match(line)
-                            if class_match:
-                                self.class_name_to_smali_file[
-                                    class_match.group("class_name")
-                                ] = smali_file
-                                break
-
-            self.transform_package_name(manifest_root)
-
-            # Write the changes into the manifest file.
-            manifest_tree.write(obfuscation_info.get_manifest_file(), encoding="utf-8")
-
-            xml_files: Set[str] = set(
-                os.path.join(root, file_name)
-                for root, dir_names, file_names in os.walk(
-                    obfuscation_info.get_resource_directory()
-                )
-                for file_name in file_names
-                if file_name.endswith(".xml")
-                and (
-                    "layout" in root or "xml" in root
-                )  # Only res/layout-*/ and res/xml-*/ folders.
-            )
-            xml_files.add(obfuscation_info.get_manifest_file())
-
-            # TODO: use the following code to rename only the classes declared in
-            #  application's package.
-
-            # package_smali_files: Set[str] = set(
-            #     smali_file
-            #     for class_name, smali_file in self.class_name_to_smali_file.items()
-            #     if class_name[1:].startswith(self.package_name.replace(".", "/"))
-            # )
-            #
-            # # Rename the classes declared in the application's package.
-            # class_rename_transformations = self.rename_class_declarations(
-            #     list(package_smali_files), obfuscation_info.interactive
-            # )
-
-            # Get user defined ignore package list.
-            self.ignore_package_names = obfuscation_info.get_ignore_package_names()
-
-            # Rename all classes declared in smali files.
-            class_rename_transformations = self.rename_class_declarations(
-                obfuscation_info.get_smali_files(), obfuscation_info.interactive
-            )
+            # TODO: use the class name to smali file mapping (populated when
+            #  looking for class declarations) to rename only the classes declared
+            #  in application's package.
+
+            # The classes in the user defined ignore package list are not renamed.
+            self.is_ignored_class = obfuscation_info.is_ignored_class
 
-            # Update renamed classes through all the smali files.
-            self.rename_class_usages_in_smali(
-                obfuscation_info.get_smali_files(),
+            # Find all the classes declared in smali files and the corresponding new
+            # names.
+            (
                 class_rename_transformations,
-                obfuscation_info.interactive,
+                inner_class_rename_transformations,
+            ) = self.get_class_rename_transformations(
+                obfuscation_info.get_smali_files(), obfuscation_info.interactive
             )
 
-            # Update renamed classes through all the xml files.
-            self.rename_class_usages_in_xml(
-                list(xml_files),
+            # The renamed classes are updated through all the smali and xml files
+            # by the rename planner (together with the renaming planned by the other
+            # rename obfuscators, if any).
+            rename_planner = obfuscation_info.get_rename_planner()
+            rename_planner.add_class_renames(
                 class_rename_transformations,
-                obfuscation_info.interactive,
+                self.package_name,
+                self.encrypted_package_name,
+                inner_class_rename_transformations,
             )
+            if not obfuscation_info.defer_rename_rewrite:
+                obfuscation_info.rewrite_planned_renames()
 
         except Exception as e:
             self.logger.error(
@@ -4,7 +4,7 @@ import logging
 import os
 import re
 from binascii import hexlify
-from typing import List, Set
+from typing import List, Set, Union
 
 from Crypto.Cipher import AES
 from Crypto.Protocol.KDF import PBKDF2
@@ -13,6 +13,7 @@ from Crypto.Util.Padding import pad
 from obfuscapk import obfuscator_category
 from obfuscapk import util
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.smali_method_index import SmaliMethodIndex
 
 
 class ConstStringEncryption(obfuscator_category.IEncryptionObfuscator):
@@ -24,6 +25,11 @@ class ConstStringEncryption(obfuscator_category.IEncryptionObfuscator):
 
         self.encryption_secret = "This-key-need-to-be-32-character"
 
+        # The character used to separate the static strings of a class when they are
+        # packed into a single encrypted blob (see decryptStringBlob method in
+        # DecryptString.smali).
+        self.blob_separator = "\u0000"
+
     def encrypt_string(self, string_to_encrypt: str) -> str:
         # This is needed to remove the escaping added by Python. For example, if we
         # find in smali the instruction const-string v0, "\"message\"" Android will
@@ -34,6 +40,26 @@ class ConstStringEncryption(obfuscator_category.IEncryptionObfuscator):
             "unicode_escape"
         )
 
+        return self.encrypt_unescaped_string(string_to_encrypt)
+
+    def encrypt_string_blob(self, strings_to_encrypt: List[str]) -> Union[str, None]:
+        # Pack all the strings into a single blob (using a separator that will be used
+        # to split the decrypted blob at runtime) and encrypt it. If the separator is
+        # contained in any of the strings, the blob can't be created and None is
+        # returned.
+        unescaped_strings = [
+            string_to_encrypt.encode(errors="replace").decode("unicode_escape")
+            for string_to_encrypt in strings_to_encrypt
+        ]
+
+        if any(self.blob_separator in string for string in unescaped_strings):
+            return None
+
+        return self.encrypt_unescaped_string(
+            self.blob_separator.join(unescaped_strings)
+        )
+
+    def encrypt_unescaped_string(self, string_to_encrypt: str) -> str:
         key = PBKDF2(
             password=self.encryption_secret,
             salt=self.encryption_secret.encode(),
@@ -47,6 +73,65 @@ class ConstStringEncryption(obfuscator_category.IEncryptionObfuscator):
         ).decode()
         return encrypted_string
 
+    def get_static_string_encryption_code(
+        self, class_name: str, string_names: List[str], string_values: List[str]
+    ) -> str:
+        static_string_encryption_code = ""
+        for string_name, string_value in zip(string_names, string_values):
+            # Initialize the static string from an encrypted string.
+            static_string_encryption_code += (
+                '\tconst-string/jumbo v0, "{enc_string}"\n'
+                "\n\tinvoke-static {{v0}}, "
+                "Lcom/decryptstringmanager/DecryptString"
+                ";->decryptString(Ljava/lang/String;)Ljava/lang/String;\n"
+                "\n\tmove-result-object v0\n"
+                "\n\tsput-object v0, {class_name}->"
+                "{string_name}:Ljava/lang/String;\n\n".format(
+                    enc_string=self.encrypt_string(string_value),
+                    class_name=class_name,
+                    string_name=string_name,
+                )
+            )
+
+        return static_string_encryption_code
+
+    def get_packed_static_string_encryption_code(
+        self, class_name: str, string_names: List[str], string_values: List[str]
+    ) -> str:
+        encrypted_blob = self.encrypt_string_blob(string_values)
+        if encrypted_blob is None:
+            # The strings can't be packed, the caller has to encrypt them one by one.
+            return ""
+
+        # Decrypt all the static strings with a single call and then initialize each
+        # static string from the resulting array (v0 holds the array, v1 is used for
+        # the index and then for the element).
+        static_string_encryption_code = (
+            '\tconst-string/jumbo v0, "{enc_blob}"\n'
+            "\n\tinvoke-static {{v0}}, "
+            "Lcom/decryptstringmanager/DecryptString"
+            ";->decryptStringBlob(Ljava/lang/String;)[Ljava/lang/String;\n"
+            "\n\tmove-result-object v0\n\n".format(enc_blob=encrypted_blob)
+        )
+        for string_number, string_name in enumerate(string_names):
+            if string_number <= 0x7FFF:
+                const_instruction = "const/16"
+            else:
+                const_instruction = "const"
+            static_string_encryption_code += (
+                "\t{const} v1, {string_number:#x}\n"
+                "\n\taget-object v1, v0, v1\n"
+                "\n\tsput-object v1, {class_name}->"
+                "{string_name}:Ljava/lang/String;\n\n".format(
+                    const=const_instruction,
+                    string_number=string_number,
+                    class_name=class_name,
+                    string_name=string_name,
+                )
+            )
+
+        return static_string_encryption_code
+
     def obfuscate(self, obfuscation_info: Obfuscation):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
@@ -54,12 +139,15 @@ class ConstStringEncryption(obfuscator_category.IEncryptionObfuscator):
         try:
             encrypted_strings: Set[str] = set()
 
+            # If True, the static strings of each class are decrypted all together with
+            # a single call in the static constructor.
+            pack_static_strings = obfuscation_info.pack_static_strings
+
             # .field <other_optional_stuff> <string_name>:Ljava/lang/String; =
             # "<string_value>"
             static_string_pattern = re.compile(
-                r"\.field.+?static.+?(?P<string_name>\S+?):"
-                r'Ljava/lang/String;\s=\s"(?P<string_value>.+)"',
-                re.UNICODE,
+                rb"\.field.+?static.+?(?P<string_name>\S+?):"
+                rb'Ljava/lang/String;\s=\s"(?P<string_value>.+)"'
             )
 
             for smali_file in util.show_list_progress(
@@ -71,7 +159,9 @@ class ConstStringEncryption(obfuscator_category.IEncryptionObfuscator):
                     'Encrypting constant strings in file "{0}"'.format(smali_file)
                 )
 
-                with open(smali_file, "r", encoding="utf-8") as current_file:
+                # The smali file is processed in binary mode, only the names and the
+                # strings that are actually used are decoded.
+                with open(smali_file, "rb") as current_file:
                     lines = current_file.readlines()
 
                 class_name = None
@@ -85,36 +175,25 @@ class ConstStringEncryption(obfuscator_category.IEncryptionObfuscator):
                 # Values of the static strings.
                 static_string_value: List[str] = []
 
-                direct_methods_line = -1
-                static_constructor_line = -1
-
                 # Line numbers where a constant string is declared.
                 string_index: List[int] = []
 
                 # Registers containing the constant strings.
                 string_register: List[str] = []
 
-                # Values of the constant strings.
-                string_value: List[str] = []
+                # Values of the constant strings (not decoded yet).
+                string_value: List[bytes] = []
+
+                # The positions of the methods and of their local registers.
+                method_index = SmaliMethodIndex(lines)
 
-                current_local_count = 0
                 for line_number, line in enumerate(lines):
                     if not class_name:
-                        class_match = util.class_pattern.match(line)
+                        class_match = util.class_bytes_pattern.match(line)
                         if class_match:
-                            class_name = class_match.group("class_name")
+                            class_name = class_match.group("class_name").decode()
                             continue
 
-                    if line.startswith("# direct methods"):
-                        direct_methods_line = line_number
-                        continue
-
-                    if line.startswith(".method") and line.strip().endswith(
-                        "static constructor <clinit>()V"
-                    ):
-                        static_constructor_line = line_number
-                        continue
-
                     static_string_match = static_string_pattern.match(line)
                     if static_string_match and static_string_match.group(
                         "string_value"
@@ -122,115 +201,125 @@ class ConstStringEncryption(obfuscator_category.IEncryptionObfuscator):
                         # A static non empty string initialization was found.
                         static_string_index.append(line_number)
                         static_string_name.append(
-                            static_string_match.group("string_name")
+                            static_string_match.group("string_name").decode()
                         )
                         static_string_value.append(
-                            static_string_match.group("string_value")
+                            static_string_match.group("string_value").decode()
                         )
 
-                    # We are iterating the lines in order, so each time we enter a
-                    # method we'll find the declaration with the number of local
-                    # registers available. When we'll encounter a constant string later
-                    # in the body of the method, we'll look at its register value and if
-                    # it's greater than 15 we won't encrypt it (the invoke instruction
-                    # that we need later won't take registers with values greater
-                    # than 15).
-                    match = util.locals_pattern.match(line)
-                    if match:
-                        current_local_count = int(match.group("local_count"))
-                        continue
-
-                    # If the constant string has a register v0-v15 we can proceed with
-                    # the encryption, but if it uses a p<number> register, before
-                    # encrypting we have to check if <number> + locals <= 15.
-                    string_match = util.const_string_pattern.match(line)
+                    # When a constant string is found in the body of a method, look at
+                    # its register value and if it's greater than 15 don't encrypt it
+                    # (the invoke instruction that we need later won't take registers
+                    # with values greater than 15). If the constant string has a
+                    # register v0-v15 we can proceed with the encryption, but if it
+                    # uses a p<number> register, before encrypting we have to check if
+                    # <number> + locals <= 15 (the number of local registers is
+                    # declared at the beginning of the method).
+                    string_match = util.match_const_string_bytes(line)
                     if string_match and string_match.group("string"):
-                        reg_type = string_match.group("register")[:1]
-                        reg_number = int(string_match.group("register")[1:])
+                        register = string_match.group("register").decode()
+                        reg_type = register[:1]
+                        reg_number = int(register[1:])
+                        method = method_index.get_method_at(line_number)
                         if (reg_type == "v" and reg_number <= 15) or (
-                            reg_type == "p" and reg_number + current_local_count <= 15
+                            reg_type == "p"
+                            and method is not None
+                            and method.local_count is not None
+                            and reg_number + method.local_count <= 15
                         ):
                             # A non empty string was found in a register <= 15.
                             string_index.append(line_number)
-                            string_register.append(string_match.group("register"))
+                            string_register.append(register)
                             string_value.append(string_match.group("string"))
 
                 # Const string encryption.
 
                 for string_number, index in enumerate(string_index):
-                    lines[index] = (
+                    decoded_string = string_value[string_number].decode()
+                    string_encryption_code = (
                         '\tconst-string/jumbo {register}, "{enc_string}"\n'
                         "\n\tinvoke-static {{{register}}}, "
                         "Lcom/decryptstringmanager/DecryptString"
                         ";->decryptString(Ljava/lang/String;)Ljava/lang/String;\n"
                         "\n\tmove-result-object {register}\n".format(
                             register=string_register[string_number],
-                            enc_string=self.encrypt_string(string_value[string_number]),
+                            enc_string=self.encrypt_string(decoded_string),
                         )
                     )
+                    lines[index] = util.with_line_ending(
+                        string_encryption_code.encode(), lines[index]
+                    )
 
-                    encrypted_strings.add(string_value[string_number])
+                    encrypted_strings.add(decoded_string)
 
                 # Static string encryption.
 
-                static_string_encryption_code = ""
-                for string_number, index in enumerate(static_string_index):
+                for index in static_string_index:
                     # Remove the original initialization.
-                    lines[index] = "{0}\n".format(lines[index].split(" = ")[0])
+                    field_declaration = lines[index].split(b" = ")[0]
+                    lines[index] = field_declaration + util.with_line_ending(
+                        b"\n", lines[index]
+                    )
 
-                    # Initialize the static string from an encrypted string.
-                    static_string_encryption_code += (
-                        '\tconst-string/jumbo v0, "{enc_string}"\n'
-                        "\n\tinvoke-static {{v0}}, "
-                        "Lcom/decryptstringmanager/DecryptString"
-                        ";->decryptString(Ljava/lang/String;)Ljava/lang/String;\n"
-                        "\n\tmove-result-object v0\n"
-                        "\n\tsput-object v0, {class_name}->"
-                        "{string_name}:Ljava/lang/String;\n\n".format(
-                            enc_string=self.encrypt_string(
-                                static_string_value[string_number]
-                            ),
-                            class_name=class_name,
-                            string_name=static_string_name[string_number],
+                static_string_encryption_code = ""
+                needed_registers = 1
+                if pack_static_strings and len(static_string_index) > 1:
+                    static_string_encryption_code = (
+                        self.get_packed_static_string_encryption_code(
+                            class_name, static_string_name, static_string_value
+                        )
+                    )
+                    needed_registers = 2
+                if not static_string_encryption_code:
+                    static_string_encryption_code = (
+                        self.get_static_string_encryption_code(
+                            class_name, static_string_name, static_string_value
                         )
                     )
+                    needed_registers = 1
 
-                    encrypted_strings.add(static_string_value[string_number])
+                encrypted_strings.update(static_string_value)
 
                 if static_string_encryption_code != "":
-                    if static_constructor_line != -1:
+                    static_constructor = method_index.get_static_constructor()
+                    if static_constructor is not None:
                         # Add static string encryption to the existing static constructor.
-                        local_match = util.locals_pattern.match(
-                            lines[static_constructor_line + 1]
-                        )
-                        if local_match:
-                            # At least one register is needed.
-                            local_count = int(local_match.group("local_count"))
-                            if local_count == 0:
-                                lines[static_constructor_line + 1] = "\t.locals 1\n"
-                            lines[static_constructor_line + 2] = "\n{0}".format(
-                                static_string_encryption_code
+                        locals_line = static_constructor.locals_line
+                        if locals_line == static_constructor.start + 1:
+                            # At least the needed registers have to be available (the
+                            # static constructor takes no parameters, so the number of
+                            # local registers can be safely increased).
+                            if static_constructor.local_count < needed_registers:
+                                new_locals = "\t.locals {0}\n".format(needed_registers)
+                                lines[locals_line] = util.with_line_ending(
+                                    new_locals.encode(), lines[locals_line]
+                                )
+                            new_code = "\n{0}".format(static_string_encryption_code)
+                            lines[locals_line + 1] = util.with_line_ending(
+                                new_code.encode(), lines[locals_line + 1]
                             )
                     else:
                         # Add a new static constructor for the static string encryption.
-                        if direct_methods_line != -1:
-                            new_constructor_line = direct_methods_line
-                        else:
-                            new_constructor_line = len(lines) - 1
+                        new_constructor_line = method_index.sections.get(
+                            "direct methods", len(lines) - 1
+                        )
 
-                        lines[new_constructor_line] = (
-                            "{original}"
+                        static_constructor_code = (
                             ".method static constructor <clinit>()V\n"
-                            "\t.locals 1\n\n"
+                            "\t.locals {local_count}\n\n"
                             "{encryption_code}"
                             "\treturn-void\n"
                             ".end method\n\n".format(
-                                original=lines[new_constructor_line],
+                                local_count=needed_registers,
                                 encryption_code=static_string_encryption_code,
                             )
                         )
+                        lines[new_constructor_line] += util.with_line_ending(
+                            static_constructor_code.encode(),
+                            lines[new_constructor_line],
+                        )
 
-                with open(smali_file, "w", encoding="utf-8") as current_file:
+                with open(smali_file, "wb") as current_file:
                     current_file.writelines(lines)
 
             if (
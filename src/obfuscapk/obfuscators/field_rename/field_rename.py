@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 
 import logging
-from typing import List, Set
+from typing import Callable, Dict, List, Set, Tuple
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
+from obfuscapk.identifier_hasher import IdentifierHasher
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.smali_lexer import SmaliLexer, SmaliLineKind
 
 
 class FieldRename(obfuscator_category.IRenameObfuscator):
@@ -15,147 +17,105 @@ class FieldRename(obfuscator_category.IRenameObfuscator):
         )
         super().__init__()
 
-        self.ignore_package_names = []
+        # Replaced with the check of the current obfuscation when running the
+        # obfuscator (see Obfuscation.is_ignored_class).
+        self.is_ignored_class: Callable[[str], bool] = lambda class_name: False
+
+        # Replaced with the one of the current obfuscation when running the obfuscator.
+        self.identifier_hasher: IdentifierHasher = IdentifierHasher()
+        self.smali_lexer: SmaliLexer = SmaliLexer()
 
         self.is_adding_fields = True
+        self.is_planning_renames = True
 
         self.max_fields_to_add = 0
         self.added_fields = 0
 
     def rename_field(self, field_name: str) -> str:
-        field_md5 = util.get_string_md5(field_name)
-        return "f{0}".format(field_md5.lower()[:8])
+        return self.identifier_hasher.get_name("f", field_name)
 
     def get_sdk_class_names(self, smali_files: List[str]) -> Set[str]:
         class_names: Set[str] = set()
         for smali_file in smali_files:
-            with open(smali_file, "r", encoding="utf-8") as current_file:
-                for line in current_file:
-                    class_match = util.class_pattern.match(line)
-                    if class_match:
-                        # This is probably a SDK class, but we have its declaration so
-                        # we can change the fields inside it.
-                        if class_match.group("class_name").startswith(
-                            ("Landroid", "Ljava")
-                        ):
-                            class_names.add(class_match.group("class_name"))
-                        # There is only one class declaration per file.
-                        break
+            for smali_line in self.smali_lexer.lex_file(smali_file):
+                if smali_line.kind is SmaliLineKind.CLASS:
+                    # This is probably a SDK class, but we have its declaration so
+                    # we can change the fields inside it.
+                    if smali_line.class_name.startswith(("Landroid", "Ljava")):
+                        class_names.add(smali_line.class_name)
+                    # There is only one class declaration per file.
+                    break
         return class_names
 
-    def rename_field_declarations(
+    def get_field_rename_transformations(
         self, smali_files: List[str], interactive: bool = False
-    ) -> Set[str]:
-        renamed_fields: Set[str] = set()
-
-        # Search for field definitions that can be renamed.
+    ) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+        # Field declaration (class_name->field_name:field_type) -> original name of
+        # the field.
+        field_names: Dict[str, str] = {}
+        added_fields: Dict[str, List[str]] = {}
+
+        # Search for field definitions that can be renamed (the files are only read,
+        # they will be rewritten by the rename planner).
         for smali_file in util.show_list_progress(
             smali_files,
             interactive=interactive,
             description="Renaming field declarations",
         ):
-            with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                class_name = None
-                for line in in_file:
-                    ignore = False
-
-                    if not class_name:
-                        class_match = util.class_pattern.match(line)
-                        if class_match:
-                            class_name = class_match.group("class_name")
-
-                    # Field declared in class.
-                    field_match = util.field_pattern.match(line)
-
-                    if class_name.startswith(tuple(self.ignore_package_names)):
-                        ignore = True
-
-                    if field_match:
-                        field_name = field_match.group("field_name")
-                        # Avoid sub-fields and user defined packages.
-                        if not ignore and "$" not in field_name:
-                            # Rename field declaration (usages of this field will be
-                            # renamed later) and add some random fields.
-                            line = line.replace(
-                                "{0}:".format(field_name),
-                                "{0}:".format(self.rename_field(field_name)),
-                            )
-                            out_file.write(line)
-
-                            # Add random fields.
-                            if self.added_fields < self.max_fields_to_add:
-                                for _ in range(util.get_random_int(1, 4)):
-                                    out_file.write("\n")
-                                    out_file.write(
-                                        line.replace(
-                                            ":",
-                                            "{0}:".format(util.get_random_string(8)),
-                                        )
-                                    )
-                                    self.added_fields += 1
-
-                            field = "{field_name}:{field_type}".format(
-                                field_name=field_match.group("field_name"),
-                                field_type=field_match.group("field_type"),
-                            )
-                            renamed_fields.add(field)
-                        else:
-                            out_file.write(line)
-                    else:
-                        out_file.write(line)
-
-        return renamed_fields
-
-    def rename_field_references(
-        self,
-        fields_to_rename: Set[str],
-        smali_files: List[str],
-        sdk_classes: Set[str],
-        interactive: bool = False,
-    ):
-        for smali_file in util.show_list_progress(
-            smali_files,
-            interactive=interactive,
-            description="Renaming field references",
-        ):
-            with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                for line in in_file:
-                    # Field usage.
-                    field_usage_match = util.field_usage_pattern.match(line)
-                    if field_usage_match:
-                        field = "{field_name}:{field_type}".format(
-                            field_name=field_usage_match.group("field_name"),
-                            field_type=field_usage_match.group("field_type"),
-                        )
-                        class_name = field_usage_match.group("field_object")
-                        field_name = field_usage_match.group("field_name")
-                        if field in fields_to_rename and (
-                            not class_name.startswith(("Landroid", "Ljava"))
-                            or class_name in sdk_classes
-                        ):
-                            # Rename field usage.
-                            out_file.write(
-                                line.replace(
-                                    "{0}:".format(field_name),
-                                    "{0}:".format(self.rename_field(field_name)),
-                                )
+            class_name = None
+            ignore = False
+            for smali_line in self.smali_lexer.lex_file(smali_file):
+                if smali_line.kind is SmaliLineKind.CLASS and not class_name:
+                    class_name = smali_line.class_name
+                    # Avoid user defined packages.
+                    ignore = self.is_ignored_class(class_name)
+
+                # Field declared in class.
+                elif smali_line.kind is SmaliLineKind.FIELD:
+                    field_name = smali_line.member
+                    # Avoid sub-fields and user defined packages.
+                    if not ignore and "$" not in field_name:
+                        # Rename field declaration (usages of this field will be
+                        # renamed as well) and add some random fields.
+                        field_declaration = smali_line.get_field_reference(class_name)
+                        field_names[field_declaration] = field_name
+
+                        # Add random fields.
+                        if self.added_fields < self.max_fields_to_add:
+                            random_field_names = added_fields.setdefault(
+                                field_declaration, []
                             )
-                        else:
-                            out_file.write(line)
-                    else:
-                        out_file.write(line)
+                            for _ in range(util.get_random_int(1, 4)):
+                                if self.added_fields >= self.max_fields_to_add:
+                                    break
+                                random_field_names.append(util.get_random_string(8))
+                                self.added_fields += 1
+
+        # The new names of all the fields are computed at once.
+        new_field_names = self.identifier_hasher.get_names("f", field_names.values())
+
+        renamed_fields: Dict[str, str] = {
+            field_declaration: new_field_names[field_name]
+            for field_declaration, field_name in field_names.items()
+        }
+
+        return renamed_fields, added_fields
 
     def obfuscate(self, obfuscation_info: Obfuscation):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
-        # Get user defined ignore package list.
-        self.ignore_package_names = obfuscation_info.get_ignore_package_names()
+        # The classes in the user defined ignore package list are not renamed.
+        self.is_ignored_class = obfuscation_info.is_ignored_class
+
+        self.identifier_hasher = obfuscation_info.get_identifier_hasher()
+        self.smali_lexer = obfuscation_info.get_smali_lexer()
 
         try:
             sdk_class_declarations = self.get_sdk_class_names(
                 obfuscation_info.get_smali_files()
             )
-            renamed_field_declarations: Set[str] = set()
+            renamed_field_declarations: Dict[str, str] = {}
+            added_fields: Dict[str, List[str]] = {}
 
             # There is a field limit for dex files.
             self.max_fields_to_add = (
@@ -176,25 +136,41 @@ class FieldRename(obfuscator_category.IRenameObfuscator):
                         obfuscation_info.get_remaining_fields_per_obfuscator()[index]
                     )
                     self.added_fields = 0
-                    renamed_field_declarations.update(
-                        self.rename_field_declarations(
-                            dex_smali_files, obfuscation_info.interactive
-                        )
+                    (
+                        dex_renamed_field_declarations,
+                        dex_added_fields,
+                    ) = self.get_field_rename_transformations(
+                        dex_smali_files, obfuscation_info.interactive
                     )
+                    renamed_field_declarations.update(dex_renamed_field_declarations)
+                    added_fields.update(dex_added_fields)
             else:
-                renamed_field_declarations = self.rename_field_declarations(
+                (
+                    renamed_field_declarations,
+                    added_fields,
+                ) = self.get_field_rename_transformations(
                     obfuscation_info.get_smali_files(), obfuscation_info.interactive
                 )
 
             # When renaming field references it makes no difference if this is a
-            # multidex application, since at this point we are not introducing any new
-            # field.
-            self.rename_field_references(
+            # multidex application, since the references are renamed using only the
+            # name and the type of the fields.
+            renamed_field_references: Dict[str, str] = {}
+            for field_declaration, new_field_name in renamed_field_declarations.items():
+                field = field_declaration.split("->", 1)[1]
+                renamed_field_references[field] = new_field_name
+
+            # The declarations and the references of the renamed fields are updated by
+            # the rename planner (together with the renaming planned by the other
+            # rename obfuscators, if any).
+            obfuscation_info.get_rename_planner().add_field_renames(
                 renamed_field_declarations,
-                obfuscation_info.get_smali_files(),
+                renamed_field_references,
                 sdk_class_declarations,
-                obfuscation_info.interactive,
+                added_fields,
             )
+            if not obfuscation_info.defer_rename_rewrite:
+                obfuscation_info.rewrite_planned_renames()
 
         except Exception as e:
             self.logger.error(
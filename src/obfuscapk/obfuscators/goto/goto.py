@@ -5,6 +5,7 @@ import logging
 from obfuscapk import obfuscator_category
 from obfuscapk import util
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.smali_method_index import SmaliMethodIndex
 
 
 class Goto(obfuscator_category.ICodeObfuscator):
@@ -26,41 +27,42 @@ class Goto(obfuscator_category.ICodeObfuscator):
                 self.logger.debug(
                     'Inserting "goto" instructions in file "{0}"'.format(smali_file)
                 )
-                with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                    editing_method = False
-                    for line in in_file:
-                        if (
-                            line.startswith(".method ")
-                            and " abstract " not in line
-                            and " native " not in line
-                            and not editing_method
-                        ):
-                            # If at the beginning of a non abstract/native method
-                            # (after the .locals instruction), insert a "goto" to the
-                            # label at the end of the method and a label to the first
-                            # instruction of the method.
-                            out_file.write(line)
-                            editing_method = True
+                with util.inplace_edit_binary_file(smali_file) as (in_file, out_file):
+                    lines = in_file.readlines()
+                    for method in SmaliMethodIndex(lines).methods:
+                        if not method.has_code:
+                            # Abstract and native methods have no code.
+                            continue
 
-                        elif editing_method and util.locals_pattern.match(line):
-                            out_file.write(line)
-                            out_file.write("\n\tgoto/32 :after_last_instruction\n\n")
-                            out_file.write("\t:before_first_instruction\n")
+                        if method.locals_line is not None:
+                            # At the beginning of the method (after the .locals
+                            # instruction), insert a "goto" to the label at the end of
+                            # the method and a label to the first instruction of the
+                            # method.
+                            start_code = (
+                                b"\n\tgoto/32 :after_last_instruction\n\n"
+                                b"\t:before_first_instruction\n"
+                            )
+                            locals_line = lines[method.locals_line]
+                            lines[method.locals_line] += util.with_line_ending(
+                                start_code, locals_line
+                            )
 
-                        elif line.startswith(".end method") and editing_method:
-                            # If at the end of the method, insert a label after the
-                            # last instruction of the method and a "goto" to the label
-                            # at the beginning of the method. This will not cause an
-                            # endless loop because the method will return at some point
-                            # and the second "goto" won't be called again when the
-                            # method finishes.
-                            out_file.write("\n\t:after_last_instruction\n\n")
-                            out_file.write("\tgoto/32 :before_first_instruction\n\n")
-                            out_file.write(line)
-                            editing_method = False
+                        # At the end of the method, insert a label after the last
+                        # instruction of the method and a "goto" to the label at the
+                        # beginning of the method. This will not cause an endless loop
+                        # because the method will return at some point and the second
+                        # "goto" won't be called again when the method finishes.
+                        end_code = (
+                            b"\n\t:after_last_instruction\n\n"
+                            b"\tgoto/32 :before_first_instruction\n\n"
+                        )
+                        end_line = lines[method.end]
+                        lines[method.end] = (
+                            util.with_line_ending(end_code, end_line) + end_line
+                        )
 
-                        else:
-                            out_file.write(line)
+                    out_file.writelines(lines)
 
         except Exception as e:
             self.logger.error(
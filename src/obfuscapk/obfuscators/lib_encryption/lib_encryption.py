@@ -3,14 +3,16 @@
 import logging
 import os
 import re
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
+from obfuscapk.const_string_tracker import ConstStringTracker
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.smali_method_index import SmaliMethodIndex
 
 
 class LibEncryption(obfuscator_category.IEncryptionObfuscator):
@@ -36,6 +38,9 @@ class LibEncryption(obfuscator_category.IEncryptionObfuscator):
 
             encrypted_to_original_mapping: Dict[str, str] = {}
 
+            # True if some native library loads were not replaced.
+            keep_original_libs = False
+
             if native_libs:
                 for smali_file in util.show_list_progress(
                     obfuscation_info.get_smali_files(),
@@ -51,118 +56,121 @@ class LibEncryption(obfuscator_category.IEncryptionObfuscator):
                         lines = current_file.readlines()
 
                     class_name = None
-
-                    local_count = 16
+                    for line in lines:
+                        class_match = util.class_pattern.match(line)
+                        if class_match:
+                            class_name = class_match.group("class_name")
+                            break
 
                     # Names of the loaded libraries.
                     lib_names: List[str] = []
 
-                    editing_constructor = False
-                    start_index = 0
-                    for line_number, line in enumerate(lines):
-                        if not class_name:
-                            class_match = util.class_pattern.match(line)
-                            if class_match:
-                                class_name = class_match.group("class_name")
-                                continue
-
-                        # Native libraries should be loaded inside static constructors.
-                        if (
-                            line.startswith(".method static constructor <clinit>()V")
-                            and not editing_constructor
+                    # Native libraries should be loaded inside static constructors
+                    # (only one static constructor per class).
+                    constructor = SmaliMethodIndex(lines).get_static_constructor()
+
+                    # If for some reason the locals declaration is not found where it
+                    # should be, assume the local registers are all used (we can't add
+                    # any instruction here).
+                    if (
+                        constructor is not None
+                        and constructor.locals_line == constructor.start + 1
+                        and constructor.local_count <= 15
+                    ):
+                        # The constant strings held by the registers in the static
+                        # constructor.
+                        const_string_tracker = ConstStringTracker()
+
+                        # (Line number, register) of the native library load
+                        # instructions to replace.
+                        lib_loads: List[Tuple[int, str]] = []
+
+                        for line_number in range(
+                            constructor.locals_line + 1, constructor.end
                         ):
-                            # Entering static constructor.
-                            editing_constructor = True
-                            start_index = line_number + 1
-                            local_match = util.locals_pattern.match(
-                                lines[line_number + 1]
+                            line = lines[line_number]
+                            invoke_match = native_lib_invoke_pattern.match(line)
+                            if invoke_match:
+                                # Native library load instruction. Get the constant
+                                # string containing the name of the loaded library
+                                # (if any). The instruction is replaced only when the
+                                # library is found, otherwise the original library
+                                # has to be loaded as usual.
+                                register = invoke_match.group("invoke_pass")
+                                lib_name = const_string_tracker.get_string(register)
+                                if lib_name is not None and any(
+                                    native_lib.endswith("{0}.so".format(lib_name))
+                                    for native_lib in native_libs
+                                ):
+                                    lib_names.append(lib_name)
+                                    lib_loads.append((line_number, register))
+
+                            const_string_tracker.update(line)
+
+                        if lib_loads:
+                            # An additional register is needed for the encryption.
+                            local_count = constructor.local_count + 1
+                            lines[constructor.locals_line] = "\t.locals {0}\n".format(
+                                local_count
                             )
-                            if local_match:
-                                local_count = int(local_match.group("local_count"))
-                                if local_count <= 15:
-                                    # An additional register is needed for the
-                                    # encryption.
-                                    local_count += 1
-                                    lines[line_number + 1] = "\t.locals {0}\n".format(
-                                        local_count
-                                    )
-                                    continue
-
-                            # For some reason the locals declaration was not found where
-                            # it should be, so assume the local registers are all used
-                            # (we can't add any instruction here).
-                            break
 
-                        elif line.startswith(".end method") and editing_constructor:
-                            # Only one static constructor per class.
-                            break
+                        for line_number, register in lib_loads:
+                            # Static constructors take no parameters, so the highest
+                            # register is v<local_count - 1>.
+                            lines[line_number] = (
+                                "\tconst-class v{class_register_num}, "
+                                "{class_name}\n\n"
+                                "\tinvoke-static {{v{class_register_num}, "
+                                "{original_register}}}, "
+                                "Lcom/decryptassetmanager/DecryptAsset;->"
+                                "loadEncryptedLibrary("
+                                "Ljava/lang/Class;Ljava/lang/String;)V\n".format(
+                                    class_name=class_name,
+                                    original_register=register,
+                                    class_register_num=local_count - 1,
+                                )
+                            )
 
-                        elif editing_constructor:
-                            # Inside static constructor.
-                            invoke_match = native_lib_invoke_pattern.match(line)
-                            if invoke_match:
-                                # Native library load instruction. Iterate the
-                                # constructor lines backwards in order to find the
-                                # string containing the name of the loaded library.
-                                for l_num in range(line_number - 1, start_index, -1):
-                                    string_match = util.const_string_pattern.match(
-                                        lines[l_num]
-                                    )
-                                    if string_match and string_match.group(
-                                        "register"
-                                    ) == invoke_match.group("invoke_pass"):
-                                        # Native library string declaration.
-                                        lib_names.append(string_match.group("string"))
-
-                                # Static constructors take no parameters, so the highest
-                                # register is v<local_count - 1>.
-                                lines[line_number] = (
-                                    "\tconst-class v{class_register_num}, "
-                                    "{class_name}\n\n"
-                                    "\tinvoke-static {{v{class_register_num}, "
-                                    "{original_register}}}, "
-                                    "Lcom/decryptassetmanager/DecryptAsset;->"
-                                    "loadEncryptedLibrary("
-                                    "Ljava/lang/Class;Ljava/lang/String;)V\n".format(
-                                        class_name=class_name,
-                                        original_register=invoke_match.group(
-                                            "invoke_pass"
-                                        ),
-                                        class_register_num=local_count - 1,
-                                    )
+                    # The native library loads left unchanged (e.g., with an unknown
+                    # library name) still need the original native libraries.
+                    if any(
+                        native_lib_invoke_pattern.match(line)
+                        for line in lines
+                        if "loadLibrary" in line
+                    ):
+                        keep_original_libs = True
+
+                    # Encrypt the native libraries used in code and put them
+                    # in assets folder.
+                    assets_dir = obfuscation_info.get_assets_directory()
+                    os.makedirs(assets_dir, exist_ok=True)
+                    for native_lib in native_libs:
+                        for lib_name in lib_names:
+                            if native_lib.endswith("{0}.so".format(lib_name)):
+                                arch = os.path.basename(os.path.dirname(native_lib))
+                                encrypted_lib_path = os.path.join(
+                                    assets_dir,
+                                    "lib.{arch}.{lib_name}.so".format(
+                                        arch=arch, lib_name=lib_name
+                                    ),
                                 )
 
-                        # Encrypt the native libraries used in code and put them
-                        # in assets folder.
-                        assets_dir = obfuscation_info.get_assets_directory()
-                        os.makedirs(assets_dir, exist_ok=True)
-                        for native_lib in native_libs:
-                            for lib_name in lib_names:
-                                if native_lib.endswith("{0}.so".format(lib_name)):
-                                    arch = os.path.basename(os.path.dirname(native_lib))
-                                    encrypted_lib_path = os.path.join(
-                                        assets_dir,
-                                        "lib.{arch}.{lib_name}.so".format(
-                                            arch=arch, lib_name=lib_name
-                                        ),
+                                with open(native_lib, "rb") as native_lib_file:
+                                    encrypted_lib = AES.new(
+                                        key=self.encryption_secret.encode(),
+                                        mode=AES.MODE_ECB,
+                                    ).encrypt(
+                                        pad(native_lib_file.read(), AES.block_size)
                                     )
 
-                                    with open(native_lib, "rb") as native_lib_file:
-                                        encrypted_lib = AES.new(
-                                            key=self.encryption_secret.encode(),
-                                            mode=AES.MODE_ECB,
-                                        ).encrypt(
-                                            pad(native_lib_file.read(), AES.block_size)
-                                        )
+                                with open(
+                                    encrypted_lib_path, "wb"
+                                ) as encrypted_lib_file:
+                                    encrypted_lib_file.write(encrypted_lib)
 
-                                    with open(
-                                        encrypted_lib_path, "wb"
-                                    ) as encrypted_lib_file:
-                                        encrypted_lib_file.write(encrypted_lib)
-
-                                    encrypted_to_original_mapping[
-                                        encrypted_lib_path
-                                    ] = native_lib
+                                encrypted_to_original_mapping.update(
+                                    {encrypted_lib_path: native_lib}
+                                )
 
                     with open(smali_file, "w", encoding="utf-8") as current_file:
                         current_file.writelines(lines)
@@ -190,16 +198,24 @@ class LibEncryption(obfuscator_category.IEncryptionObfuscator):
                         obfuscation_info.decrypt_asset_smali_file_added_flag = True
 
                 # Remove the original native libraries that were encrypted (the
-                # encrypted ones will be used instead).
-                for _, original_lib in encrypted_to_original_mapping.items():
-                    try:
-                        os.remove(original_lib)
-                    except OSError as e:
-                        self.logger.warning(
-                            'Unable to delete native library "{0}": {1}'.format(
-                                original_lib, e
+                # encrypted ones will be used instead), unless some library loads
+                # were left unchanged (the name of the library they load is unknown,
+                # so any original library could still be needed).
+                if keep_original_libs:
+                    self.logger.warning(
+                        "Some native library loads can't be replaced, the original "
+                        "native libraries are kept in the application"
+                    )
+                else:
+                    for _, original_lib in encrypted_to_original_mapping.items():
+                        try:
+                            os.remove(original_lib)
+                        except OSError as e:
+                            self.logger.warning(
+                                'Unable to delete native library "{0}": {1}'.format(
+                                    original_lib, e
+                                )
                             )
-                        )
 
             else:
                 self.logger.debug("No native libraries found")
@@ -2,7 +2,7 @@
 
 import logging
 import random
-from typing import List, Set
+from typing import FrozenSet, List, Set
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
@@ -25,6 +25,7 @@ class MethodOverload(obfuscator_category.ICodeObfuscator):
         smali_file: str,
         overloaded_method_body: str,
         class_names_to_ignore: Set[str],
+        max_methods_to_add: int,
     ) -> int:
         new_methods_num: int = 0
         with util.inplace_edit_file(smali_file) as (in_file, out_file):
@@ -71,10 +72,12 @@ class MethodOverload(obfuscator_category.ICodeObfuscator):
                 ):
                     # Create lists with random parameters to be added to the method
                     # signature. Add 3 overloads for each method and for each overload
-                    # use 4 random params.
-                    for params in util.get_random_list_permutations(
+                    # use 4 random params (without exceeding the methods that can be
+                    # added).
+                    overloads_params = util.get_random_list_permutations(
                         random.sample(self.param_types, 4)
-                    )[:3]:
+                    )[: min(3, max_methods_to_add - new_methods_num)]
+                    for params in overloads_params:
                         new_param = "".join(params)
                         # Update parameter list and add void return type.
                         overloaded_signature = line.replace(
@@ -92,6 +95,10 @@ class MethodOverload(obfuscator_category.ICodeObfuscator):
 
                     # Print original method.
                     out_file.write(line)
+
+                    # No more methods can be added, leave the rest of the file as is.
+                    if new_methods_num >= max_methods_to_add:
+                        skip_remaining_lines = True
                 else:
                     out_file.write(line)
 
@@ -117,7 +124,10 @@ class MethodOverload(obfuscator_category.ICodeObfuscator):
             )
             if added_methods < max_methods_to_add:
                 added_methods += self.add_method_overloads_to_file(
-                    smali_file, overloaded_method_body, class_names_to_ignore
+                    smali_file,
+                    overloaded_method_body,
+                    class_names_to_ignore,
+                    max_methods_to_add - added_methods,
                 )
             else:
                 break
@@ -132,7 +142,7 @@ class MethodOverload(obfuscator_category.ICodeObfuscator):
             # namely private instance methods, constructors and static methods) will be
             # overloaded.
 
-            android_class_names: Set[str] = set(util.get_android_class_names())
+            android_class_names: FrozenSet[str] = util.get_android_class_names()
 
             # There is a method limit for dex files.
             max_methods_to_add = obfuscation_info.get_remaining_methods_per_obfuscator()
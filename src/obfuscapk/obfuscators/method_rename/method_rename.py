@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
 import logging
-from typing import List, Set
+from typing import Callable, Dict, FrozenSet, List, Set
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
+from obfuscapk.identifier_hasher import IdentifierHasher
 from obfuscapk.obfuscation import Obfuscation
 
 
@@ -15,61 +16,57 @@ class MethodRename(obfuscator_category.IRenameObfuscator):
         )
         super().__init__()
 
-        self.ignore_package_names = []
+        # Replaced with the check of the current obfuscation when running the
+        # obfuscator (see Obfuscation.is_ignored_class).
+        self.is_ignored_class: Callable[[str], bool] = lambda class_name: False
+
+        # Replaced with the one of the current obfuscation when running the obfuscator.
+        self.identifier_hasher: IdentifierHasher = IdentifierHasher()
+
+        self.is_planning_renames = True
 
     def rename_method(self, method_name: str) -> str:
-        method_md5 = util.get_string_md5(method_name)
-        return "m{0}".format(method_md5.lower()[:8])
+        return self.identifier_hasher.get_name("m", method_name)
 
-    def rename_method_declarations(
+    def get_method_rename_transformations(
         self,
         smali_files: List[str],
         class_names_to_ignore: Set[str],
         interactive: bool = False,
-    ) -> Set[str]:
-        renamed_methods: Set[str] = set()
+    ) -> Dict[str, str]:
+        # Method (class_name->method) -> original name of the method.
+        method_names: Dict[str, str] = {}
 
-        # Search for method definitions that can be renamed.
+        # Search for method definitions that can be renamed (the files are only read,
+        # they will be rewritten by the rename planner).
         for smali_file in util.show_list_progress(
             smali_files,
             interactive=interactive,
             description="Renaming method declarations",
         ):
-            with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                skip_remaining_lines = False
+            with open(smali_file, "r", encoding="utf-8") as current_file:
                 class_name = None
-                for line in in_file:
-                    if skip_remaining_lines:
-                        out_file.write(line)
-                        continue
-
+                for line in current_file:
                     if not class_name:
                         class_match = util.class_pattern.match(line)
                         # If this is an enum class, don't rename anything.
                         if " enum " in line:
-                            skip_remaining_lines = True
-                            out_file.write(line)
-                            continue
+                            break
                         elif class_match:
                             class_name = class_match.group("class_name")
                             if (
                                 class_name in class_names_to_ignore
-                                or class_name.startswith(
-                                    tuple(self.ignore_package_names)
-                                )
+                                or self.is_ignored_class(class_name)
                             ):
                                 # The methods of this class should be ignored when
                                 # renaming, so proceed with the next class.
-                                skip_remaining_lines = True
-                            out_file.write(line)
+                                break
                             continue
 
                     # Skip virtual methods, consider only the direct methods defined
                     # earlier in the file.
                     if line.startswith("# virtual methods"):
-                        skip_remaining_lines = True
-                        out_file.write(line)
-                        continue
+                        break
 
                     # Method declared in class.
                     method_match = util.method_pattern.match(line)
@@ -87,97 +84,51 @@ class MethodRename(obfuscator_category.IRenameObfuscator):
                             method_param=method_match.group("method_param"),
                             method_return=method_match.group("method_return"),
                         )
-                        # Rename method declaration (invocations of this method will be
-                        # renamed later).
-                        method_name = method_match.group("method_name")
-                        out_file.write(
-                            line.replace(
-                                "{0}(".format(method_name),
-                                "{0}(".format(self.rename_method(method_name)),
-                            )
-                        )
                         # Direct methods cannot be overridden, so they can be called
-                        # only by the same class that declares them.
-                        renamed_methods.add(
+                        # only by the same class that declares them (both the
+                        # declaration and the invocations of this method will be
+                        # renamed by the rename planner).
+                        method_names[
                             "{class_name}->{method}".format(
                                 class_name=class_name, method=method
                             )
-                        )
-                    else:
-                        out_file.write(line)
+                        ] = method_match.group("method_name")
 
-        return renamed_methods
+        # The new names of all the methods are computed at once.
+        new_method_names = self.identifier_hasher.get_names("m", method_names.values())
 
-    def rename_method_invocations(
-        self,
-        smali_files: List[str],
-        methods_to_rename: Set[str],
-        interactive: bool = False,
-    ):
-        for smali_file in util.show_list_progress(
-            smali_files,
-            interactive=interactive,
-            description="Renaming method invocations",
-        ):
-            with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                for line in in_file:
-                    # Method invocation.
-                    invoke_match = util.invoke_pattern.match(line)
-                    if invoke_match:
-                        method = (
-                            "{class_name}->"
-                            "{method_name}({method_param}){method_return}".format(
-                                class_name=invoke_match.group("invoke_object"),
-                                method_name=invoke_match.group("invoke_method"),
-                                method_param=invoke_match.group("invoke_param"),
-                                method_return=invoke_match.group("invoke_return"),
-                            )
-                        )
-                        invoke_type = invoke_match.group("invoke_type")
-                        # Rename the method invocation only if is direct or static (we
-                        # are renaming only direct methods). The list of methods to
-                        # rename already contains the class name of each method, since
-                        # here we have a list of methods whose declarations were already
-                        # renamed.
-                        if (
-                            "direct" in invoke_type or "static" in invoke_type
-                        ) and method in methods_to_rename:
-                            method_name = invoke_match.group("invoke_method")
-                            out_file.write(
-                                line.replace(
-                                    "->{0}(".format(method_name),
-                                    "->{0}(".format(self.rename_method(method_name)),
-                                )
-                            )
-                        else:
-                            out_file.write(line)
-                    else:
-                        out_file.write(line)
+        return {
+            method: new_method_names[method_name]
+            for method, method_name in method_names.items()
+        }
 
     def obfuscate(self, obfuscation_info: Obfuscation):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
-        # Get user defined ignore package list.
-        self.ignore_package_names = obfuscation_info.get_ignore_package_names()
+        # The classes in the user defined ignore package list are not renamed.
+        self.is_ignored_class = obfuscation_info.is_ignored_class
+
+        self.identifier_hasher = obfuscation_info.get_identifier_hasher()
 
         try:
             # NOTE: only direct methods (methods that are by nature non-overridable,
             # namely private instance methods, constructors and static methods) will be
             # renamed.
 
-            android_class_names: Set[str] = set(util.get_android_class_names())
+            android_class_names: FrozenSet[str] = util.get_android_class_names()
 
-            renamed_methods: Set[str] = self.rename_method_declarations(
+            renamed_methods: Dict[str, str] = self.get_method_rename_transformations(
                 obfuscation_info.get_smali_files(),
                 android_class_names,
                 obfuscation_info.interactive,
             )
 
-            self.rename_method_invocations(
-                obfuscation_info.get_smali_files(),
-                renamed_methods,
-                obfuscation_info.interactive,
-            )
+            # The declarations and the invocations of the renamed methods are
+            # updated by the rename planner (together with the renaming planned by
+            # the other rename obfuscators, if any).
+            obfuscation_info.get_rename_planner().add_method_renames(renamed_methods)
+            if not obfuscation_info.defer_rename_rewrite:
+                obfuscation_info.rewrite_planned_renames()
 
         except Exception as e:
             self.logger.error(
@@ -19,8 +19,9 @@ class Nop(obfuscator_category.ICodeObfuscator):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
         try:
-            op_codes = util.get_nop_valid_op_codes()
-            pattern = re.compile(r"\s+(?P<op_code>\S+)")
+            # The smali files are processed in binary mode.
+            op_codes = {op_code.encode() for op_code in util.get_nop_valid_op_codes()}
+            pattern = re.compile(rb"\s+(?P<op_code>\S+)")
 
             for smali_file in util.show_list_progress(
                 obfuscation_info.get_smali_files(),
@@ -30,7 +31,7 @@ class Nop(obfuscator_category.ICodeObfuscator):
                 self.logger.debug(
                     'Inserting "nop" instructions in file "{0}"'.format(smali_file)
                 )
-                with util.inplace_edit_file(smali_file) as (in_file, out_file):
+                with util.inplace_edit_binary_file(smali_file) as (in_file, out_file):
                     for line in in_file:
                         # Print original instruction.
                         out_file.write(line)
@@ -44,7 +45,8 @@ class Nop(obfuscator_category.ICodeObfuscator):
                             # after it.
                             if op_code in op_codes:
                                 nop_count = util.get_random_int(1, 5)
-                                out_file.write("\tnop\n" * nop_count)
+                                nop_code = util.with_line_ending(b"\tnop\n", line)
+                                out_file.write(nop_code * nop_count)
 
         except Exception as e:
             self.logger.error(
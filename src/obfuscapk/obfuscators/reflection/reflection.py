@@ -3,7 +3,7 @@
 import logging
 import os
 import re
-from typing import List, Set
+from typing import Dict, FrozenSet, List, Set
 
 from obfuscapk import obfuscator_category
 from obfuscapk import util
@@ -17,10 +17,19 @@ class Reflection(obfuscator_category.ICodeObfuscator):
         )
         super().__init__()
 
-        self.android_class_names: Set[str] = set(util.get_android_class_names())
+        self.android_class_names: FrozenSet[str] = util.get_android_class_names()
 
         self.methods_with_reflection: int = 0
 
+        # If True, setAccessible(true) is called once on every method using
+        # reflection (when it's looked up), to skip the access checks when invoking it.
+        self.set_accessible: bool = False
+
+        # The methods already added to the list of methods using reflection (e.g.,
+        # Lcom/app/Class;->method(I)V) and their index in the list: the same method
+        # invoked in many places (even in different classes) is added only once.
+        self.reflected_methods: Dict[str, int] = {}
+
         # Will be populated before running the reflection obfuscator.
         self.class_name_to_smali_file: dict = {}
 
@@ -186,7 +195,7 @@ class Reflection(obfuscator_category.ICodeObfuscator):
         return needed_registers
 
     def add_smali_reflection_code(
-        self, class_name: str, method_name: str, param_string: str
+        self, class_name: str, method_name: str, param_string: str, method_index: int
     ) -> str:
         params = self.split_method_params(param_string)
 
@@ -229,17 +238,26 @@ class Reflection(obfuscator_category.ICodeObfuscator):
         )
         self.obfuscator_instructions_length += 3
 
-        smali_code += (
-            "\tmove-result-object v1\n\n"
-            "\tsget-object v2, Lcom/apireflectionmanager/ApiReflection;->"
-            "obfuscatedMethods:Ljava/util/List;\n\n"
-        )
-        self.obfuscator_instructions_length += 3
+        smali_code += "\tmove-result-object v1\n\n"
+        self.obfuscator_instructions_length += 1
+
+        if self.set_accessible:
+            # Skip the access checks when the method is invoked.
+            smali_code += (
+                "\tconst/4 v2, 0x1\n\n"
+                "\tinvoke-virtual {v1, v2}, "
+                "Ljava/lang/reflect/Method;->setAccessible(Z)V\n\n"
+            )
+            self.obfuscator_instructions_length += 4
 
+        # Save the method in the static array, so it's looked up only once.
         smali_code += (
-            "\tinvoke-interface {v2, v1}, Ljava/util/List;->add(Ljava/lang/Object;)Z\n"
+            "\tsget-object v2, Lcom/apireflectionmanager/ApiReflection;->"
+            "obfuscatedMethods:[Ljava/lang/reflect/Method;\n\n"
+            "\tconst/16 v3, {method_index:#x}\n\n"
+            "\taput-object v1, v2, v3\n".format(method_index=method_index)
         )
-        self.obfuscator_instructions_length += 3
+        self.obfuscator_instructions_length += 6
 
         return smali_code
 
@@ -376,6 +394,13 @@ class Reflection(obfuscator_category.ICodeObfuscator):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
         try:
+            # The list of methods using reflection is created for each obfuscation.
+            self.methods_with_reflection = 0
+            self.reflected_methods = {}
+            self.obfuscator_instructions_length = 0
+
+            self.set_accessible = obfuscation_info.reflection_set_accessible
+
             for smali_file in util.show_list_progress(
                 obfuscation_info.get_smali_files(),
                 interactive=obfuscation_info.interactive,
@@ -474,9 +499,7 @@ class Reflection(obfuscator_category.ICodeObfuscator):
 
                             current_line_number += 1
 
-                            invoke_match = util.invoke_pattern.match(
-                                lines[current_line_number]
-                            )
+                            invoke_match = util.match_invoke(lines[current_line_number])
 
                             if (
                                 invoke_match
@@ -609,24 +632,37 @@ class Reflection(obfuscator_category.ICodeObfuscator):
                                         lines[move_result_index] = new_move_result
 
                                 # Add the original method to the list of methods
-                                # using reflection.
-                                obfuscator_smali_code += self.add_smali_reflection_code(
-                                    tmp_class_name, tmp_method, tmp_param
+                                # using reflection (only the first time it's found).
+                                reflected_method = "{0}->{1}({2}){3}".format(
+                                    tmp_class_name,
+                                    tmp_method,
+                                    tmp_param,
+                                    tmp_return_type,
+                                )
+                                reflection_index = self.reflected_methods.setdefault(
+                                    reflected_method, self.methods_with_reflection
                                 )
+                                if reflection_index == self.methods_with_reflection:
+                                    reflection_code = self.add_smali_reflection_code(
+                                        tmp_class_name,
+                                        tmp_method,
+                                        tmp_param,
+                                        reflection_index,
+                                    )
+                                    obfuscator_smali_code += reflection_code
+                                    self.methods_with_reflection += 1
 
                                 # Change the original code with code using reflection.
                                 lines[
                                     current_line_number
                                 ] = self.create_reflection_method(
-                                    self.methods_with_reflection,
+                                    reflection_index,
                                     method_local_count[method_number],
                                     tmp_is_virtual,
                                     tmp_register,
                                     tmp_param,
                                 )
 
-                                self.methods_with_reflection += 1
-
                                 # Add the registers needed for performing reflection.
                                 lines[index + 1] = "\t.locals {0}\n".format(
                                     method_local_count[method_number] + 4
@@ -641,8 +677,13 @@ class Reflection(obfuscator_category.ICodeObfuscator):
             destination_dir = os.path.dirname(obfuscation_info.get_smali_files()[0])
             destination_file = os.path.join(destination_dir, "ApiReflection.smali")
             with open(destination_file, "w", encoding="utf-8") as api_reflection_smali:
-                reflection_code = util.get_api_reflection_smali_code().replace(
-                    "#!code_to_replace!#", obfuscator_smali_code
+                reflection_code = (
+                    util.get_api_reflection_smali_code()
+                    .replace(
+                        "#!methods_count!#",
+                        "{0:#x}".format(self.methods_with_reflection),
+                    )
+                    .replace("#!code_to_replace!#", obfuscator_smali_code)
                 )
                 api_reflection_smali.write(reflection_code)
 
@@ -8,6 +8,7 @@ from typing import List
 from obfuscapk import obfuscator_category
 from obfuscapk import util
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.smali_method_index import SmaliMethodIndex
 
 
 class CodeBlock:
@@ -59,93 +60,62 @@ class Reorder(obfuscator_category.ICodeObfuscator):
             ):
                 self.logger.debug('Reordering code in file "{0}"'.format(smali_file))
                 with util.inplace_edit_file(smali_file) as (in_file, out_file):
-                    editing_method = False
-                    inside_try_catch = False
-                    jump_count = 0
-                    for line in in_file:
-                        if (
-                            line.startswith(".method ")
-                            and " abstract " not in line
-                            and " native " not in line
-                            and not editing_method
-                        ):
-                            # If at the beginning of a non abstract/native method
-                            out_file.write(line)
-                            editing_method = True
-                            inside_try_catch = False
-                            jump_count = 0
-
-                        elif line.startswith(".end method") and editing_method:
-                            # If a the end of the method.
-                            out_file.write(line)
-                            editing_method = False
-                            inside_try_catch = False
-
-                        elif editing_method:
+                    lines = in_file.readlines()
+                    for method in SmaliMethodIndex(lines).methods:
+                        if not method.has_code:
+                            # Abstract and native methods have no code.
+                            continue
+
+                        jump_count = 0
+                        for line_number in range(method.start + 1, method.end):
                             # Inside method. Check if this line contains an op code at
                             # the beginning of the string.
+                            line = lines[line_number]
                             match = op_code_pattern.match(line)
-                            if match:
-                                op_code = match.group("op_code")
-
-                                # Check if we are entering or leaving a try-catch
-                                # block of code.
-                                if op_code.startswith(":try_start_"):
-                                    out_file.write(line)
-                                    inside_try_catch = True
-                                elif op_code.startswith(":try_end_"):
-                                    out_file.write(line)
-                                    inside_try_catch = False
-
-                                # If this is a valid op code, and we are not inside a
-                                # try-catch block, mark this section with a special
-                                # label that will be used later and invert the if
-                                # conditions (if any).
-                                elif op_code in op_codes and not inside_try_catch:
-                                    jump_name = util.get_random_string(16)
-                                    out_file.write(
-                                        "\tgoto/32 :l_{label}_{count}\n\n".format(
-                                            label=jump_name, count=jump_count
-                                        )
+                            if not match:
+                                continue
+
+                            # If this is a valid op code, and we are not inside a
+                            # try-catch block, mark this section with a special label
+                            # that will be used later and invert the if conditions
+                            # (if any).
+                            op_code = match.group("op_code")
+                            if op_code not in op_codes or method.is_in_try_block(
+                                line_number
+                            ):
+                                continue
+
+                            jump_name = util.get_random_string(16)
+                            new_code = (
+                                "\tgoto/32 :l_{label}_{count}\n\n"
+                                "\tnop\n\n"
+                                "#!code_block!#\n"
+                                "\t:l_{label}_{count}\n".format(
+                                    label=jump_name, count=jump_count
+                                )
+                            )
+                            jump_count += 1
+
+                            new_if = self.if_mapping.get(op_code, None)
+                            if new_if:
+                                if_match = if_pattern.match(line)
+                                random_label_name = util.get_random_string(16)
+                                new_code += (
+                                    "\t{if_cond} {register}, :gl_{new_label}\n\n"
+                                    "\tgoto/32 :{goto_label}\n\n"
+                                    "\t:gl_{new_label}".format(
+                                        if_cond=new_if,
+                                        register=if_match.group("register"),
+                                        new_label=random_label_name,
+                                        goto_label=if_match.group("goto_label"),
                                     )
-                                    out_file.write("\tnop\n\n")
-                                    out_file.write("#!code_block!#\n")
-                                    out_file.write(
-                                        "\t:l_{label}_{count}\n".format(
-                                            label=jump_name, count=jump_count
-                                        )
-                                    )
-                                    jump_count += 1
-
-                                    new_if = self.if_mapping.get(op_code, None)
-                                    if new_if:
-                                        if_match = if_pattern.match(line)
-                                        random_label_name = util.get_random_string(16)
-                                        out_file.write(
-                                            "\t{if_cond} {register}, "
-                                            ":gl_{new_label}\n\n".format(
-                                                if_cond=new_if,
-                                                register=if_match.group("register"),
-                                                new_label=random_label_name,
-                                            )
-                                        )
-                                        out_file.write(
-                                            "\tgoto/32 :{0}\n\n".format(
-                                                if_match.group("goto_label")
-                                            )
-                                        )
-                                        out_file.write(
-                                            "\t:gl_{0}".format(random_label_name)
-                                        )
-                                    else:
-                                        out_file.write(line)
-                                else:
-                                    out_file.write(line)
+                                )
                             else:
-                                out_file.write(line)
+                                new_code += line
 
-                        else:
-                            out_file.write(line)
+                            lines[line_number] = new_code
+
+                    out_file.writelines(lines)
 
                 # Reorder code blocks randomly.
                 with util.inplace_edit_file(smali_file) as (in_file, out_file):
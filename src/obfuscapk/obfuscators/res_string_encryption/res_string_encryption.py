@@ -3,9 +3,9 @@
 import logging
 import os
 import re
-import xml.etree.cElementTree as Xml
 from binascii import hexlify
-from typing import List, Set
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, List, Set, Union
 
 from Crypto.Cipher import AES
 from Crypto.Protocol.KDF import PBKDF2
@@ -14,6 +14,8 @@ from Crypto.Util.Padding import pad
 from obfuscapk import obfuscator_category
 from obfuscapk import util
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.resource_table import ResourceTable
+from obfuscapk.xml_rewriter import StreamingXmlRewriter, XmlParents
 
 
 class ResStringEncryption(obfuscator_category.IEncryptionObfuscator):
@@ -25,6 +27,25 @@ class ResStringEncryption(obfuscator_category.IEncryptionObfuscator):
 
         self.encryption_secret = "This-key-need-to-be-32-character"
 
+        # The key derived from the encryption secret (the derivation is expensive, so
+        # it's done only once and not for every encrypted string).
+        self._encryption_key: Union[bytes, None] = None
+        self._encryption_key_secret: Union[str, None] = None
+
+    def get_encryption_key(self) -> bytes:
+        if (
+            self._encryption_key is None
+            or self._encryption_key_secret != self.encryption_secret
+        ):
+            self._encryption_key = PBKDF2(
+                password=self.encryption_secret,
+                salt=self.encryption_secret.encode(),
+                dkLen=32,
+                count=128,
+            )
+            self._encryption_key_secret = self.encryption_secret
+        return self._encryption_key
+
     def encrypt_string(self, string_to_encrypt: str) -> str:
         # This is needed to remove the escaping added by Python. For example, if we
         # find in string resources the string "\"message\"" Android will treat it as
@@ -35,63 +56,141 @@ class ResStringEncryption(obfuscator_category.IEncryptionObfuscator):
             "unicode_escape"
         )
 
-        key = PBKDF2(
-            password=self.encryption_secret,
-            salt=self.encryption_secret.encode(),
-            dkLen=32,
-            count=128,
-        )
         encrypted_string = hexlify(
-            AES.new(key=key, mode=AES.MODE_ECB).encrypt(
+            AES.new(key=self.get_encryption_key(), mode=AES.MODE_ECB).encrypt(
                 pad(string_to_encrypt.encode(errors="replace"), AES.block_size)
             )
         ).decode()
         return encrypted_string
 
     def encrypt_string_resources(
-        self, string_resources_xml_file: str, string_names_to_encrypt: Set[str]
+        self,
+        string_resources_xml_file: str,
+        string_names_to_encrypt: Union[Set[str], FrozenSet[str]],
     ):
-        xml_parser = Xml.XMLParser(encoding="utf-8")
-        xml_tree = Xml.parse(string_resources_xml_file, parser=xml_parser)
-
-        for xml_string in xml_tree.iter("string"):
-            string_name = xml_string.get("name", None)
-            string_value = xml_string.text
-            if string_name and string_value and string_name in string_names_to_encrypt:
-                encrypted_string_value = self.encrypt_string(string_value)
-                xml_string.text = encrypted_string_value
+        def new_string_text(
+            tag: str, attributes: Dict[str, str], text: str, parents: XmlParents
+        ) -> Union[str, None]:
+            if (
+                tag == "string"
+                and text
+                and attributes.get("name", None) in string_names_to_encrypt
+            ):
+                return self.encrypt_string(text)
+            return None
 
-        xml_tree.write(string_resources_xml_file, encoding="utf-8")
+        # The file is rewritten in a streaming way, only the text of the selected
+        # strings is changed.
+        StreamingXmlRewriter(new_text=new_string_text).rewrite(
+            string_resources_xml_file
+        )
 
     def encrypt_string_array_resources(
         self,
         string_array_resources_xml_file: str,
-        string_array_names_to_encrypt: Set[str],
+        string_array_names_to_encrypt: Union[Set[str], FrozenSet[str]],
     ):
-        xml_parser = Xml.XMLParser(encoding="utf-8")
-        xml_tree = Xml.parse(string_array_resources_xml_file, parser=xml_parser)
+        def new_item_text(
+            tag: str, attributes: Dict[str, str], text: str, parents: XmlParents
+        ) -> Union[str, None]:
+            # Encrypt the items of the selected string arrays.
+            if (
+                tag == "item"
+                and text
+                and any(
+                    parent_tag == "string-array"
+                    and parent_attributes.get("name", None)
+                    in string_array_names_to_encrypt
+                    for parent_tag, parent_attributes in parents
+                )
+            ):
+                return self.encrypt_string(text)
+            return None
 
-        for xml_string_array in xml_tree.iter("string-array"):
-            string_array_name = xml_string_array.get("name", None)
-            if string_array_name and string_array_name in string_array_names_to_encrypt:
-                for item in xml_string_array.iter("item"):
-                    if item.text:
-                        encrypted_string_value = self.encrypt_string(item.text)
-                        item.text = encrypted_string_value
+        StreamingXmlRewriter(new_text=new_item_text).rewrite(
+            string_array_resources_xml_file
+        )
+
+    def encrypt_locale_resources(
+        self,
+        strings_xml_files: List[str],
+        string_arrays_xml_files: List[str],
+        string_names_to_encrypt: FrozenSet[str],
+        string_array_names_to_encrypt: FrozenSet[str],
+    ):
+        # Encrypt all the selected strings and string arrays of a single locale
+        # (i.e., of a single res/values*/ directory).
+        for strings_xml_file in strings_xml_files:
+            self.encrypt_string_resources(strings_xml_file, string_names_to_encrypt)
+        for string_arrays_xml_file in string_arrays_xml_files:
+            self.encrypt_string_array_resources(
+                string_arrays_xml_file, string_array_names_to_encrypt
+            )
 
-        xml_tree.write(string_array_resources_xml_file, encoding="utf-8")
+    def encrypt_resources_per_locale(
+        self,
+        resource_table: ResourceTable,
+        string_names_to_encrypt: FrozenSet[str],
+        string_array_names_to_encrypt: FrozenSet[str],
+        interactive: bool = False,
+    ):
+        # Group the resource files to rewrite by locale. Only the files containing
+        # at least one of the selected strings are rewritten.
+        locale_to_files: Dict[str, tuple] = {}
+        for strings_xml_file in resource_table.get_value_files_for_names(
+            "string", string_names_to_encrypt
+        ):
+            locale_to_files.setdefault(
+                os.path.basename(os.path.dirname(strings_xml_file)), ([], [])
+            )[0].append(strings_xml_file)
+        for string_arrays_xml_file in resource_table.get_value_files_for_names(
+            "array", string_array_names_to_encrypt
+        ):
+            locale_to_files.setdefault(
+                os.path.basename(os.path.dirname(string_arrays_xml_file)), ([], [])
+            )[1].append(string_arrays_xml_file)
+
+        if not locale_to_files:
+            return
+
+        # Derive the key before starting the workers.
+        self.get_encryption_key()
+
+        # The locales are independent from each other (every file belongs to
+        # exactly one locale), so they are encrypted concurrently. Threads are used
+        # since the work is mostly file I/O, xml parsing and AES encryption done in
+        # native code.
+        with ThreadPoolExecutor() as executor:
+            locale_to_future = {
+                locale: executor.submit(
+                    self.encrypt_locale_resources,
+                    sorted(strings_xml_files),
+                    sorted(string_arrays_xml_files),
+                    string_names_to_encrypt,
+                    string_array_names_to_encrypt,
+                )
+                for locale, (
+                    strings_xml_files,
+                    string_arrays_xml_files,
+                ) in locale_to_files.items()
+            }
+
+            for locale in util.show_list_progress(
+                sorted(locale_to_future),
+                interactive=interactive,
+                unit="locale",
+                description="Encrypting string resource files",
+            ):
+                # Wait for the encryption of each locale (this also raises the
+                # exception of any failed worker).
+                locale_to_future[locale].result()
+                self.logger.debug('String resources of "{0}" encrypted'.format(locale))
 
     def obfuscate(self, obfuscation_info: Obfuscation):
         self.logger.info('Running "{0}" obfuscator'.format(self.__class__.__name__))
 
         self.encryption_secret = obfuscation_info.encryption_secret
         try:
-            string_res_field_pattern = re.compile(
-                r"\.field\spublic\sstatic\sfinal\s(?P<string_name>\S+?):I\s=\s"
-                r"(?P<string_id>[0-9a-fA-FxX]+)",
-                re.UNICODE,
-            )
-
             string_id_pattern = re.compile(
                 r"\s+const\s(?P<register>[vp0-9]+),\s(?P<id>\S+)"
             )
@@ -122,37 +221,9 @@ class ResStringEncryption(obfuscator_category.IEncryptionObfuscator):
             encrypted_res_strings: Set[str] = set()
             encrypted_res_string_arrays: Set[str] = set()
 
-            # Find the mappings between string name and string id.
-            string_id_to_string_name: dict = {}
-            string_array_id_to_string_name: dict = {}
-            for smali_file in obfuscation_info.get_smali_files():
-                if smali_file.endswith("R$string.smali"):
-                    with open(smali_file, "r", encoding="utf-8") as current_file:
-                        for line in current_file:
-                            if line.startswith(".method "):
-                                # Method declaration reached, no more field declarations
-                                # from now on.
-                                break
-                            field_match = string_res_field_pattern.match(line)
-                            if field_match:
-                                # String name and id declaration.
-                                string_id_to_string_name[
-                                    field_match.group("string_id")
-                                ] = field_match.group("string_name")
-
-                elif smali_file.endswith("R$array.smali"):
-                    with open(smali_file, "r", encoding="utf-8") as current_file:
-                        for line in current_file:
-                            if line.startswith(".method "):
-                                # Method declaration reached, no more field declarations
-                                # from now on.
-                                break
-                            field_match = string_res_field_pattern.match(line)
-                            if field_match:
-                                # String array name and id declaration.
-                                string_array_id_to_string_name[
-                                    field_match.group("string_id")
-                                ] = field_match.group("string_name")
+            # The mappings between resource names and resource ids (and the resource
+            # files where each string is defined) are taken from the resource table.
+            resource_table = obfuscation_info.get_resource_table()
 
             for smali_file in util.show_list_progress(
                 obfuscation_info.get_smali_files(),
@@ -242,10 +313,11 @@ class ResStringEncryption(obfuscator_category.IEncryptionObfuscator):
                             # String id declaration, get the name corresponding to
                             # the id and add it to the list of string resources to
                             # be encrypted.
-                            if id_match.group("id") in string_id_to_string_name:
-                                encrypted_res_strings.add(
-                                    string_id_to_string_name[id_match.group("id")]
-                                )
+                            string_name = resource_table.get_name(
+                                "string", id_match.group("id")
+                            )
+                            if string_name:
+                                encrypted_res_strings.add(string_name)
 
                             # Proceed with the next asset file (if any).
                             break
@@ -279,10 +351,11 @@ class ResStringEncryption(obfuscator_category.IEncryptionObfuscator):
                             # String array id declaration, get the name corresponding to
                             # the id and add it to the list of string array resources
                             # to be encrypted.
-                            if id_match.group("id") in string_array_id_to_string_name:
-                                encrypted_res_string_arrays.add(
-                                    string_array_id_to_string_name[id_match.group("id")]
-                                )
+                            string_array_name = resource_table.get_name(
+                                "array", id_match.group("id")
+                            )
+                            if string_array_name:
+                                encrypted_res_string_arrays.add(string_array_name)
 
                             # Proceed with the next asset file (if any).
                             break
@@ -378,19 +451,14 @@ class ResStringEncryption(obfuscator_category.IEncryptionObfuscator):
                 with open(smali_file, "w", encoding="utf-8") as current_file:
                     current_file.writelines(lines)
 
-            # Encrypt the strings and the string arrays in the resource files.
-            strings_xml_path = os.path.join(
-                obfuscation_info.get_resource_directory(), "values", "strings.xml"
-            )
-            string_arrays_xml_path = os.path.join(
-                obfuscation_info.get_resource_directory(), "values", "arrays.xml"
+            # Encrypt the strings and the string arrays in the resource files of all
+            # the locales.
+            self.encrypt_resources_per_locale(
+                resource_table,
+                frozenset(encrypted_res_strings),
+                frozenset(encrypted_res_string_arrays),
+                obfuscation_info.interactive,
             )
-            if os.path.isfile(strings_xml_path):
-                self.encrypt_string_resources(strings_xml_path, encrypted_res_strings)
-            if os.path.isfile(string_arrays_xml_path):
-                self.encrypt_string_array_resources(
-                    string_arrays_xml_path, encrypted_res_string_arrays
-                )
 
             if not obfuscation_info.decrypt_string_smali_file_added_flag and (
                 encrypted_res_strings or encrypted_res_string_arrays
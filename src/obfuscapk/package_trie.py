@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+from typing import Dict, List, Tuple, Union
+
+
+class _PackageTrieNode(object):
+    __slots__ = ("children", "label", "partial_prefixes")
+
+    def __init__(self):
+        self.children: Dict[str, "_PackageTrieNode"] = {}
+
+        # The label of the prefix ending with a "/" after this node (it matches
+        # everything inside the corresponding package).
+        self.label: Union[str, None] = None
+
+        # The prefixes not ending with a "/" after this node, as (start of the next
+        # token, label).
+        self.partial_prefixes: List[Tuple[str, str]] = []
+
+
+class PackagePrefixTrie(object):
+    """
+    A trie of package prefixes (e.g., Lcom/example/ or Lcom/example), each with a
+    label. A name (e.g., Lcom/example/MainActivity;) is matched by walking its tokens
+    (separated by "/"), so the cost of a lookup depends on the depth of the name and
+    not on the number of prefixes. The result is the same of checking
+    name.startswith(prefix) for every prefix, and the label of the shortest matching
+    prefix is returned.
+    """
+
+    def __init__(self):
+        self._root = _PackageTrieNode()
+        self.size = 0
+
+    def add(self, prefix: str, label: str) -> None:
+        tokens = prefix.split("/")
+        node = self._root
+        for token in tokens[:-1]:
+            node = node.children.setdefault(token, _PackageTrieNode())
+
+        if tokens[-1]:
+            # The last token is the start of a package/class name.
+            node.partial_prefixes.append((tokens[-1], label))
+        elif node.label is None:
+            node.label = label
+
+        self.size += 1
+
+    def get_label(self, name: str) -> Union[str, None]:
+        tokens = name.split("/")
+        last_index = len(tokens) - 1
+        node = self._root
+        for index, token in enumerate(tokens):
+            for partial_prefix, label in node.partial_prefixes:
+                if token.startswith(partial_prefix):
+                    return label
+
+            node = node.children.get(token, None)
+            if node is None:
+                return None
+
+            # A prefix ending with "/" matches only if the name continues.
+            if node.label is not None and index < last_index:
+                return node.label
+
+        return None
+
+    def __contains__(self, name: str) -> bool:
+        return self.get_label(name) is not None
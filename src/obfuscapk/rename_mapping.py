@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+from typing import Dict, List, Tuple
+
+from obfuscapk import util
+from obfuscapk.rename_planner import RenamePlanner
+
+
+class RenameMapping(object):
+    """
+    The mapping between the original and the obfuscated names of the classes, methods
+    and fields renamed during an obfuscation, which can be saved to (and loaded from)
+    a file in the ProGuard mapping format:
+
+    # obfuscators: ClassRename,MethodRename
+    com.example.MainActivity -> p12345678.p9abcdef0.p13579bdf:
+        # {"id":"obfuscapk.smali","file":"smali/...","sha256":"..."}
+        int counter -> f2468ace0
+        void update(int,java.lang.String) -> m02468ace
+
+    Besides the renamed members, every class records the smali file where it's
+    declared and the hash of its original content, so a following obfuscation of a
+    new version of the application can detect the unchanged classes.
+    """
+
+    primitive_types = {
+        "V": "void",
+        "Z": "boolean",
+        "B": "byte",
+        "S": "short",
+        "C": "char",
+        "I": "int",
+        "J": "long",
+        "F": "float",
+        "D": "double",
+    }
+
+    java_primitive_types = {value: key for key, value in primitive_types.items()}
+
+    def __init__(self):
+        self.logger = logging.getLogger(
+            "{0}.{1}".format(__name__, self.__class__.__name__)
+        )
+
+        # The names of the obfuscators used to produce this mapping.
+        self.obfuscators: List[str] = []
+
+        # Original class name -> new class name (e.g., Lcom/app/Class; ->
+        # Lp1234abcd/p5678abcd/p90abcdef;).
+        self.classes: Dict[str, str] = {}
+
+        # Original class name -> {original method (name(params)return) -> new name}.
+        self.methods: Dict[str, Dict[str, str]] = {}
+
+        # Original class name -> {original field (name:type) -> new name}.
+        self.fields: Dict[str, Dict[str, str]] = {}
+
+        # Original class name -> (relative path of the smali file, sha256 of the
+        # original smali file).
+        self.class_files: Dict[str, Tuple[str, str]] = {}
+
+        # Current (renamed) class name -> original class name.
+        self._current_to_original: Dict[str, str] = {}
+
+    def get_original_class_name(self, class_name: str) -> str:
+        return self._current_to_original.get(class_name, class_name)
+
+    def _to_original_descriptor(self, descriptor: str) -> str:
+        # Replace the renamed classes in a descriptor with the original names.
+        return util.class_name_pattern.sub(
+            lambda match: self.get_original_class_name(match.group(0)), descriptor
+        )
+
+    def _split_member(self, member: str) -> Tuple[str, str]:
+        # Lcom/app/Class;->member -> (original class name, original member).
+        class_name, member = member.split("->", 1)
+        return (
+            self.get_original_class_name(class_name),
+            self._to_original_descriptor(member),
+        )
+
+    def add_planned_renames(self, rename_planner: RenamePlanner) -> None:
+        # All the names in the planner refer to the names before its rewrite, so
+        # methods and fields are added before updating the class names.
+        for method, new_method_name in rename_planner.method_renames.items():
+            class_name, method = self._split_member(method)
+            self.methods.setdefault(class_name, {})[method] = new_method_name
+
+        for field, new_field_name in rename_planner.field_declaration_renames.items():
+            class_name, field = self._split_member(field)
+            self.fields.setdefault(class_name, {})[field] = new_field_name
+
+        for class_name, new_class_name in rename_planner.class_renames.items():
+            original_class_name = self.get_original_class_name(class_name)
+            self.classes[original_class_name] = new_class_name
+            self._current_to_original.pop(class_name, None)
+            self._current_to_original[new_class_name] = original_class_name
+
+    def reuse_previous_names(
+        self, previous_mapping: "RenameMapping", rename_planner: RenamePlanner
+    ) -> None:
+        # Use the names of the previous mapping (if available) for the renaming
+        # planned in the current obfuscation, so the names stay the same across
+        # different versions of the application.
+        for method in rename_planner.method_renames:
+            class_name, original_method = self._split_member(method)
+            previous_name = previous_mapping.methods.get(class_name, {}).get(
+                original_method, None
+            )
+            if previous_name:
+                rename_planner.method_renames[method] = previous_name
+
+        for field in rename_planner.field_declaration_renames:
+            class_name, original_field = self._split_member(field)
+            previous_name = previous_mapping.fields.get(class_name, {}).get(
+                original_field, None
+            )
+            if previous_name:
+                rename_planner.field_declaration_renames[field] = previous_name
+                # The references are renamed using only the name and the type of
+                # the field.
+                field_reference = field.split("->", 1)[1]
+                rename_planner.field_reference_renames[field_reference] = previous_name
+
+        for class_name in rename_planner.class_renames:
+            previous_name = previous_mapping.classes.get(
+                self.get_original_class_name(class_name), None
+            )
+            if previous_name:
+                rename_planner.class_renames[class_name] = previous_name
+
+    @classmethod
+    def descriptor_to_java_type(cls, descriptor: str) -> str:
+        array_dimensions = len(descriptor) - len(descriptor.lstrip("["))
+        descriptor = descriptor[array_dimensions:]
+        if descriptor in cls.primitive_types:
+            java_type = cls.primitive_types[descriptor]
+        else:
+            java_type = descriptor[1:-1].replace("/", ".")
+        return java_type + "[]" * array_dimensions
+
+    @classmethod
+    def java_type_to_descriptor(cls, java_type: str) -> str:
+        array_dimensions = java_type.count("[]")
+        java_type = java_type.replace("[]", "")
+        if java_type in cls.java_primitive_types:
+            descriptor = cls.java_primitive_types[java_type]
+        else:
+            descriptor = "L{0};".format(java_type.replace(".", "/"))
+        return "[" * array_dimensions + descriptor
+
+    @classmethod
+    def split_parameter_descriptors(cls, parameters: str) -> List[str]:
+        descriptors: List[str] = []
+        index = 0
+        while index < len(parameters):
+            start = index
+            while parameters[index] == "[":
+                index += 1
+            if parameters[index] == "L":
+                index = parameters.index(";", index)
+            index += 1
+            descriptors.append(parameters[start:index])
+        return descriptors
+
+    def _method_to_java(self, method: str) -> str:
+        # name(params)return -> return name(param1,param2)
+        method_name, method_descriptor = method.split("(", 1)
+        parameters, return_type = method_descriptor.split(")", 1)
+        return "{0} {1}({2})".format(
+            self.descriptor_to_java_type(return_type),
+            method_name,
+            ",".join(
+                self.descriptor_to_java_type(parameter)
+                for parameter in self.split_parameter_descriptors(parameters)
+            ),
+        )
+
+    def _java_to_method(self, java_method: str) -> str:
+        return_type, method = java_method.split(" ", 1)
+        method_name, parameters = method.split("(", 1)
+        parameters = parameters.rstrip(")")
+        return "{0}({1}){2}".format(
+            method_name,
+            "".join(
+                self.java_type_to_descriptor(parameter)
+                for parameter in parameters.split(",")
+                if parameter
+            ),
+            self.java_type_to_descriptor(return_type),
+        )
+
+    def write(self, mapping_file: str) -> None:
+        try:
+            with open(mapping_file, "w", encoding="utf-8") as current_file:
+                current_file.write(
+                    "# obfuscators: {0}\n".format(",".join(self.obfuscators))
+                )
+
+                for class_name in sorted(
+                    set(self.class_files)
+                    | set(self.classes)
+                    | set(self.methods)
+                    | set(self.fields)
+                ):
+                    current_file.write(
+                        "{0} -> {1}:\n".format(
+                            self.descriptor_to_java_type(class_name),
+                            self.descriptor_to_java_type(
+                                self.classes.get(class_name, class_name)
+                            ),
+                        )
+                    )
+
+                    if class_name in self.class_files:
+                        relative_path, sha256 = self.class_files[class_name]
+                        current_file.write(
+                            "    # {0}\n".format(
+                                json.dumps(
+                                    {
+                                        "id": "obfuscapk.smali",
+                                        "file": relative_path,
+                                        "sha256": sha256,
+                                    },
+                                    separators=(",", ":"),
+                                )
+                            )
+                        )
+
+                    for field, new_field_name in sorted(
+                        self.fields.get(class_name, {}).items()
+                    ):
+                        field_name, field_type = field.split(":", 1)
+                        current_file.write(
+                            "    {0} {1} -> {2}\n".format(
+                                self.descriptor_to_java_type(field_type),
+                                field_name,
+                                new_field_name,
+                            )
+                        )
+
+                    for method, new_method_name in sorted(
+                        self.methods.get(class_name, {}).items()
+                    ):
+                        current_file.write(
+                            "    {0} -> {1}\n".format(
+                                self._method_to_java(method), new_method_name
+                            )
+                        )
+
+        except Exception as e:
+            self.logger.error(
+                'Error during rename mapping writing to "{0}": {1}'.format(
+                    mapping_file, e
+                )
+            )
+            raise
+
+    @classmethod
+    def load(cls, mapping_file: str) -> "RenameMapping":
+        mapping = cls()
+
+        try:
+            with open(mapping_file, "r", encoding="utf-8") as current_file:
+                class_name = None
+                for line in current_file:
+                    line = line.rstrip("\n")
+                    if not line.strip():
+                        continue
+
+                    if not line.startswith((" ", "\t")):
+                        if line.startswith("# obfuscators:"):
+                            mapping.obfuscators = [
+                                obfuscator.strip()
+                                for obfuscator in line.split(":", 1)[1].split(",")
+                                if obfuscator.strip()
+                            ]
+                        elif not line.startswith("#"):
+                            # Class: original -> new:
+                            original_name, new_name = line.rstrip(":").split(" -> ")
+                            class_name = cls.java_type_to_descriptor(original_name)
+                            new_class_name = cls.java_type_to_descriptor(new_name)
+                            if new_class_name != class_name:
+                                mapping.classes[class_name] = new_class_name
+                        continue
+
+                    line = line.strip()
+                    if class_name is None:
+                        continue
+
+                    if line.startswith("#"):
+                        file_info = json.loads(line[1:])
+                        if file_info.get("id", None) == "obfuscapk.smali":
+                            mapping.class_files[class_name] = (
+                                file_info["file"],
+                                file_info["sha256"],
+                            )
+                    else:
+                        member, new_member_name = line.split(" -> ")
+                        if "(" in member:
+                            mapping.methods.setdefault(class_name, {})[
+                                mapping._java_to_method(member)
+                            ] = new_member_name
+                        else:
+                            field_type, field_name = member.split(" ")
+                            mapping.fields.setdefault(class_name, {})[
+                                "{0}:{1}".format(
+                                    field_name, cls.java_type_to_descriptor(field_type)
+                                )
+                            ] = new_member_name
+
+        except Exception as e:
+            mapping.logger.error(
+                'Error during rename mapping loading from "{0}": {1}'.format(
+                    mapping_file, e
+                )
+            )
+            raise
+
+        return mapping
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+
+import logging
+import shutil
+from typing import Dict, List, Set, Tuple, Union
+
+from obfuscapk import util
+from obfuscapk.multi_pattern_replacer import MultiPatternReplacer
+
+
+class RenamePlanner(object):
+    """
+    This class collects the renaming of classes, methods and fields planned by the
+    rename obfuscators and then applies all of them with a single rewrite of each
+    smali (and xml) file.
+
+    Every rename obfuscator first reads the smali files to decide what to rename
+    (without changing any file) and adds its part of the mapping to the planner.
+    When more rename obfuscators are executed one after the other, the rewrite is
+    done only once, after the last of them. All the mappings refer to the names found
+    in the files before the rewrite.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(
+            "{0}.{1}".format(__name__, self.__class__.__name__)
+        )
+
+        # Smali file -> obfuscated smali file of a previous obfuscation to use instead
+        # of rewriting the file (for the classes that didn't change since the
+        # previous obfuscation, see Obfuscation.enable_incremental_obfuscation).
+        self.reusable_smali_files: Dict[str, str] = {}
+
+        self.reset()
+
+    def reset(self) -> None:
+        # Class renaming (ClassRename): old class name -> new class name (e.g.,
+        # Lcom/app/Class; -> Lp1234abcd/p5678abcd/p90abcdef;).
+        self.class_renames: Dict[str, str] = {}
+
+        # The package name of the application and its renamed version.
+        self.package_rename: Union[Tuple[str, str], None] = None
+
+        # Class name -> (old, new) name of the inner class, as found in the
+        # dalvik/annotation/InnerClass annotation of the class.
+        self.inner_class_renames: Dict[str, Tuple[str, str]] = {}
+
+        # Method renaming (MethodRename): Lcom/app/Class;->method(params)return ->
+        # new method name. Only direct methods are renamed, so both the declaration
+        # (in the declaring class) and the direct/static invocations are renamed.
+        self.method_renames: Dict[str, str] = {}
+
+        # Field renaming (FieldRename): the declarations to rename
+        # (Lcom/app/Class;->field:type -> new field name), the references to rename
+        # (field:type -> new field name, for any class not in the Android SDK) and
+        # the SDK classes whose fields can be renamed anyway (since they are declared
+        # in the application).
+        self.field_declaration_renames: Dict[str, str] = {}
+        self.field_reference_renames: Dict[str, str] = {}
+        self.field_reference_sdk_classes: Set[str] = set()
+
+        # Lcom/app/Class;->field:type -> names of the random fields to add after the
+        # declaration of the field.
+        self.added_fields: Dict[str, List[str]] = {}
+
+    def has_pending_renames(self) -> bool:
+        return bool(
+            self.class_renames
+            or self.package_rename
+            or self.inner_class_renames
+            or self.method_renames
+            or self.field_declaration_renames
+            or self.field_reference_renames
+        )
+
+    def add_class_renames(
+        self,
+        class_renames: Dict[str, str],
+        package_name: str,
+        encrypted_package_name: str,
+        inner_class_renames: Dict[str, Tuple[str, str]],
+    ) -> None:
+        self.class_renames.update(class_renames)
+        self.package_rename = (package_name, encrypted_package_name)
+        self.inner_class_renames.update(inner_class_renames)
+
+    def add_method_renames(self, method_renames: Dict[str, str]) -> None:
+        self.method_renames.update(method_renames)
+
+    def add_field_renames(
+        self,
+        field_declaration_renames: Dict[str, str],
+        field_reference_renames: Dict[str, str],
+        sdk_classes: Set[str],
+        added_fields: Dict[str, List[str]],
+    ) -> None:
+        self.field_declaration_renames.update(field_declaration_renames)
+        self.field_reference_renames.update(field_reference_renames)
+        self.field_reference_sdk_classes.update(sdk_classes)
+        self.added_fields.update(added_fields)
+
+    def slash_to_dot_notation_for_classes(
+        self, rename_transformations: Dict[str, str]
+    ) -> Dict[str, str]:
+        dot_rename_transformations: Dict[str, str] = {}
+
+        # Remove leading L and trailing ; from class names and replace / and $ with .
+        for old_name, new_name in rename_transformations.items():
+            dot_rename_transformations[
+                old_name[1:-1].replace("/", ".").replace("$", ".")
+            ] = (new_name[1:-1].replace("/", ".").replace("$", "."))
+
+        return dot_rename_transformations
+
+    def _get_dot_class_renames(self) -> Dict[str, str]:
+        dot_rename_transformations = self.slash_to_dot_notation_for_classes(
+            self.class_renames
+        )
+
+        # Add package name.
+        if self.package_rename:
+            dot_rename_transformations[self.package_rename[0]] = self.package_rename[1]
+
+        return dot_rename_transformations
+
+    def _get_smali_string_replacer(self) -> MultiPatternReplacer:
+        # Classes used as strings: with . instead of / (e.g., "com.app.Class") and,
+        # sometimes in annotations, without trailing ; (e.g., "Lcom/app/Class").
+        # All these strings are replaced in a single scan of each line.
+        string_replacements: Dict[str, str] = {
+            '"{0}"'.format(old_name[:-1]): '"{0}"'.format(new_name[:-1])
+            for old_name, new_name in self.class_renames.items()
+        }
+        string_replacements.update(
+            ('"{0}"'.format(old_name), '"{0}"'.format(new_name))
+            for old_name, new_name in self._get_dot_class_renames().items()
+        )
+        return MultiPatternReplacer(string_replacements)
+
+    def _get_xml_class_replacer(self) -> MultiPatternReplacer:
+        dot_rename_transformations = self._get_dot_class_renames()
+
+        xml_replacements: Dict[str, str] = dict(dot_rename_transformations)
+
+        # Activity without package name (".ActivityName").
+        if self.package_rename:
+            old_package_name, new_package_name = self.package_rename
+            for old_name, new_name in dot_rename_transformations.items():
+                if old_name.startswith(
+                    "{0}.".format(old_package_name)
+                ) and new_name.startswith("{0}.".format(new_package_name)):
+                    old_relative_name = '"{0}"'.format(
+                        old_name[len(old_package_name) :]
+                    )
+                    new_relative_name = '"{0}"'.format(
+                        new_name[len(new_package_name) :]
+                    )
+                    xml_replacements[old_relative_name] = new_relative_name
+
+        return MultiPatternReplacer(xml_replacements)
+
+    def _rename_class_name(self, class_match) -> str:
+        return self.class_renames.get(class_match.group(0), class_match.group(0))
+
+    def _rewrite_smali_file(
+        self, smali_file: str, string_replacer: MultiPatternReplacer
+    ) -> bool:
+        # Return True if the smali file was changed by the rewrite.
+        with util.inplace_edit_file(smali_file) as (in_file, out_file):
+            class_name = None
+            in_class_header = True
+            inner_class_annotation = False
+            for line in in_file:
+                # All the decisions are taken on the original line (the mappings
+                # contain the names before the rewrite), while the changes are
+                # applied to new_line.
+                new_line = line
+                added_lines: List[str] = []
+
+                if not class_name:
+                    class_match = util.class_pattern.match(line)
+                    if class_match:
+                        class_name = class_match.group("class_name")
+
+                if in_class_header:
+                    if line.startswith(".method "):
+                        in_class_header = False
+                    elif (
+                        line.strip()
+                        == ".annotation system Ldalvik/annotation/InnerClass;"
+                    ):
+                        inner_class_annotation = True
+                    elif line.strip() == ".end annotation":
+                        inner_class_annotation = False
+                    elif (
+                        inner_class_annotation
+                        and 'name = "' in line
+                        and class_name in self.inner_class_renames
+                    ):
+                        # Subclasses have to be renamed as well.
+                        old_inner_name, new_inner_name = self.inner_class_renames[
+                            class_name
+                        ]
+                        new_line = new_line.replace(old_inner_name, new_inner_name)
+
+                if self.method_renames:
+                    if line.startswith(".method "):
+                        # Method declaration.
+                        method_match = util.method_pattern.match(line)
+                        if method_match:
+                            method_name = method_match.group("method_name")
+                            new_method_name = self.method_renames.get(
+                                "{class_name}->{method_name}({method_param})"
+                                "{method_return}".format(
+                                    class_name=class_name,
+                                    method_name=method_name,
+                                    method_param=method_match.group("method_param"),
+                                    method_return=method_match.group("method_return"),
+                                ),
+                                None,
+                            )
+                            if new_method_name:
+                                new_line = new_line.replace(
+                                    "{0}(".format(method_name),
+                                    "{0}(".format(new_method_name),
+                                )
+                    else:
+                        # Method invocation (only direct methods are renamed, so only
+                        # direct and static invocations are considered).
+                        invoke_match = util.match_invoke(line)
+                        if invoke_match and (
+                            "direct" in invoke_match.group("invoke_type")
+                            or "static" in invoke_match.group("invoke_type")
+                        ):
+                            method_name = invoke_match.group("invoke_method")
+                            new_method_name = self.method_renames.get(
+                                "{class_name}->{method_name}({method_param})"
+                                "{method_return}".format(
+                                    class_name=invoke_match.group("invoke_object"),
+                                    method_name=method_name,
+                                    method_param=invoke_match.group("invoke_param"),
+                                    method_return=invoke_match.group("invoke_return"),
+                                ),
+                                None,
+                            )
+                            if new_method_name:
+                                new_line = new_line.replace(
+                                    "->{0}(".format(method_name),
+                                    "->{0}(".format(new_method_name),
+                                )
+
+                field_declaration = None
+                if self.field_declaration_renames and line.startswith(".field "):
+                    # Field declaration.
+                    field_match = util.field_pattern.match(line)
+                    if field_match:
+                        field_name = field_match.group("field_name")
+                        field_declaration = "{0}->{1}:{2}".format(
+                            class_name, field_name, field_match.group("field_type")
+                        )
+                        new_field_name = self.field_declaration_renames.get(
+                            field_declaration, None
+                        )
+                        if new_field_name:
+                            new_line = new_line.replace(
+                                "{0}:".format(field_name),
+                                "{0}:".format(new_field_name),
+                            )
+                elif self.field_reference_renames:
+                    # Field usage.
+                    field_usage_match = util.match_field_usage(line)
+                    if field_usage_match:
+                        field_name = field_usage_match.group("field_name")
+                        field_class_name = field_usage_match.group("field_object")
+                        new_field_name = self.field_reference_renames.get(
+                            "{0}:{1}".format(
+                                field_name, field_usage_match.group("field_type")
+                            ),
+                            None,
+                        )
+                        if new_field_name and (
+                            not field_class_name.startswith(("Landroid", "Ljava"))
+                            or field_class_name in self.field_reference_sdk_classes
+                        ):
+                            new_line = new_line.replace(
+                                "{0}:".format(field_name),
+                                "{0}:".format(new_field_name),
+                            )
+
+                if self.class_renames or self.package_rename:
+                    # Rename classes used as strings.
+                    if '"' in new_line:
+                        new_line = string_replacer.replace(new_line)
+
+                    # Rename classes used with the "classic" syntax
+                    # (leading L and trailing ;).
+                    new_line = util.class_name_pattern.sub(
+                        self._rename_class_name, new_line
+                    )
+
+                # Add the random fields after the (renamed) field declaration.
+                if field_declaration in self.added_fields:
+                    for random_field_name in self.added_fields[field_declaration]:
+                        added_lines.append("\n")
+                        added_lines.append(
+                            new_line.replace(":", "{0}:".format(random_field_name))
+                        )
+
+                out_file.write(new_line)
+                for added_line in added_lines:
+                    out_file.write(added_line)
+
+        return out_file.is_changed
+
+    def _rewrite_xml_file(
+        self, xml_file: str, xml_class_replacer: MultiPatternReplacer
+    ) -> None:
+        with open(xml_file, "r", encoding="utf-8") as current_file:
+            file_content = current_file.read()
+
+        new_file_content = xml_class_replacer.replace(file_content)
+
+        if new_file_content != file_content:
+            with open(xml_file, "w", encoding="utf-8") as current_file:
+                current_file.write(new_file_content)
+
+    def rewrite(
+        self, smali_files: List[str], xml_files: List[str], interactive: bool = False
+    ) -> None:
+        """
+        Apply all the planned renaming with a single rewrite of each file and clear
+        the plan.
+
+        :param smali_files: The smali files of the application.
+        :param xml_files: The xml files where to rename the classes (the manifest and
+                          the layout and xml resources). They are rewritten only if
+                          some class has to be renamed.
+        :param interactive: If True, show a progress bar.
+        """
+
+        if not self.has_pending_renames():
+            return
+
+        try:
+            string_replacer = self._get_smali_string_replacer()
+
+            changed_smali_files = 0
+            for smali_file in util.show_list_progress(
+                smali_files,
+                interactive=interactive,
+                description="Renaming classes, methods and fields in smali files",
+            ):
+                if smali_file in self.reusable_smali_files:
+                    # The class didn't change, so the result of the previous
+                    # obfuscation is used (the previous obfuscation is reused only
+                    # when all the renaming is applied with a single rewrite).
+                    shutil.copyfile(
+                        self.reusable_smali_files.pop(smali_file), smali_file
+                    )
+                elif self._rewrite_smali_file(smali_file, string_replacer):
+                    changed_smali_files += 1
+
+            self.logger.debug(
+                "{0} smali files changed by the rename rewrite".format(
+                    changed_smali_files
+                )
+            )
+
+            if self.class_renames or self.package_rename:
+                # The replacer is built only once and then used for all the xml files
+                # (all the class names are replaced with a single scan of each file,
+                # the longest class name is used when more names match at the same
+                # position).
+                xml_class_replacer = self._get_xml_class_replacer()
+
+                for xml_file in util.show_list_progress(
+                    xml_files,
+                    interactive=interactive,
+                    description="Renaming class usages in xml files",
+                ):
+                    self._rewrite_xml_file(xml_file, xml_class_replacer)
+
+        except Exception as e:
+            self.logger.error("Error during rename rewrite: {0}".format(e))
+            raise
+
+        finally:
+            self.reset()
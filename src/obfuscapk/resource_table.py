@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import xml.etree.cElementTree as Xml
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+
+class ResourceTable(object):
+    """
+    This class holds an index of the resources of a decoded application, built once
+    from res/values/public.xml (type, name and id of each resource), from the
+    res/values*/ xml files with string and array values (the files where each value is
+    defined) and from the res/<type>*/ directories (the files of each file based
+    resource type, e.g., layout).
+    """
+
+    # The xml files (in res/values*/ directories) whose values are indexed.
+    value_files = ("strings.xml", "arrays.xml")
+
+    # Mapping between the tags used in the indexed xml files and the corresponding
+    # resource types.
+    value_tag_to_type = {
+        "string": "string",
+        "plurals": "plurals",
+        "string-array": "array",
+        "integer-array": "array",
+        "array": "array",
+    }
+
+    def __init__(self, resource_directory: str):
+        self.logger = logging.getLogger(
+            "{0}.{1}".format(__name__, self.__class__.__name__)
+        )
+
+        self.resource_directory: str = resource_directory
+
+        # (resource type, resource name) -> resource id
+        self._name_to_id: Dict[Tuple[str, str], int] = {}
+
+        # (resource type, resource id) -> resource name
+        self._id_to_name: Dict[Tuple[str, int], str] = {}
+
+        # (resource type, resource name) -> files where the value is defined
+        self._value_to_files: Dict[Tuple[str, str], Set[str]] = {}
+
+        # resource type -> files of the file based resources of that type
+        self._type_to_files: Dict[str, List[str]] = {}
+
+        self._build()
+
+    @staticmethod
+    def get_resource_type_from_directory(directory_name: str) -> str:
+        # The directories in res/ are named <type>[-<qualifiers>] (e.g., values-it,
+        # layout-land).
+        return directory_name.split("-", 1)[0]
+
+    def _build(self) -> None:
+        if not os.path.isdir(self.resource_directory):
+            self.logger.debug(
+                'Resource directory "{0}" not found, the resource table will be '
+                "empty".format(self.resource_directory)
+            )
+            return
+
+        try:
+            public_xml_path = os.path.join(
+                self.resource_directory, "values", "public.xml"
+            )
+            if os.path.isfile(public_xml_path):
+                self._add_public_resources(public_xml_path)
+
+            with os.scandir(self.resource_directory) as resource_directories:
+                for resource_directory in sorted(
+                    resource_directories, key=lambda x: x.name
+                ):
+                    if not resource_directory.is_dir():
+                        continue
+
+                    resource_type = self.get_resource_type_from_directory(
+                        resource_directory.name
+                    )
+
+                    if resource_type == "values":
+                        for file_name in self.value_files:
+                            value_file = os.path.join(
+                                resource_directory.path, file_name
+                            )
+                            if os.path.isfile(value_file):
+                                self._add_value_resources(value_file)
+                    else:
+                        with os.scandir(resource_directory.path) as resource_files:
+                            self._type_to_files.setdefault(resource_type, []).extend(
+                                sorted(
+                                    resource_file.path
+                                    for resource_file in resource_files
+                                    if resource_file.is_file()
+                                )
+                            )
+
+        except Exception as e:
+            self.logger.error("Error during resource table creation: {0}".format(e))
+            raise
+
+    def _add_public_resources(self, public_xml_path: str) -> None:
+        for _, element in Xml.iterparse(public_xml_path):
+            if element.tag == "public":
+                resource_type = element.get("type")
+                resource_name = element.get("name")
+                resource_id = element.get("id")
+                if resource_type and resource_name and resource_id:
+                    resource_id = int(resource_id, 16)
+                    self._name_to_id[(resource_type, resource_name)] = resource_id
+                    self._id_to_name[(resource_type, resource_id)] = resource_name
+            element.clear()
+
+    def _add_value_resources(self, value_xml_path: str) -> None:
+        depth = 0
+        for event, element in Xml.iterparse(value_xml_path, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                # Only the direct children of the root <resources> element are values.
+                if depth == 2:
+                    resource_type = self.value_tag_to_type.get(element.tag, None)
+                    resource_name = element.get("name", None)
+                    if resource_type and resource_name:
+                        self._value_to_files.setdefault(
+                            (resource_type, resource_name), set()
+                        ).add(value_xml_path)
+            else:
+                depth -= 1
+                if depth == 1:
+                    element.clear()
+
+    def get_id(self, resource_type: str, resource_name: str) -> Union[int, None]:
+        return self._name_to_id.get((resource_type, resource_name), None)
+
+    def get_name(
+        self, resource_type: str, resource_id: Union[int, str]
+    ) -> Union[str, None]:
+        # The id can be also passed as it's found in smali code (e.g., "0x7f060000").
+        if isinstance(resource_id, str):
+            try:
+                resource_id = int(resource_id, 16)
+            except ValueError:
+                return None
+
+        return self._id_to_name.get((resource_type, resource_id), None)
+
+    def get_value_files(self, resource_type: str, resource_name: str) -> Set[str]:
+        return self._value_to_files.get((resource_type, resource_name), set())
+
+    def get_value_files_for_names(
+        self, resource_type: str, resource_names: Iterable[str]
+    ) -> Set[str]:
+        # Return only the files containing at least one of the selected values.
+        files: Set[str] = set()
+        for resource_name in resource_names:
+            files.update(self.get_value_files(resource_type, resource_name))
+        return files
+
+    def get_resource_files(self, resource_type: str) -> List[str]:
+        return self._type_to_files.get(resource_type, [])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import os
+from collections import OrderedDict
+from enum import Enum
+from typing import List, Tuple, Union
+
+from obfuscapk import util
+
+
+class SmaliLineKind(Enum):
+    BLANK = "blank"
+    COMMENT = "comment"
+    LABEL = "label"
+    # Directives.
+    CLASS = ".class"
+    SUPER = ".super"
+    FIELD = ".field"
+    METHOD = ".method"
+    END_METHOD = ".end method"
+    LOCALS = ".locals"
+    DIRECTIVE = "directive"
+    # Annotation value with a method (value = Lcom/app/Class;->method()V).
+    ANNOTATION_METHOD = "annotation method"
+    # Instructions.
+    INVOKE = "invoke"
+    FIELD_USAGE = "field usage"
+    CONST_STRING = "const-string"
+    INSTRUCTION = "instruction"
+
+
+class SmaliLine(object):
+    """
+    A line of a smali file, classified by the lexer. Depending on the kind of line,
+    only some of the attributes are set (the others are None):
+
+    CLASS, SUPER: class_name
+    FIELD: member (field name), type (field type)
+    METHOD: member (method name), parameters, type (return type)
+    LOCALS: literal (number of local registers, as a string)
+    ANNOTATION_METHOD: class_name, member, parameters, type
+    INVOKE: opcode, registers, class_name, member, parameters, type
+    FIELD_USAGE: opcode, registers, class_name, member, type
+    CONST_STRING: opcode, registers, literal (the string, still escaped)
+    INSTRUCTION, DIRECTIVE: opcode (the instruction or the directive)
+    """
+
+    __slots__ = (
+        "kind",
+        "opcode",
+        "registers",
+        "class_name",
+        "member",
+        "parameters",
+        "type",
+        "literal",
+    )
+
+    def __init__(
+        self,
+        kind: SmaliLineKind,
+        opcode: str = None,
+        registers: str = None,
+        class_name: str = None,
+        member: str = None,
+        parameters: str = None,
+        type: str = None,
+        literal: str = None,
+    ):
+        self.kind = kind
+        self.opcode = opcode
+        self.registers = registers
+        self.class_name = class_name
+        self.member = member
+        self.parameters = parameters
+        self.type = type
+        self.literal = literal
+
+    def get_method_reference(self, class_name: str = None) -> str:
+        # Lcom/app/Class;->method(I)V (the class name is needed for the methods
+        # declared in a class, since their lines don't contain it).
+        return "{0}->{1}({2}){3}".format(
+            self.class_name or class_name, self.member, self.parameters, self.type
+        )
+
+    def get_field_reference(self, class_name: str = None) -> str:
+        # Lcom/app/Class;->field:I (the class name is needed for the fields declared
+        # in a class, since their lines don't contain it).
+        return "{0}->{1}:{2}".format(
+            self.class_name or class_name, self.member, self.type
+        )
+
+
+# Shared records for the lines without details.
+_blank_line = SmaliLine(SmaliLineKind.BLANK)
+_comment_line = SmaliLine(SmaliLineKind.COMMENT)
+_label_line = SmaliLine(SmaliLineKind.LABEL)
+_end_method_line = SmaliLine(SmaliLineKind.END_METHOD, ".end")
+
+
+def classify_line(line: str) -> SmaliLine:
+    """
+    Classify a line of smali code. The kind of line is found from its first token,
+    so at most one of the util regex patterns is used for each line (the matches are
+    the same obtained by using the util patterns on the line).
+    """
+
+    stripped_line = line.lstrip()
+    if not stripped_line:
+        return _blank_line
+
+    first_char = stripped_line[0]
+    if first_char == "#":
+        return _comment_line
+    if first_char == ":":
+        return _label_line
+
+    token = stripped_line.split(None, 1)[0]
+
+    if first_char == ".":
+        if token == ".class":
+            match = util.class_pattern.match(line)
+            if match:
+                return SmaliLine(
+                    SmaliLineKind.CLASS, token, class_name=match.group("class_name")
+                )
+        elif token == ".super":
+            match = util.super_class_pattern.match(line)
+            if match:
+                return SmaliLine(
+                    SmaliLineKind.SUPER, token, class_name=match.group("class_name")
+                )
+        elif token == ".field":
+            match = util.field_pattern.match(line)
+            if match:
+                return SmaliLine(
+                    SmaliLineKind.FIELD,
+                    token,
+                    member=match.group("field_name"),
+                    type=match.group("field_type"),
+                )
+        elif token == ".method":
+            match = util.method_pattern.match(line)
+            if match:
+                return SmaliLine(
+                    SmaliLineKind.METHOD,
+                    token,
+                    member=match.group("method_name"),
+                    parameters=match.group("method_param"),
+                    type=match.group("method_return"),
+                )
+        elif token == ".end" and stripped_line.startswith(".end method"):
+            return _end_method_line
+        elif token == ".locals":
+            match = util.locals_pattern.match(line)
+            if match:
+                return SmaliLine(
+                    SmaliLineKind.LOCALS, token, literal=match.group("local_count")
+                )
+        return SmaliLine(SmaliLineKind.DIRECTIVE, token)
+
+    if token == "value":
+        match = util.annotation_method_pattern.match(line)
+        if match:
+            return SmaliLine(
+                SmaliLineKind.ANNOTATION_METHOD,
+                class_name=match.group("method_object"),
+                member=match.group("method_name"),
+                parameters=match.group("method_param"),
+                type=match.group("method_return"),
+            )
+    elif token.startswith("invoke-"):
+        match = util.invoke_pattern.match(line)
+        if match:
+            return SmaliLine(
+                SmaliLineKind.INVOKE,
+                match.group("invoke_type"),
+                registers=match.group("invoke_pass"),
+                class_name=match.group("invoke_object"),
+                member=match.group("invoke_method"),
+                parameters=match.group("invoke_param"),
+                type=match.group("invoke_return"),
+            )
+    elif first_char in "is" and token[1:4] in ("get", "put"):
+        match = util.field_usage_pattern.match(line)
+        if match:
+            return SmaliLine(
+                SmaliLineKind.FIELD_USAGE,
+                match.group("usage_type"),
+                registers=match.group("field_param"),
+                class_name=match.group("field_object"),
+                member=match.group("field_name"),
+                type=match.group("field_type"),
+            )
+    elif token.startswith("const-string"):
+        match = util.const_string_pattern.match(line)
+        if match:
+            return SmaliLine(
+                SmaliLineKind.CONST_STRING,
+                token,
+                registers=match.group("register"),
+                literal=match.group("string"),
+            )
+
+    return SmaliLine(SmaliLineKind.INSTRUCTION, token)
+
+
+class SmaliLexer(object):
+    """
+    Classify the lines of smali files. The classified lines of the most recently
+    used files are cached, and the cache of a file is used until the file changes.
+    """
+
+    max_cached_files = 2048
+
+    def __init__(self):
+        # Smali file -> (stat of the file when it was classified, classified lines).
+        self._cache: "OrderedDict[str, Tuple[tuple, List[SmaliLine]]]" = OrderedDict()
+
+    @staticmethod
+    def _get_file_signature(smali_file: str) -> tuple:
+        # The files are rewritten by replacing them, so a change is detected by
+        # comparing the inode, the size and the modification time.
+        file_stat = os.stat(smali_file)
+        return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+    def lex_file(self, smali_file: str) -> List[SmaliLine]:
+        file_signature = self._get_file_signature(smali_file)
+
+        cached: Union[Tuple[tuple, List[SmaliLine]], None] = self._cache.get(
+            smali_file, None
+        )
+        if cached and cached[0] == file_signature:
+            self._cache.move_to_end(smali_file)
+            return cached[1]
+
+        with open(smali_file, "r", encoding="utf-8") as current_file:
+            smali_lines = [classify_line(line) for line in current_file]
+
+        self._cache[smali_file] = (file_signature, smali_lines)
+        self._cache.move_to_end(smali_file)
+        if len(self._cache) > self.max_cached_files:
+            self._cache.popitem(last=False)
+
+        return smali_lines
+
+    def clear(self) -> None:
+        self._cache.clear()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import bisect
+from typing import Dict, List, Tuple, Union
+
+from obfuscapk import util
+
+
+def _decode(line: Union[str, bytes]) -> str:
+    if isinstance(line, bytes):
+        return line.decode("utf-8", errors="replace")
+    return line
+
+
+class SmaliMethod(object):
+    """
+    The position of a method in the lines of a smali file (all the positions are
+    line numbers, starting from 0).
+    """
+
+    __slots__ = (
+        "start",
+        "end",
+        "locals_line",
+        "local_count",
+        "try_blocks",
+        "is_abstract",
+        "is_native",
+        "is_static_constructor",
+        "_try_starts",
+        "_try_ends",
+    )
+
+    def __init__(self, start: int, declaration: str):
+        # The .method and .end method lines.
+        self.start: int = start
+        self.end: Union[int, None] = None
+
+        # The .locals line and the number of local registers (None if the method
+        # has no .locals declaration).
+        self.locals_line: Union[int, None] = None
+        self.local_count: Union[int, None] = None
+
+        # (:try_start_N line, :try_end_N line) for each try block of the method.
+        self.try_blocks: List[Tuple[int, int]] = []
+
+        # The try blocks as sorted and non overlapping ranges (set when the end of
+        # the method is found), to check with a binary search if a line is in a try
+        # block.
+        self._try_starts: List[int] = []
+        self._try_ends: List[int] = []
+
+        self.is_abstract: bool = " abstract " in declaration
+        self.is_native: bool = " native " in declaration
+        self.is_static_constructor: bool = declaration.strip().endswith(
+            "static constructor <clinit>()V"
+        )
+
+    @property
+    def has_code(self) -> bool:
+        return not self.is_abstract and not self.is_native
+
+    def _index_try_blocks(self) -> None:
+        self._try_starts, self._try_ends = [], []
+        for start, end in sorted(self.try_blocks):
+            if self._try_ends and start < self._try_ends[-1]:
+                # Overlapping try blocks are merged.
+                self._try_ends[-1] = max(self._try_ends[-1], end)
+            else:
+                self._try_starts.append(start)
+                self._try_ends.append(end)
+
+    def is_in_try_block(self, line_number: int) -> bool:
+        # The last try block starting before the line is the only one that can
+        # contain it.
+        index = bisect.bisect_left(self._try_starts, line_number)
+        return index > 0 and line_number < self._try_ends[index - 1]
+
+
+class SmaliMethodIndex(object):
+    """
+    The positions of the methods (with their .locals declarations and try blocks)
+    and of the sections (# static fields, # direct methods etc.) in the lines of a
+    smali file, found with a single pass over the lines (either str or bytes), so the
+    obfuscators can go straight to the methods they change. The obfuscators replace
+    the content of the lines without inserting new ones (a replaced line can contain
+    more instructions), so the positions remain valid while editing.
+    """
+
+    def __init__(self, lines: Union[List[str], List[bytes]]):
+        self.methods: List[SmaliMethod] = []
+
+        # The name of the section (e.g., "direct methods") -> line number of the
+        # section comment.
+        self.sections: Dict[str, int] = {}
+
+        # The lines are not decoded when processing a file in binary mode (only the
+        # method declarations and the section comments are decoded).
+        if lines and isinstance(lines[0], bytes):
+            method_prefix, end_method_prefix = b".method ", b".end method"
+            section_prefix, section_suffixes = b"# ", (b"fields", b"methods")
+            locals_prefix, locals_pattern = b".locals", util.locals_bytes_pattern
+            try_start_prefix, try_end_prefix = b":try_start_", b":try_end_"
+        else:
+            method_prefix, end_method_prefix = ".method ", ".end method"
+            section_prefix, section_suffixes = "# ", ("fields", "methods")
+            locals_prefix, locals_pattern = ".locals", util.locals_pattern
+            try_start_prefix, try_end_prefix = ":try_start_", ":try_end_"
+
+        current_method: Union[SmaliMethod, None] = None
+        try_starts: Dict[Union[str, bytes], int] = {}
+        for line_number, line in enumerate(lines):
+            if current_method is None:
+                if line.startswith(method_prefix):
+                    current_method = SmaliMethod(line_number, _decode(line))
+                    try_starts = {}
+                elif line.startswith(section_prefix) and line.rstrip().endswith(
+                    section_suffixes
+                ):
+                    section = _decode(line[2:].rstrip())
+                    self.sections.setdefault(section, line_number)
+                continue
+
+            if line.startswith(end_method_prefix):
+                current_method.end = line_number
+                current_method._index_try_blocks()
+                self.methods.append(current_method)
+                current_method = None
+                continue
+
+            stripped_line = line.lstrip()
+            if stripped_line.startswith(locals_prefix):
+                locals_match = locals_pattern.match(line)
+                if locals_match and current_method.locals_line is None:
+                    current_method.locals_line = line_number
+                    current_method.local_count = int(locals_match.group("local_count"))
+            elif stripped_line.startswith(try_start_prefix):
+                try_label = stripped_line[len(try_start_prefix) :].rstrip()
+                try_starts[try_label] = line_number
+            elif stripped_line.startswith(try_end_prefix):
+                try_label = stripped_line[len(try_end_prefix) :].rstrip()
+                try_start = try_starts.pop(try_label, None)
+                if try_start is not None:
+                    current_method.try_blocks.append((try_start, line_number))
+
+        self._method_starts: List[int] = [method.start for method in self.methods]
+
+    def get_method_at(self, line_number: int) -> Union[SmaliMethod, None]:
+        # The method containing a line (None if the line is not inside a method).
+        index = bisect.bisect_right(self._method_starts, line_number)
+        if index and line_number <= self.methods[index - 1].end:
+            return self.methods[index - 1]
+        return None
+
+    def get_static_constructor(self) -> Union[SmaliMethod, None]:
+        for method in self.methods:
+            if method.is_static_constructor:
+                return method
+        return None
@@ -1,16 +1,18 @@
 #!/usr/bin/env python3
 
+import functools
+import io
 import itertools
 import logging
 import os
 import random
 import re
+import stat
 import string
+import tempfile
 from contextlib import contextmanager
 from hashlib import md5, sha256
-from typing import List
-
-from tqdm import tqdm
+from typing import FrozenSet, List, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -84,6 +86,47 @@ const_string_pattern = re.compile(
 )
 
 
+# The same patterns, to be used on the lines of the smali files read in binary mode
+# (the smali files are almost entirely ASCII, so there is no need to decode every line
+# only to match it).
+def get_bytes_pattern(pattern: "re.Pattern") -> "re.Pattern":
+    return re.compile(pattern.pattern.encode(), pattern.flags & ~re.UNICODE)
+
+
+class_name_bytes_pattern = get_bytes_pattern(class_name_pattern)
+class_bytes_pattern = get_bytes_pattern(class_pattern)
+super_class_bytes_pattern = get_bytes_pattern(super_class_pattern)
+locals_bytes_pattern = get_bytes_pattern(locals_pattern)
+field_bytes_pattern = get_bytes_pattern(field_pattern)
+method_bytes_pattern = get_bytes_pattern(method_pattern)
+annotation_method_bytes_pattern = get_bytes_pattern(annotation_method_pattern)
+field_usage_bytes_pattern = get_bytes_pattern(field_usage_pattern)
+invoke_bytes_pattern = get_bytes_pattern(invoke_pattern)
+const_string_bytes_pattern = get_bytes_pattern(const_string_pattern)
+
+
+# Most of the lines of a smali file can't match invoke_pattern, field_usage_pattern and
+# const_string_pattern. When trying them on every line, use the following functions:
+# they check first that the line contains a substring of the instruction, which is much
+# faster than calling the regex (even when the regex fails at the first characters).
+def match_invoke(line: str) -> Optional["re.Match"]:
+    if "invoke-" in line:
+        return invoke_pattern.match(line)
+    return None
+
+
+def match_field_usage(line: str) -> Optional["re.Match"]:
+    if "->" in line and ":" in line:
+        return field_usage_pattern.match(line)
+    return None
+
+
+def match_const_string_bytes(line: bytes) -> Optional["re.Match"]:
+    if b"const-string" in line:
+        return const_string_bytes_pattern.match(line)
+    return None
+
+
 ########################################################################################
 
 
@@ -99,6 +142,9 @@ def show_list_progress(
     if not interactive:
         return the_list
     else:
+        # Imported only when needed, since it slows down the startup.
+        from tqdm import tqdm
+
         return tqdm(
             the_list,
             dynamic_ncols=True,
@@ -141,61 +187,94 @@ def get_string_md5(input_string: str) -> str:
     return md5(input_string.encode()).hexdigest()
 
 
-# Adapted from https://www.zopatista.com/python/2013/11/26/inplace-file-rewriting/
-@contextmanager
-def inplace_edit_file(file_name: str):
-    """
-    Allow for a file to be replaced with new content.
+class _InplaceEditTextBuffer(io.StringIO):
+    # After the editing, is_changed tells if the file was actually replaced.
+    is_changed = False
 
-    Yield a tuple of (readable, writable) file objects, where writable replaces
-    readable. If an exception occurs, the old file is restored, removing the
-    written data.
-    """
 
-    backup_file_name = "{0}{1}{2}".format(file_name, os.extsep, "bak")
+class _InplaceEditBytesBuffer(io.BytesIO):
+    # After the editing, is_changed tells if the file was actually replaced.
+    is_changed = False
 
-    try:
-        os.unlink(backup_file_name)
-    except OSError:
-        pass
-    os.rename(file_name, backup_file_name)
 
-    readable = open(backup_file_name, "r", encoding="utf-8")
+def replace_file_content(file_name: str, new_content: bytes) -> None:
+    # Write the new content into a temporary file in the same directory and then
+    # replace the original file with it (so the file is never left half written).
+    file_mode = os.stat(file_name).st_mode
+    fd, tmp_file_name = tempfile.mkstemp(
+        prefix="{0}.".format(os.path.basename(file_name)),
+        suffix="{0}tmp".format(os.extsep),
+        dir=os.path.dirname(os.path.abspath(file_name)),
+    )
     try:
-        perm = os.fstat(readable.fileno()).st_mode
-    except OSError:
-        writable = open(file_name, "w", encoding="utf-8", newline="")
-    else:
-        os_mode = os.O_CREAT | os.O_WRONLY | os.O_TRUNC
-        if hasattr(os, "O_BINARY"):
-            os_mode |= os.O_BINARY
-        fd = os.open(file_name, os_mode, perm)
-        writable = open(fd, "w", encoding="utf-8", newline="")
+        with open(fd, "wb") as tmp_file:
+            tmp_file.write(new_content)
+        os.chmod(tmp_file_name, stat.S_IMODE(file_mode))
+        os.replace(tmp_file_name, file_name)
+    except Exception:
         try:
-            if hasattr(os, "chmod"):
-                os.chmod(file_name, perm)
+            os.unlink(tmp_file_name)
         except OSError:
             pass
+        raise
+
+
+@contextmanager
+def inplace_edit_file(file_name: str, binary: bool = False):
+    """
+    Allow for a file to be replaced with new content.
+
+    Yield a tuple of (readable, writable) file objects, where writable replaces
+    readable. The new content is kept in memory and, at the end, the file is replaced
+    (atomically) only if its content changed, so the files left unchanged are not
+    written again. After the editing, writable.is_changed is True if the file was
+    replaced. If an exception occurs, the original file is left untouched. If binary
+    is True, the lines are read and written as bytes (they are not decoded/encoded).
+    """
+
     try:
-        yield readable, writable
-    except Exception as e:
-        try:
-            os.unlink(file_name)
-        except OSError:
-            pass
-        os.rename(backup_file_name, file_name)
+        with open(file_name, "rb") as original_file:
+            original_content = original_file.read()
+
+        if binary:
+            readable = io.BytesIO(original_content)
+            writable = _InplaceEditBytesBuffer()
+        else:
+            readable = io.TextIOWrapper(io.BytesIO(original_content), encoding="utf-8")
+            writable = _InplaceEditTextBuffer(newline="")
+
+        with readable, writable:
+            yield readable, writable
+
+            new_content = writable.getvalue()
+            if not binary:
+                new_content = new_content.encode("utf-8")
+
+            if new_content != original_content:
+                replace_file_content(file_name, new_content)
+                writable.is_changed = True
 
+    except Exception as e:
         logger.error(
             'Error during inplace editing file "{0}": {1}'.format(file_name, e)
         )
         raise
-    finally:
-        readable.close()
-        writable.close()
-        try:
-            os.unlink(backup_file_name)
-        except OSError:
-            pass
+
+
+@contextmanager
+def inplace_edit_binary_file(file_name: str):
+    # Same as inplace_edit_file, but the lines are read and written as bytes.
+    with inplace_edit_file(file_name, binary=True) as (readable, writable):
+        yield readable, writable
+
+
+def with_line_ending(code: bytes, line: bytes) -> bytes:
+    # The code inserted next to a line of a smali file read in binary mode has to use
+    # the same line ending of that line (otherwise a file with Windows line endings
+    # would end up with mixed line endings).
+    if line.endswith(b"\r\n"):
+        return code.replace(b"\n", b"\r\n")
+    return code
 
 
 def get_text_from_file(file_name: str) -> str:
@@ -217,40 +296,41 @@ def get_non_empty_lines_from_file(file_name: str) -> List[str]:
         raise
 
 
+def get_resource_path(resource_name: str) -> str:
+    return os.path.join(os.path.dirname(__file__), "resources", resource_name)
+
+
+# The tables in the resources directory are read only once per process (the result is
+# cached and is an immutable set, so it can be shared by all the obfuscators and used
+# for O(1) lookups).
+@functools.lru_cache(maxsize=None)
+def get_resource_file_set(resource_name: str) -> FrozenSet[str]:
+    return frozenset(get_non_empty_lines_from_file(get_resource_path(resource_name)))
+
+
 # Adapted from https://github.com/pkumza/LiteRadar
-def get_libs_to_ignore() -> List[str]:
-    return get_non_empty_lines_from_file(
-        os.path.join(os.path.dirname(__file__), "resources", "libs_to_ignore.txt")
-    )
+def get_libs_to_ignore() -> FrozenSet[str]:
+    return get_resource_file_set("libs_to_ignore.txt")
 
 
 # Adapted from https://github.com/reddr/axplorer
-def get_dangerous_api() -> List[str]:
-    return get_non_empty_lines_from_file(
-        os.path.join(os.path.dirname(__file__), "resources", "dangerous_api.txt")
-    )
+def get_dangerous_api() -> FrozenSet[str]:
+    return get_resource_file_set("dangerous_api.txt")
 
 
-def get_nop_valid_op_codes() -> List[str]:
-    return get_non_empty_lines_from_file(
-        os.path.join(os.path.dirname(__file__), "resources", "nop_valid_op_codes.txt")
-    )
+def get_nop_valid_op_codes() -> FrozenSet[str]:
+    return get_resource_file_set("nop_valid_op_codes.txt")
 
 
-def get_code_block_valid_op_codes() -> List[str]:
-    return get_non_empty_lines_from_file(
-        os.path.join(
-            os.path.dirname(__file__), "resources", "code_block_valid_op_codes.txt"
-        )
-    )
+def get_code_block_valid_op_codes() -> FrozenSet[str]:
+    return get_resource_file_set("code_block_valid_op_codes.txt")
 
 
-def get_android_class_names() -> List[str]:
-    return get_non_empty_lines_from_file(
-        os.path.join(
-            os.path.dirname(__file__), "resources", "android_class_names_api_27.txt"
-        )
-    )
+# The class names of each Android API level are read from
+# android_class_names_api_<api_level>.txt (only API level 27 is currently shipped, add
+# the file of another API level to use it). Each API level is cached separately.
+def get_android_class_names(api_level: int = 27) -> FrozenSet[str]:
+    return get_resource_file_set("android_class_names_api_{0}.txt".format(api_level))
 
 
 def get_smali_method_overload() -> str:
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import re
+import stat
+import tempfile
+import xml.parsers.expat
+from typing import Callable, Dict, List, Tuple, Union
+from xml.sax.saxutils import escape, quoteattr
+
+# The ancestors of an element, as a list of (tag, attributes) tuples (the first
+# element of the list is the root of the document).
+XmlParents = List[Tuple[str, Dict[str, str]]]
+
+# new_text(tag, attributes, text, parents) returns the new text of the element (the
+# text before its first child element, if any), or None to leave it unchanged.
+NewTextCallback = Callable[[str, Dict[str, str], str, XmlParents], Union[str, None]]
+
+# new_attributes(tag, attributes, parents) returns a dictionary with the attributes
+# of the element to change or to add, or None to leave the element unchanged.
+NewAttributesCallback = Callable[
+    [str, Dict[str, str], XmlParents], Union[Dict[str, str], None]
+]
+
+
+class StreamingXmlRewriter(object):
+    """
+    Rewrite the text and/or the attributes of some elements of an xml file without
+    loading the whole xml tree into memory. The file is parsed in a streaming way and
+    all the spans that are not changed are copied verbatim (formatting, comments and
+    quotes are preserved). The new text of an element replaces all its original text,
+    so the comments inside the text of a rewritten element are not kept. A file
+    without any change is never written, and a rewritten file keeps its permissions.
+    """
+
+    chunk_size = 65536
+
+    def __init__(
+        self,
+        new_text: NewTextCallback = None,
+        new_attributes: NewAttributesCallback = None,
+    ):
+        self.logger = logging.getLogger(
+            "{0}.{1}".format(__name__, self.__class__.__name__)
+        )
+
+        self.new_text = new_text
+        self.new_attributes = new_attributes
+
+    @staticmethod
+    def _find_start_tag_end(raw_file, start_tag_index: int) -> int:
+        # Return the position right after the ">" closing the start tag beginning at
+        # the specified position (a ">" inside a quoted attribute value is ignored).
+        raw_file.seek(start_tag_index)
+        position = start_tag_index
+        quote = None
+        while True:
+            chunk = raw_file.read(1024)
+            if not chunk:
+                raise ValueError(
+                    "Unterminated start tag at position {0}".format(start_tag_index)
+                )
+            for byte in chunk:
+                position += 1
+                if quote:
+                    if byte == quote:
+                        quote = None
+                elif byte == 0x22 or byte == 0x27:  # " or '
+                    quote = byte
+                elif byte == 0x3E:  # >
+                    return position
+
+    @staticmethod
+    def _set_attributes(start_tag: str, attributes: Dict[str, str]) -> str:
+        for attribute_name, attribute_value in attributes.items():
+            attribute_pattern = re.compile(
+                r"(\s{0}\s*=\s*)(\"[^\"]*\"|'[^']*')".format(re.escape(attribute_name))
+            )
+            new_value = quoteattr(attribute_value)
+            if attribute_pattern.search(start_tag):
+                start_tag = attribute_pattern.sub(
+                    lambda match: "{0}{1}".format(match.group(1), new_value),
+                    start_tag,
+                    count=1,
+                )
+            else:
+                # Add the new attribute at the end of the start tag.
+                closing = "/>" if start_tag.endswith("/>") else ">"
+                start_tag = "{0} {1}={2}{3}".format(
+                    start_tag[: -len(closing)].rstrip(),
+                    attribute_name,
+                    new_value,
+                    closing,
+                )
+        return start_tag
+
+    def rewrite(self, xml_file: str) -> bool:
+        """
+        Apply the callbacks to the elements of the xml file.
+
+        :param xml_file: The path of the xml file to rewrite.
+        :return: True if the file was changed, False otherwise (in this case the file
+                 is not written at all).
+        """
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+
+        # Stack with an entry for each open element: [tag, attributes, start tag
+        # position, list with the text parts (None after the first child)].
+        stack: List[list] = []
+
+        # State of the output (created only when the first change is found).
+        state = {"out_file": None, "tmp_path": None, "copied_up_to": 0}
+
+        source_file = open(xml_file, "rb")
+        raw_file = open(xml_file, "rb")
+
+        def write_edit(start: int, end: int, replacement: str):
+            if state["out_file"] is None:
+                fd, state["tmp_path"] = tempfile.mkstemp(
+                    dir=os.path.dirname(os.path.abspath(xml_file)),
+                    prefix=".{0}.".format(os.path.basename(xml_file)),
+                    suffix=".tmp",
+                )
+                state["out_file"] = os.fdopen(fd, "wb")
+
+            # Copy verbatim everything before the changed span.
+            source_file.seek(state["copied_up_to"])
+            remaining = start - state["copied_up_to"]
+            while remaining > 0:
+                chunk = source_file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                state["out_file"].write(chunk)
+                remaining -= len(chunk)
+
+            state["out_file"].write(replacement.encode("utf-8"))
+            state["copied_up_to"] = end
+
+        def get_parents() -> XmlParents:
+            return [(entry[0], entry[1]) for entry in stack[:-1]]
+
+        def read_raw(start: int, end: int) -> str:
+            raw_file.seek(start)
+            return raw_file.read(end - start).decode("utf-8")
+
+        def finalize_text(end_index: int, is_end_of_element: bool):
+            # Called when the text of the current element is complete (when its
+            # first child starts or when the element ends).
+            entry = stack[-1]
+            text_parts = entry[3]
+            entry[3] = None
+            if text_parts is None or not self.new_text:
+                return
+
+            text = "".join(text_parts)
+            new_text = self.new_text(entry[0], entry[1], text, get_parents())
+            if new_text is None or new_text == text:
+                return
+
+            tag_end = self._find_start_tag_end(raw_file, entry[2])
+            if is_end_of_element and end_index == tag_end:
+                start_tag = read_raw(entry[2], tag_end)
+                if start_tag.endswith("/>"):
+                    # Self-closing element, it has to be expanded to add the text.
+                    write_edit(
+                        entry[2],
+                        tag_end,
+                        "{0}>{1}</{2}>".format(
+                            start_tag[:-2].rstrip(), escape(new_text), entry[0]
+                        ),
+                    )
+                    return
+
+            write_edit(tag_end, end_index, escape(new_text))
+
+        def start_element(tag: str, attributes: Dict[str, str]):
+            start_index = parser.CurrentByteIndex
+            if stack:
+                finalize_text(start_index, False)
+
+            stack.append([tag, attributes, start_index, []])
+
+            if self.new_attributes:
+                new_attributes = self.new_attributes(tag, attributes, get_parents())
+                if new_attributes:
+                    tag_end = self._find_start_tag_end(raw_file, start_index)
+                    write_edit(
+                        start_index,
+                        tag_end,
+                        self._set_attributes(
+                            read_raw(start_index, tag_end), new_attributes
+                        ),
+                    )
+
+        def end_element(_: str):
+            finalize_text(parser.CurrentByteIndex, True)
+            stack.pop()
+
+        def character_data(data: str):
+            if stack and stack[-1][3] is not None:
+                stack[-1][3].append(data)
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+
+        try:
+            with open(xml_file, "rb") as parsed_file:
+                parser.ParseFile(parsed_file)
+
+            if state["out_file"] is not None:
+                # Copy the rest of the file after the last change.
+                source_file.seek(state["copied_up_to"])
+                for chunk in iter(lambda: source_file.read(self.chunk_size), b""):
+                    state["out_file"].write(chunk)
+                state["out_file"].close()
+                os.chmod(state["tmp_path"], stat.S_IMODE(os.stat(xml_file).st_mode))
+                os.replace(state["tmp_path"], xml_file)
+                return True
+
+            return False
+
+        except Exception as e:
+            if state["out_file"] is not None:
+                state["out_file"].close()
+                try:
+                    os.unlink(state["tmp_path"])
+                except OSError:
+                    pass
+
+            self.logger.error(
+                'Error during streaming rewrite of xml file "{0}": {1}'.format(
+                    xml_file, e
+                )
+            )
+            raise
+
+        finally:
+            source_file.close()
+            raw_file.close()
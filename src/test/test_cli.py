@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import json
 import os
 
 import pytest
@@ -95,6 +96,48 @@ class TestCommandLine(object):
 
         assert os.path.isfile(obfuscated_apk_path)
 
+    def test_valid_basic_command_with_stats_file(
+        self,
+        tmp_working_directory_path: str,
+        tmp_demo_apk_v10_original_path: str,
+        monkeypatch,
+    ):
+        obfuscated_apk_path = os.path.join(tmp_working_directory_path, "obfuscated.apk")
+
+        # Mock the command line parser.
+        arguments = cli.get_cmd_args(
+            "-w {working_dir} -d {destination} "
+            "-o Nop -o Rebuild {apk_file} --stats".format(
+                working_dir=tmp_working_directory_path,
+                destination=obfuscated_apk_path,
+                apk_file=tmp_demo_apk_v10_original_path,
+            ).split()
+        )
+        monkeypatch.setattr(cli, "get_cmd_args", lambda: arguments)
+
+        cli.main()
+
+        stats_file = os.path.join(tmp_working_directory_path, "obfuscated.stats.json")
+        with open(stats_file, "r", encoding="utf-8") as json_stats_file:
+            stats = json.load(json_stats_file)
+        assert [step["name"] for step in stats["steps"]] == [
+            "decode",
+            "Nop",
+            "build",
+            "Rebuild",
+        ]
+
+    def test_stats_file_before_apk_file(self):
+        arguments = cli.get_cmd_args("-o Nop --stats-file stats.json app.apk".split())
+        assert arguments.stats_file == "stats.json"
+        assert arguments.apk_file == "app.apk"
+        assert arguments.stats is False
+
+        arguments = cli.get_cmd_args("-o Nop --stats app.apk".split())
+        assert arguments.stats_file is None
+        assert arguments.apk_file == "app.apk"
+        assert arguments.stats is True
+
     def test_missing_required_parameters(self, monkeypatch):
         # Mock the command line parser.
         original = cli.get_cmd_args
@@ -104,6 +147,36 @@ class TestCommandLine(object):
             cli.main()
         assert e.value.code == 2
 
+    def test_invalid_capacity_weight(self):
+        for capacity_weight in ("Callindirection=2", "CallIndirection=inf"):
+            with pytest.raises(SystemExit) as e:
+                cli.get_cmd_args(
+                    "-o CallIndirection --capacity-weight {0} ignore.apk".format(
+                        capacity_weight
+                    ).split()
+                )
+            assert e.value.code == 2
+
+        arguments = cli.get_cmd_args(
+            "-o CallIndirection --capacity-weight CallIndirection=2 ignore.apk".split()
+        )
+        assert arguments.capacity_weight == [("CallIndirection", 2.0)]
+
+    def test_invalid_call_indirection_cache(self):
+        for cache_size in ("-1", "one"):
+            with pytest.raises(SystemExit) as e:
+                cli.get_cmd_args(
+                    "-o CallIndirection --call-indirection-cache {0} ignore.apk".format(
+                        cache_size
+                    ).split()
+                )
+            assert e.value.code == 2
+
+        arguments = cli.get_cmd_args(
+            "-o CallIndirection --call-indirection-cache 0 ignore.apk".split()
+        )
+        assert arguments.call_indirection_cache == 0
+
     def test_missing_external_tool(self, monkeypatch):
         monkeypatch.setenv("APKTOOL_PATH", "invalid.apktool.path")
 
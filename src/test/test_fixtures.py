@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
+import os
 import shutil
 from pathlib import Path
+from typing import Dict, Union
 
 import pytest
 
@@ -68,3 +70,29 @@ def tmp_demo_apk_v10_decoded_files_directory_path(tmp_path) -> str:
     destination = tmp_path.joinpath("com.obfuscapk.demo.v1.0-original")
     destination = shutil.copytree(source, destination)
     return str(destination)
+
+
+@pytest.fixture(scope="function")
+def synthetic_decoded_files(monkeypatch) -> Dict[str, Union[str, bytes]]:
+    """
+    Return an empty dictionary (relative path -> content) to fill with the files of a
+    synthetic decoded application. When an application is decoded, these files are
+    written in the output directory instead of running Apktool. This can be useful to
+    test small smali trees.
+    """
+    decoded_files: Dict[str, Union[str, bytes]] = {}
+
+    class SyntheticDecoder(object):
+        def decode(self, _, output_dir_path: str, force: bool = False) -> str:
+            for relative_path, content in decoded_files.items():
+                file_path = os.path.join(output_dir_path, *relative_path.split("/"))
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                if isinstance(content, str):
+                    content = content.encode("utf-8")
+                with open(file_path, "wb") as file:
+                    file.write(content)
+            return output_dir_path
+
+    monkeypatch.setattr("obfuscapk.obfuscation.Apktool", SyntheticDecoder)
+    monkeypatch.setattr("obfuscapk.obfuscation.BundleDecompiler", SyntheticDecoder)
+    return decoded_files
@@ -1,18 +1,45 @@
 #!/usr/bin/env python3
 
+import filecmp
 import os
+import shutil
+from collections import OrderedDict
+from io import StringIO
 
 import pytest
 
+from obfuscapk import util
+from obfuscapk.const_string_tracker import ConstStringTracker
+from obfuscapk.dex_capacity_planner import DexCapacityPlanner
 from obfuscapk.main import check_external_tool_dependencies, perform_obfuscation
 from obfuscapk.obfuscation import Obfuscation
+from obfuscapk.obfuscation_stats import ObfuscationStats
+from obfuscapk.obfuscator_manager import ObfuscatorManager
+from obfuscapk.obfuscators.arithmetic_branch.arithmetic_branch import ArithmeticBranch
+from obfuscapk.obfuscators.call_indirection.call_indirection import CallIndirection
+from obfuscapk.obfuscators.const_string_encryption.const_string_encryption import (
+    ConstStringEncryption,
+)
+from obfuscapk.obfuscators.goto.goto import Goto
+from obfuscapk.obfuscators.lib_encryption.lib_encryption import LibEncryption
+from obfuscapk.obfuscators.nop.nop import Nop
+from obfuscapk.obfuscators.res_string_encryption.res_string_encryption import (
+    ResStringEncryption,
+)
+from obfuscapk.package_trie import PackagePrefixTrie
+from obfuscapk.resource_table import ResourceTable
+from obfuscapk.rename_mapping import RenameMapping
+from obfuscapk.smali_lexer import SmaliLineKind, classify_line
+from obfuscapk.smali_method_index import SmaliMethodIndex
 from obfuscapk.tool import Apktool
+from obfuscapk.xml_rewriter import StreamingXmlRewriter
 
 # noinspection PyUnresolvedReferences
 from test.test_fixtures import (
     tmp_working_directory_path,
     tmp_demo_apk_v10_original_path,
     tmp_demo_apk_v10_rebuild_path,
+    synthetic_decoded_files,
 )
 
 
@@ -160,6 +187,332 @@ class TestObfuscation(object):
         with pytest.raises(Exception):
             obfuscation.decode_apk()
 
+    def test_obfuscation_identifier_hasher_collision(
+        self, tmp_demo_apk_v10_original_path: str
+    ):
+        obfuscation = Obfuscation(tmp_demo_apk_v10_original_path)
+        identifier_hasher = obfuscation.get_identifier_hasher()
+
+        # The md5 digests of "id7369" and "id15315" have the same first 8 characters.
+        names = identifier_hasher.get_names("p", ["id15315", "id7369", "id7369"])
+        assert names == {"id15315": "pe3514a3a", "id7369": "pe3514a3a8"}
+        assert identifier_hasher.get_name("p", "id7369") == "pe3514a3a8"
+        assert identifier_hasher.get_name("f", "id7369") == "fe3514a3a"
+        assert identifier_hasher.collisions == 1
+
+    def test_dex_capacity_planner_weights(self):
+        planner = DexCapacityPlanner({"CallIndirection": 2})
+        planner.add_obfuscator("CallIndirection", True, False)
+        planner.add_obfuscator("FieldRename", False, True)
+        planner.add_obfuscator("MethodOverload", True, False)
+
+        planner.start_obfuscator("CallIndirection")
+        assert planner.get_method_budget(900) == 600
+        assert planner.get_method_budget([900, 90]) == [600, 60]
+
+        # The capacity not used by the previous obfuscators is given back.
+        planner.start_obfuscator("FieldRename")
+        assert planner.get_field_budget(500) == 500
+        planner.start_obfuscator("MethodOverload")
+        assert planner.get_method_budget(800) == 800
+
+    def test_dex_capacity_planner_invalid_weight(self):
+        with pytest.raises(ValueError):
+            DexCapacityPlanner({"CallIndirection": 0})
+        with pytest.raises(ValueError):
+            DexCapacityPlanner({"CallIndirection": float("nan")})
+
+    def test_call_indirection_wrapper_cache(self):
+        call_indirection = CallIndirection()
+        call_indirection.wrapper_cache_size = 1
+        wrapper_cache = OrderedDict()
+        new_method = StringIO()
+        out_file = StringIO()
+
+        def change_call(invoke_method: str) -> bool:
+            return call_indirection.change_method_call(
+                "invoke-virtual",
+                "p0",
+                "Lcom/test/Test;",
+                invoke_method,
+                "",
+                "V",
+                "Lcom/test/Test;",
+                new_method,
+                out_file,
+                wrapper_cache,
+            )
+
+        # The second call to the same method reuses the wrapper.
+        assert change_call("first") is True
+        assert change_call("first") is False
+        assert new_method.getvalue().count(".method ") == 1
+
+        # With a cache of size 1, the wrapper of the first method is evicted.
+        assert change_call("second") is True
+        assert len(wrapper_cache) == 1
+        assert change_call("first") is True
+        assert new_method.getvalue().count(".method ") == 3
+
+        # The reused wrappers are invoked with the same name.
+        invocations = out_file.getvalue().splitlines()
+        assert invocations[0] == invocations[1]
+        assert invocations[0] != invocations[3]
+
+    def test_streaming_xml_rewriter(self, tmp_working_directory_path: str):
+        xml_file = os.path.join(tmp_working_directory_path, "strings.xml")
+        with open(xml_file, "w", encoding="utf-8") as file:
+            file.write(
+                '<?xml version="1.0" encoding="utf-8"?>\n'
+                "<resources>\n"
+                "    <!-- Not changed. -->\n"
+                '    <string name="empty"/>\n'
+                '    <string name="cdata"><![CDATA[<b>bold</b>]]></string>\n'
+                "    <string name='plain'>hello</string>\n"
+                '    <item type="id" name="old" />\n'
+                "</resources>\n"
+            )
+        os.chmod(xml_file, 0o644)
+
+        def new_text(tag, attributes, text, _):
+            if tag == "string":
+                return (text or attributes["name"]).upper()
+
+        def new_attributes(tag, *_):
+            if tag == "item":
+                return {"name": "new", "format": "integer"}
+
+        rewriter = StreamingXmlRewriter(new_text, new_attributes)
+        assert rewriter.rewrite(xml_file) is True
+        with open(xml_file, "r", encoding="utf-8") as file:
+            assert file.read() == (
+                '<?xml version="1.0" encoding="utf-8"?>\n'
+                "<resources>\n"
+                "    <!-- Not changed. -->\n"
+                '    <string name="empty">EMPTY</string>\n'
+                '    <string name="cdata">&lt;B&gt;BOLD&lt;/B&gt;</string>\n'
+                "    <string name='plain'>HELLO</string>\n"
+                '    <item type="id" name="new" format="integer"/>\n'
+                "</resources>\n"
+            )
+        assert os.stat(xml_file).st_mode & 0o777 == 0o644
+
+        # A file without any change is not written again.
+        inode = os.stat(xml_file).st_ino
+        rewriter = StreamingXmlRewriter(lambda _, __, text, ___: text)
+        assert rewriter.rewrite(xml_file) is False
+        assert os.stat(xml_file).st_ino == inode
+
+    def test_res_string_encryption_per_locale(self, tmp_working_directory_path: str):
+        concurrent_res = os.path.join(tmp_working_directory_path, "concurrent", "res")
+        sequential_res = os.path.join(tmp_working_directory_path, "sequential", "res")
+        for locale in ("values", "values-it", "values-fr"):
+            os.makedirs(os.path.join(concurrent_res, locale))
+            with open(
+                os.path.join(concurrent_res, locale, "strings.xml"),
+                "w",
+                encoding="utf-8",
+            ) as file:
+                file.write(
+                    "<resources>\n"
+                    '    <string name="title">Title {0}</string>\n'
+                    '    <string name="plain">Not encrypted</string>\n'
+                    "</resources>\n".format(locale)
+                )
+            with open(
+                os.path.join(concurrent_res, locale, "arrays.xml"),
+                "w",
+                encoding="utf-8",
+            ) as file:
+                file.write(
+                    "<resources>\n"
+                    '    <string-array name="days">\n'
+                    "        <item>Monday {0}</item>\n"
+                    "    </string-array>\n"
+                    "</resources>\n".format(locale)
+                )
+        shutil.copytree(concurrent_res, sequential_res)
+
+        string_names = frozenset(["title"])
+        string_array_names = frozenset(["days"])
+        obfuscator = ResStringEncryption()
+
+        # The locales are encrypted concurrently.
+        obfuscator.encrypt_resources_per_locale(
+            ResourceTable(concurrent_res), string_names, string_array_names
+        )
+
+        # The same files encrypted one at a time.
+        resource_table = ResourceTable(sequential_res)
+        for xml_file in resource_table.get_value_files_for_names(
+            "string", string_names
+        ):
+            obfuscator.encrypt_string_resources(xml_file, string_names)
+        for xml_file in resource_table.get_value_files_for_names(
+            "array", string_array_names
+        ):
+            obfuscator.encrypt_string_array_resources(xml_file, string_array_names)
+
+        for locale in ("values", "values-it", "values-fr"):
+            for xml_file in ("strings.xml", "arrays.xml"):
+                assert filecmp.cmp(
+                    os.path.join(concurrent_res, locale, xml_file),
+                    os.path.join(sequential_res, locale, xml_file),
+                    shallow=False,
+                )
+        with open(
+            os.path.join(concurrent_res, "values-it", "strings.xml"), encoding="utf-8"
+        ) as file:
+            strings_xml = file.read()
+        assert "Title" not in strings_xml and "Not encrypted" in strings_xml
+
+    def test_smali_lexer_classify_line(self):
+        invoke_line = classify_line(
+            "    invoke-virtual {p0, v0}, Lcom/app/A;->run(Ljava/lang/String;)Z\n"
+        )
+        assert invoke_line.kind is SmaliLineKind.INVOKE
+        assert invoke_line.opcode == "invoke-virtual"
+        assert invoke_line.registers == "p0, v0"
+        assert invoke_line.get_method_reference() == (
+            "Lcom/app/A;->run(Ljava/lang/String;)Z"
+        )
+
+        field_line = classify_line(".field private static count:I\n")
+        assert field_line.kind is SmaliLineKind.FIELD
+        assert field_line.get_field_reference("Lcom/app/A;") == "Lcom/app/A;->count:I"
+
+        string_line = classify_line('    const-string v1, "value = 1"\n')
+        assert string_line.kind is SmaliLineKind.CONST_STRING
+        assert string_line.literal == "value = 1"
+
+        assert classify_line(".end method\n").kind is SmaliLineKind.END_METHOD
+        assert classify_line("    move-result v0\n").opcode == "move-result"
+
+    def test_obfuscator_manager_loads_only_selected_obfuscators(self):
+        manager = ObfuscatorManager()
+        assert "Nop" in manager.get_obfuscators_names()
+        assert manager.get_obfuscator_category("Nop") == "Code"
+
+        obfuscators = manager.get_obfuscators(["Nop", "Goto"])
+        assert sorted(ob.name for ob in obfuscators) == ["Goto", "Nop"]
+        assert all(ob.category == "Code" for ob in obfuscators)
+        assert len(manager.manager.getAllPlugins()) == 2
+
+    def test_obfuscator_manager_descriptor_without_category(
+        self, tmp_working_directory_path: str, monkeypatch
+    ):
+        for name, category in (("First", "Code"), ("Second", None), ("Third", "Code")):
+            descriptor = "[Core]\nName = {0}\nModule = {1}\n".format(name, name.lower())
+            if category:
+                descriptor += "Category = {0}\n".format(category)
+            descriptor_file = os.path.join(
+                tmp_working_directory_path, "{0}.obfuscator".format(name.lower())
+            )
+            with open(descriptor_file, "w", encoding="utf-8") as file:
+                file.write(descriptor)
+        monkeypatch.setattr(
+            ObfuscatorManager, "obfuscators_dir", tmp_working_directory_path
+        )
+
+        manager = ObfuscatorManager()
+        assert manager.get_obfuscator_category("Second") == "Other"
+        assert manager.get_obfuscators_names() == ["First", "Third", "Second"]
+
+    def test_android_class_names_api_level(self):
+        android_class_names = util.get_android_class_names()
+        assert "Landroid/app/Activity;" in android_class_names
+        # The class names of each API level are read only once.
+        assert util.get_android_class_names(27) is android_class_names
+        with pytest.raises(FileNotFoundError):
+            util.get_android_class_names(1)
+
+    def test_const_string_tracker(self):
+        tracker = ConstStringTracker()
+        for line in (
+            ".method public load()V\n",
+            '    const-string v0, "first.txt"\n',
+            '    const-string v1, "second.txt"\n',
+            "    :try_start_0\n",
+            "    const-wide/16 v1, 0x0\n",
+        ):
+            tracker.update(line)
+
+        assert tracker.get_string("v0") == "first.txt"
+        # The wide constant overwrites v1 and v2.
+        assert tracker.get_string("v1") is None
+        assert tracker.get_strings("p0, v0") == [None, "first.txt"]
+        assert tracker.get_strings("v0 .. v1") == ["first.txt", None]
+
+        # The registers could hold other values when jumping to a label.
+        tracker.update("    :cond_0\n")
+        assert tracker.get_string("v0") is None
+
+    def test_smali_method_index(self):
+        lines = [
+            ".class public Lcom/app/A;\n",
+            "# direct methods\n",
+            ".method static constructor <clinit>()V\n",
+            "    .locals 1\n",
+            "    :try_start_0\n",
+            "    nop\n",
+            "    :try_end_0\n",
+            "    return-void\n",
+            ".end method\n",
+            "# virtual methods\n",
+            ".method public abstract run()V\n",
+            ".end method\n",
+        ]
+        method_index = SmaliMethodIndex(lines)
+        assert method_index.sections == {"direct methods": 1, "virtual methods": 9}
+
+        constructor, abstract_method = method_index.methods
+        assert method_index.get_static_constructor() is constructor
+        assert (constructor.start, constructor.end) == (2, 8)
+        assert (constructor.locals_line, constructor.local_count) == (3, 1)
+        assert constructor.try_blocks == [(4, 6)]
+        assert constructor.is_in_try_block(5)
+        assert not constructor.is_in_try_block(4)
+        assert not constructor.is_in_try_block(7)
+        assert not abstract_method.has_code
+        assert method_index.get_method_at(7) is constructor
+        assert method_index.get_method_at(9) is None
+        assert method_index.get_method_at(11) is abstract_method
+
+    def test_obfuscation_stats_nested_steps(self):
+        stats = ObfuscationStats()
+        with stats.measure("Nop", "obfuscator", lambda: (10, 5)):
+            # The first obfuscator decodes the application.
+            with stats.measure("decode", "decode", lambda: (8, 5)):
+                pass
+
+        decode_step, obfuscator_step = stats.steps
+        assert decode_step["name"] == "decode"
+        assert (decode_step["methods"], decode_step["methods_delta"]) == (8, None)
+        assert obfuscator_step["methods_delta"] == 2
+        assert obfuscator_step["fields_delta"] == 0
+        assert obfuscator_step["wall_time"] >= 0
+        assert stats.get_report()["steps"] == stats.steps
+
+        # The opened files are counted only while a step is measured.
+        files_read = stats.get_report()["total"]["files_read"]
+        with open(__file__, "rb"):
+            pass
+        assert stats.get_report()["total"]["files_read"] == files_read
+
+    def test_package_prefix_trie(self):
+        trie = PackagePrefixTrie()
+        trie.add("Landroid/support/", "library")
+        trie.add("Lcom/example", "ignored")
+
+        assert trie.get_label("Landroid/support/v4/app/Fragment;") == "library"
+        assert "Landroid/supportx/Fragment;" not in trie
+        assert "Landroid/support" not in trie
+
+        # A prefix without a trailing "/" matches like str.startswith.
+        assert trie.get_label("Lcom/example/MainActivity;") == "ignored"
+        assert trie.get_label("Lcom/examples/MainActivity;") == "ignored"
+        assert "Lcom/exampl/MainActivity;" not in trie
+
     def test_obfuscation_remaining_fields_per_obfuscator(
         self, tmp_demo_apk_v10_original_path: str
     ):
@@ -329,6 +682,214 @@ class TestObfuscation(object):
         # This test application is not multidex.
         assert len(smali_files) == 0
 
+    def test_get_dex_smali_stats(self, tmp_demo_apk_v10_original_path: str):
+        obfuscation = Obfuscation(tmp_demo_apk_v10_original_path)
+        dex_smali_stats = obfuscation.get_dex_smali_stats()
+        # This test application has a single dex file.
+        assert len(dex_smali_stats) == 1
+        assert dex_smali_stats[0][0] == len(obfuscation.get_smali_files())
+        assert dex_smali_stats[0][1] > 0
+
+    def test_split_dex_files(
+        self,
+        tmp_working_directory_path: str,
+        tmp_demo_apk_v10_original_path: str,
+        synthetic_decoded_files: dict,
+    ):
+        # A single dex with 3 classes declaring 2 methods each.
+        for class_name in ("A", "B", "C"):
+            smali_file = "smali/com/app/{0}.smali".format(class_name)
+            synthetic_decoded_files[smali_file] = (
+                ".class public Lcom/app/{0};\n"
+                ".super Ljava/lang/Object;\n\n"
+                ".method public first()V\n"
+                "    return-void\n"
+                ".end method\n\n"
+                ".method public second()V\n"
+                "    return-void\n"
+                ".end method\n".format(class_name)
+            )
+
+        obfuscation = Obfuscation(
+            tmp_demo_apk_v10_original_path, tmp_working_directory_path, split_dex=True
+        )
+        obfuscation.dex_reference_limit = 3
+        obfuscation.split_dex_files()
+
+        # B and C are moved to smali_classes2, which is still over the limit, so C
+        # is moved again to smali_classes3.
+        decoded_path = obfuscation._decoded_apk_path
+        expected_smali_files = [
+            [os.path.join(decoded_path, "smali", "com", "app", "A.smali")],
+            [os.path.join(decoded_path, "smali_classes2", "com", "app", "B.smali")],
+            [os.path.join(decoded_path, "smali_classes3", "com", "app", "C.smali")],
+        ]
+        assert obfuscation.is_multidex()
+        assert obfuscation.get_multidex_smali_files() == expected_smali_files
+        assert obfuscation.get_smali_files() == sum(expected_smali_files, [])
+        assert all(
+            os.path.isfile(smali_file) for smali_file in obfuscation.get_smali_files()
+        )
+        assert [stats[0] for stats in obfuscation.get_dex_smali_stats()] == [1, 1, 1]
+
+    def test_lib_encryption_unresolved_library_name(
+        self,
+        tmp_working_directory_path: str,
+        tmp_demo_apk_v10_original_path: str,
+        synthetic_decoded_files: dict,
+    ):
+        static_constructor = (
+            ".class public Lcom/app/{0};\n"
+            ".super Ljava/lang/Object;\n\n"
+            ".method static constructor <clinit>()V\n"
+            "    .locals 1\n\n"
+            '    const-string v0, "{1}"\n\n'
+            "{2}"
+            "    invoke-static {{v0}}, "
+            "Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V\n\n"
+            "    return-void\n"
+            ".end method\n"
+        )
+        smali_files = {
+            "Direct": static_constructor.format("Direct", "direct", ""),
+            # v0 could hold another value when jumping to the label.
+            "Label": static_constructor.format("Label", "label", "    :cond_0\n"),
+        }
+
+        for class_name, smali_code in smali_files.items():
+            smali_file = "smali/com/app/{0}.smali".format(class_name)
+            native_lib = "lib/armeabi-v7a/lib{0}.so".format(class_name.lower())
+            synthetic_decoded_files[smali_file] = smali_code
+            synthetic_decoded_files[native_lib] = b"\x7fELF"
+
+        obfuscation = Obfuscation(
+            tmp_demo_apk_v10_original_path, tmp_working_directory_path
+        )
+        LibEncryption().obfuscate(obfuscation)
+
+        smali_code = {}
+        for smali_file in obfuscation.get_smali_files():
+            with open(smali_file, "r", encoding="utf-8") as file:
+                smali_code[os.path.basename(smali_file)] = file.read()
+
+        assert ".locals 2" in smali_code["Direct.smali"]
+        assert "loadEncryptedLibrary" in smali_code["Direct.smali"]
+        assert smali_code["Label.smali"] == smali_files["Label"]
+        assert sorted(os.listdir(obfuscation.get_assets_directory())) == [
+            "lib.armeabi-v7a.direct.so"
+        ]
+        # The original libraries are kept for the load that was not replaced.
+        assert len(obfuscation.get_native_lib_files()) == 2
+        assert all(map(os.path.isfile, obfuscation.get_native_lib_files()))
+
+    def test_code_obfuscators_keep_windows_line_endings(
+        self,
+        tmp_working_directory_path: str,
+        tmp_demo_apk_v10_original_path: str,
+        synthetic_decoded_files: dict,
+    ):
+        smali_code = (
+            ".class public Lcom/app/Test;\n"
+            ".super Ljava/lang/Object;\n\n"
+            '.field private static final NAME:Ljava/lang/String; = "name"\n\n'
+            "# direct methods\n"
+            ".method public static test()Ljava/lang/String;\n"
+            "    .locals 2\n\n"
+            '    const-string v0, "test"\n\n'
+            "    const/4 v1, 0x1\n\n"
+            "    return-object v0\n"
+            ".end method\n"
+        )
+        smali_file = "smali/com/app/Test.smali"
+        synthetic_decoded_files[smali_file] = smali_code.replace("\n", "\r\n")
+
+        obfuscation = Obfuscation(
+            tmp_demo_apk_v10_original_path, tmp_working_directory_path
+        )
+        for obfuscator in (
+            ConstStringEncryption(),
+            ArithmeticBranch(),
+            Nop(),
+            Goto(),
+        ):
+            obfuscator.obfuscate(obfuscation)
+
+        smali_file = os.path.join(
+            obfuscation._decoded_apk_path, "smali", "com", "app", "Test.smali"
+        )
+        with open(smali_file, "rb") as file:
+            lines = file.read().splitlines(keepends=True)
+
+        assert b"\tnop\r\n" in lines
+        assert b"\t:before_first_instruction\r\n" in lines
+        assert b".method static constructor <clinit>()V\r\n" in lines
+        assert all(line.endswith(b"\r\n") for line in lines)
+
+    def test_perform_obfuscation_reuse_unchanged_classes(
+        self,
+        tmp_working_directory_path: str,
+        tmp_demo_apk_v10_original_path: str,
+        synthetic_decoded_files: dict,
+        monkeypatch,
+    ):
+        monkeypatch.setattr(
+            "obfuscapk.main.check_external_tool_dependencies", lambda: None
+        )
+        synthetic_decoded_files["AndroidManifest.xml"] = (
+            '<manifest package="com.app"><application /></manifest>\n'
+        )
+        for class_name in ("Unchanged", "Changed"):
+            smali_file = "smali/com/app/{0}.smali".format(class_name)
+            synthetic_decoded_files[smali_file] = (
+                ".class public Lcom/app/{0};\n"
+                ".super Ljava/lang/Object;\n\n"
+                ".method public run()V\n"
+                "    return-void\n"
+                ".end method\n".format(class_name)
+            )
+
+        obfuscators = ["ClassRename", "MethodRename"]
+        decoded_apk_name = os.path.splitext(
+            os.path.basename(tmp_demo_apk_v10_original_path)
+        )[0]
+        previous_working_dir = os.path.join(tmp_working_directory_path, "previous")
+        previous_output_dir = os.path.join(previous_working_dir, decoded_apk_name)
+        perform_obfuscation(
+            tmp_demo_apk_v10_original_path, obfuscators, previous_working_dir
+        )
+
+        # Mark the previous obfuscated files, to find the reused ones.
+        previous_smali_files = []
+        for root, _, file_names in os.walk(os.path.join(previous_output_dir, "smali")):
+            for file_name in file_names:
+                smali_file = os.path.join(root, file_name)
+                with open(smali_file, "a", encoding="utf-8") as file:
+                    file.write("# previous\n")
+                previous_smali_files.append(file_name)
+
+        synthetic_decoded_files["smali/com/app/Changed.smali"] += "\n"
+        working_dir = os.path.join(tmp_working_directory_path, "new")
+        perform_obfuscation(
+            tmp_demo_apk_v10_original_path,
+            obfuscators,
+            working_dir,
+            previous_mapping_file=os.path.join(previous_working_dir, "mapping.txt"),
+            previous_output_dir=previous_output_dir,
+        )
+
+        smali_code = {}
+        for root, _, file_names in os.walk(
+            os.path.join(working_dir, decoded_apk_name, "smali")
+        ):
+            for file_name in file_names:
+                smali_file = os.path.join(root, file_name)
+                with open(smali_file, "r", encoding="utf-8") as file:
+                    smali_code[file_name] = file.read()
+
+        # The same names are used, only the unchanged class is reused.
+        assert sorted(smali_code) == sorted(previous_smali_files)
+        assert sum(code.endswith("# previous\n") for code in smali_code.values()) == 1
+
     def test_get_native_lib_files(self, tmp_demo_apk_v10_original_path: str):
         obfuscation = Obfuscation(tmp_demo_apk_v10_original_path)
         native_libs = obfuscation.get_native_lib_files()
@@ -346,3 +907,32 @@ class TestObfuscation(object):
         resource_dir = obfuscation.get_resource_directory()
         assert os.path.isdir(resource_dir)
         assert "drawable" in os.listdir(resource_dir)
+
+    def test_get_resource_table(self, tmp_demo_apk_v10_original_path: str):
+        obfuscation = Obfuscation(tmp_demo_apk_v10_original_path)
+        resource_table = obfuscation.get_resource_table()
+        assert resource_table.get_name("string", "0x7f060001") == "app_name"
+        assert resource_table.get_id("string", "app_name") == 0x7F060001
+        assert len(resource_table.get_value_files("string", "app_name")) == 1
+        assert all(
+            os.path.isfile(layout_file)
+            for layout_file in resource_table.get_resource_files("layout")
+        )
+
+    def test_perform_obfuscation_rename_mapping(
+        self,
+        tmp_working_directory_path: str,
+        tmp_demo_apk_v10_original_path: str,
+    ):
+        mapping_file = os.path.join(tmp_working_directory_path, "mapping.txt")
+        perform_obfuscation(
+            tmp_demo_apk_v10_original_path,
+            ["ClassRename", "MethodRename", "FieldRename"],
+            tmp_working_directory_path,
+            mapping_file=mapping_file,
+            ignore_libs=True,
+        )
+        mapping = RenameMapping.load(mapping_file)
+        assert mapping.obfuscators == ["ClassRename", "MethodRename", "FieldRename"]
+        assert "Lcom/obfuscapk/demo/MainActivity;" in mapping.classes
+        assert "Lcom/obfuscapk/demo/MainActivity;" in mapping.class_files